@@ -0,0 +1,248 @@
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures.process import BrokenProcessPool
+
+import instrument
+import main6
+import model_cache
+
+SIZE_SUFFIXES = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+# rough peak RSS per rewrite, as a multiple of the input size (the builder is the only model-sized allocation)
+REBUILD_MEMORY_FACTOR = 1.2
+PATCH_MEMORY_FACTOR = 0.05
+
+
+def parse_size(text):
+    text = text.strip().upper().rstrip("B")
+    if text and text[-1] in SIZE_SUFFIXES:
+        return int(float(text[:-1]) * SIZE_SUFFIXES[text[-1]])
+    return int(text)
+
+
+def collect_jobs(source, out_dir):
+    """Pares (entrada, saída) de um diretório (*.tflite recursivo) ou de um manifesto.
+
+    O manifesto tem um modelo por linha: "entrada" ou "entrada saída"; linhas vazias e # são ignoradas.
+    """
+    jobs = []
+    if os.path.isdir(source):
+        for root, _, files in os.walk(source):
+            for name in sorted(files):
+                if name.endswith(".tflite"):
+                    path = os.path.join(root, name)
+                    jobs.append((path, os.path.join(out_dir, os.path.relpath(path, source))))
+        return sorted(jobs)
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            parts = line.split()
+            path = os.path.join(base, parts[0])
+            out = os.path.join(base, parts[1]) if len(parts) > 1 else os.path.join(out_dir, os.path.basename(path))
+            jobs.append((path, out))
+    return jobs
+
+
+def estimate_memory(path, patch):
+    return int(os.path.getsize(path) * (PATCH_MEMORY_FACTOR if patch else REBUILD_MEMORY_FACTOR))
+
+
+def rewrite_one(input_path, output_path, options):
+    # runs in a worker process: main6/tflite are imported once per worker, not once per model
+    log = io.StringIO()
+    start = time.perf_counter()
+    error = None
+    cache = None
+    scan = None
+    status = "ok"
+    recorder = instrument.PhaseRecorder() if options["profile"] else None
+
+    def rewrite(src, dst):
+        if options["patch"]:
+            main6.patch_keepdims(src, dst, recorder)
+        else:
+            main6.inject_keepdims(src, dst, options["external_threshold"], options["dedup"], 1,
+                                  options["strip_names"], recorder, alignment=options["alignment"],
+                                  remove_reshapes=options["remove_reshapes"], infer_shapes=options["infer_shapes"],
+                                  remove_dead=options["remove_dead"], compress_weights=options["compress_weights"])
+
+    try:
+        with contextlib.redirect_stdout(log):
+            if options["scan"] or options["skip_compliant"]:
+                scan = main6.scan_keepdims(input_path, recorder)
+                if options["scan"] or scan["compliant"]:
+                    status = "scanned" if options["scan"] else "skipped"
+            if status == "ok":
+                os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+                if options["cache_dir"]:
+                    config = main6.cache_config(options["patch"], options["external_threshold"], options["dedup"],
+                                                options["strip_names"], alignment=options["alignment"],
+                                                remove_reshapes=options["remove_reshapes"],
+                                                infer_shapes=options["infer_shapes"],
+                                                remove_dead=options["remove_dead"],
+                                                compress_weights=options["compress_weights"])
+                    hit = model_cache.cached_rewrite(rewrite, input_path, output_path, config,
+                                                     options["cache_dir"], options["cache_size"],
+                                                     options["cache_link"])
+                    cache = "hit" if hit else "miss"
+                else:
+                    rewrite(input_path, output_path)
+    except Exception as e:
+        error = "%s: %s" % (type(e).__name__, e)
+    return {
+        "input": input_path,
+        "output": output_path,
+        "status": "error" if error else status,
+        "error": error,
+        "cache": cache,
+        "seconds": round(time.perf_counter() - start, 4),
+        "input_bytes": os.path.getsize(input_path),
+        "output_bytes": (os.path.getsize(output_path)
+                         if status == "ok" and not error and os.path.exists(output_path) else None),
+        "scan": scan,
+        "log": log.getvalue().strip(),
+        "phases": recorder.totals() if recorder else None,
+    }
+
+
+def crash_result(input_path, output_path, error):
+    return {"input": input_path, "output": output_path, "status": "error", "error": error, "cache": None,
+            "seconds": None, "input_bytes": os.path.getsize(input_path), "output_bytes": None, "scan": None,
+            "log": "", "phases": None}
+
+
+def run_batch(jobs, options, workers=None, memory_budget=None):
+    """Executa os jobs num pool de processos sem passar do orçamento de memória estimado.
+
+    Um job só é despachado se couber no orçamento junto com os que já estão rodando;
+    um job maior que o orçamento inteiro roda sozinho. Se um worker morre (segfault, OOM
+    kill) o pool quebra: os jobs que estavam rodando voltam para a fila, cada um sozinho num
+    pool novo, e só o que derrubar o worker rodando sozinho vira erro; o resto do lote segue.
+    """
+    workers = workers or os.cpu_count() or 1
+    # (input, output, estimated memory, run alone): a scan only touches the metadata pages, like the patch mode
+    pending = deque((path, out, estimate_memory(path, options["patch"] or options["scan"]), False)
+                    for path, out in jobs)
+    running = {}
+    in_flight = 0
+    results = []
+    pool = None
+    try:
+        while pending or running:
+            if pool is None:
+                pool = concurrent.futures.ProcessPoolExecutor(workers)
+            while pending and len(running) < workers:
+                path, out, est, alone = pending[0]
+                if running and (alone or any(job[3] for job in running.values())
+                                or memory_budget is not None and in_flight + est > memory_budget):
+                    break
+                try:
+                    fut = pool.submit(rewrite_one, path, out, options)
+                except BrokenProcessPool:
+                    break  # a worker died since the last wait: the running futures report it below
+                pending.popleft()
+                running[fut] = (path, out, est, alone)
+                in_flight += est
+                if alone:
+                    break
+            if not running:
+                pool.shutdown(wait=True)
+                pool = None
+                continue
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            if any(isinstance(fut.exception(), BrokenProcessPool) for fut in done):
+                # every job still on the dead pool fails with it; wait for the pool to settle them all
+                pool.shutdown(wait=True, cancel_futures=True)
+                pool = None
+                done = list(running)
+            lost = []
+            for fut in done:
+                job = running.pop(fut)
+                in_flight -= job[2]
+                if isinstance(fut.exception(), BrokenProcessPool):
+                    lost.append(job)
+                    continue
+                results.append(fut.result())
+                print("[%s] %s (%.2fs)" % (results[-1]["status"], results[-1]["input"], results[-1]["seconds"]))
+            if len(lost) == 1 or any(job[3] for job in lost):
+                for path, out, _, _ in lost:
+                    results.append(crash_result(path, out, "worker process died while rewriting this model"))
+                    print("[error] %s (worker process died)" % path)
+            else:
+                # can't tell which one killed the worker: retry each alone
+                pending.extendleft((path, out, est, True) for path, out, est, _ in reversed(lost))
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+    order = {path: i for i, (path, _) in enumerate(jobs)}
+    return sorted(results, key=lambda r: order[r["input"]])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the keep_num_dims rewrite over many models in parallel.")
+    parser.add_argument("source", help="directory searched for *.tflite, or a manifest file")
+    parser.add_argument("out_dir", help="output directory (keeps the layout of a source directory)")
+    parser.add_argument("--workers", type=int, help="worker processes (default: all cores)")
+    parser.add_argument("--memory-budget", type=parse_size, metavar="SIZE",
+                        help="max estimated memory of concurrent rewrites, e.g. 6G")
+    parser.add_argument("--summary", help="per-model JSON report (default: OUT_DIR/summary.json)")
+    parser.add_argument("--patch", action="store_true", help="use the in-place patch mode")
+    parser.add_argument("--scan", action="store_true",
+                        help="only report FULLY_CONNECTED ops and keep_num_dims per model; write no models")
+    parser.add_argument("--skip-compliant", action="store_true",
+                        help="don't rewrite models whose FULLY_CONNECTED ops all have keep_num_dims=1")
+    parser.add_argument("--dedup", action="store_true", help="deduplicate identical weight buffers")
+    parser.add_argument("--strip-names", action="store_true", help="drop tensor and subgraph names (rebuild only)")
+    parser.add_argument("--external-weights", type=int, metavar="BYTES",
+                        help="store buffers of at least BYTES after the flatbuffer")
+    parser.add_argument("--remove-reshapes", action="store_true",
+                        help="drop the RESHAPE ops keep_num_dims makes redundant (rebuild only)")
+    parser.add_argument("--infer-shapes", action="store_true",
+                        help="rewrite tensor shapes to match keep_num_dims (rebuild only)")
+    parser.add_argument("--remove-dead", action="store_true",
+                        help="drop operators, tensors, buffers and opcodes no output needs (rebuild only)")
+    parser.add_argument("--compress-weights", choices=main6.CompressWeights.MODES,
+                        help="store FC/CONV weights as float16 or per-channel int8 (rebuild only)")
+    parser.add_argument("--alignment", type=int, default=main6.WEIGHT_ALIGNMENT, metavar="BYTES",
+                        help="start every weight buffer on this boundary, a power of two (default %(default)s)")
+    parser.add_argument("--profile", action="store_true", help="add per-phase timings to the summary")
+    parser.add_argument("--cache-dir", help="reuse outputs of earlier runs with the same input and options")
+    parser.add_argument("--cache-size", type=parse_size, metavar="SIZE",
+                        help="evict least recently used cache entries past this, e.g. 50G")
+    parser.add_argument("--cache-link", action="store_true",
+                        help="hardlink cache hits instead of copying them (outputs must not be modified in place)")
+    args = parser.parse_args()
+    try:
+        main6.check_alignment(args.alignment)
+    except ValueError as e:
+        parser.error(str(e))
+
+    jobs = collect_jobs(args.source, args.out_dir)
+    options = {"patch": args.patch, "scan": args.scan, "skip_compliant": args.skip_compliant, "dedup": args.dedup,
+               "external_threshold": args.external_weights, "strip_names": args.strip_names,
+               "alignment": args.alignment, "remove_reshapes": args.remove_reshapes,
+               "infer_shapes": args.infer_shapes, "remove_dead": args.remove_dead,
+               "compress_weights": args.compress_weights, "profile": args.profile,
+               "cache_dir": args.cache_dir, "cache_size": args.cache_size, "cache_link": args.cache_link}
+    results = run_batch(jobs, options, args.workers, args.memory_budget)
+    summary = args.summary or os.path.join(args.out_dir, "summary.json")
+    os.makedirs(os.path.dirname(os.path.abspath(summary)), exist_ok=True)
+    with open(summary, "w") as f:
+        json.dump(results, f, indent=2)
+    failed = sum(r["status"] == "error" for r in results)
+    if args.scan:
+        compliant = sum(bool(r["scan"] and r["scan"]["compliant"]) for r in results)
+        print("%d models, %d compliant, %d need a rewrite, %d failed. Summary: %s"
+              % (len(results), compliant, len(results) - compliant - failed, failed, summary))
+    else:
+        print("%d models, %d failed. Summary: %s" % (len(results), failed, summary))
+    sys.exit(1 if failed else 0)
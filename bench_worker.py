@@ -0,0 +1,36 @@
+# Processo de medição do benchmark.py: importa só a biblioteca padrão e o módulo medido, para que
+# o tempo de processo e o pico de RSS sejam do entry point e não dos imports do próprio benchmark.
+# Uso: python bench_worker.py MODULE FUNCTION input.tflite output.tflite
+
+import contextlib
+import importlib
+import json
+import os
+import resource
+import sys
+import time
+
+
+def peak_rss():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def run_worker(module, func, input_path, output_path):
+    fn = getattr(importlib.import_module(module), func)
+    start = time.perf_counter()
+    error = None
+    try:
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            fn(input_path, output_path)
+    except BaseException as e:
+        error = "%s: %s" % (type(e).__name__, e)
+    end = time.perf_counter()
+    print(json.dumps({"seconds": end - start, "peak_rss": peak_rss(), "error": error}))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 5:
+        print("Uso: python bench_worker.py MODULE FUNCTION input.tflite output.tflite")
+        sys.exit(1)
+    run_worker(*sys.argv[1:])
@@ -0,0 +1,308 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import flatbuffers
+import numpy as np
+
+import graph_ir
+import main6
+from bindings import tfl as tflite
+
+# name -> (module, function(input_path, output_path))
+ENTRY_POINTS = {
+    "main": ("main", "main"),
+    "main2": ("main2", "inject_keep_num_dims"),
+    "main3": ("main3", "inject"),
+    "main5": ("main5", "inject_keepdims"),
+    "main6": ("main6", "inject_keepdims"),
+}
+# op count, share of FULLY_CONNECTED ops, weight buffers, total weight bytes
+SUITES = {
+    "small": [
+        {"name": "ops100_w1m", "ops": 100, "fc_share": 0.5, "buffers": 50, "weight_bytes": 1 << 20},
+        {"name": "ops2k_w16m", "ops": 2000, "fc_share": 0.3, "buffers": 600, "weight_bytes": 16 << 20},
+    ],
+    "medium": [
+        {"name": "ops20k_w64m", "ops": 20000, "fc_share": 0.3, "buffers": 6000, "weight_bytes": 64 << 20},
+        {"name": "ops1k_w512m", "ops": 1000, "fc_share": 0.8, "buffers": 800, "weight_bytes": 512 << 20},
+    ],
+    "large": [
+        {"name": "ops100k_w1g", "ops": 100000, "fc_share": 0.3, "buffers": 30000, "weight_bytes": 1 << 30},
+        {"name": "ops4k_w3g", "ops": 4000, "fc_share": 0.8, "buffers": 3200, "weight_bytes": 3 << 30},
+    ],
+}
+WORKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_worker.py")
+ACTIVATION_WIDTH = 64
+DEFAULT_THRESHOLD = 0.25
+# leading bytes of every buffer compared between input and output
+CHECK_BYTES = 64
+
+
+def fc_at(i, fc_share):
+    # spreads the FULLY_CONNECTED ops evenly through the chain
+    return int((i + 1) * fc_share) > int(i * fc_share)
+
+
+def generate_model(path, ops, fc_share, buffers, weight_bytes, seed=0):
+    """Modelo sintético: uma cadeia de `ops` operadores (FULLY_CONNECTED ou ADD) com `buffers` pesos.
+
+    Os pesos somam weight_bytes; acima do limite de 2 GB do flatbuffer eles vão para depois
+    do arquivo (Buffer.offset/size), como no rebuild do main6. Não é feito para rodar no
+    interpretador, só para exercitar os rewrites com a forma e o tamanho desejados.
+    """
+    buffers = max(1, buffers)
+    size = max(4, weight_bytes // buffers // 4 * 4)
+    # one random block; buffer i starts i floats into it, so no two buffers are identical
+    pattern = np.random.default_rng(seed).standard_normal(size // 4 + buffers).astype(np.float32)
+    pattern = memoryview(pattern).cast("B")
+    views = [pattern[i * 4:i * 4 + size] for i in range(buffers)]
+    external_threshold = main6.EXTERNAL_DEFAULT_THRESHOLD if size * buffers >= main6.EXTERNAL_AUTO_SIZE else None
+    inline = 0 if external_threshold else size * buffers
+    b = flatbuffers.Builder(inline + 16 * buffers + 256 * (ops + buffers) + 1024)
+
+    buffer_offs = [main6.create_buffer(b, None)]
+    external = []
+    for view in views:
+        if main6.is_external(view, external_threshold):
+            buffer_offs.append(main6.create_external_buffer(b, len(view)))
+            external.append((buffer_offs[-1], view))
+        else:
+            buffer_offs.append(main6.create_buffer(b, view))
+    builtin_fc, options_fc = main6.fc_enums()
+    builtin_add = main6.enum_value("BuiltinOperator_ADD", "BuiltinOperator", "ADD")
+    options_add = main6.enum_value("BuiltinOptions_AddOptions", "BuiltinOptions", "AddOptions")
+    opcode_offs = [main6.emit_opcode(b, {"builtin_code": code, "version": 1, "custom_code": None})
+                   for code in (builtin_fc, builtin_add)]
+
+    width = ACTIVATION_WIDTH
+    rows = max(1, size // 4 // width)
+    tensor_offs = []
+
+    def tensor(name, shape, buffer):
+        tensor_offs.append(main6.emit_tensor(b, {"name": name, "shape": shape, "type": 0, "buffer": buffer}))
+        return len(tensor_offs) - 1
+
+    weights = [tensor("bench/weight_%d" % i, [rows, width], i + 1) for i in range(buffers)]
+    prev = first = tensor("bench/input", [1, width], 0)
+    op_offs = []
+    n_fc = 0
+    for i in range(ops):
+        out = tensor("bench/op_%d/out" % i, [1, width], 0)
+        if fc_at(i, fc_share):
+            tflite.FullyConnectedOptions.FullyConnectedOptionsStart(b)
+            options = tflite.FullyConnectedOptions.FullyConnectedOptionsEnd(b)
+            fields = {"opcode_index": 0, "inputs": [prev, weights[n_fc % buffers], -1],
+                      "options_type": options_fc, "options": lambda builder, off=options: off}
+            n_fc += 1
+        else:
+            tflite.AddOptions.AddOptionsStart(b)
+            options = tflite.AddOptions.AddOptionsEnd(b)
+            fields = {"opcode_index": 1, "inputs": [prev, prev],
+                      "options_type": options_add, "options": lambda builder, off=options: off}
+        fields["outputs"] = [out]
+        op_offs.append(main6.emit_operator(b, fields))
+        prev = out
+
+    tensors_vec = main6.create_offset_vector(b, tensor_offs)
+    ops_vec = main6.create_offset_vector(b, op_offs)
+    in_graph = main6.vec_int(b, [first])
+    out_graph = main6.vec_int(b, [prev])
+    name_sg = main6.create_string(b, "main")
+    tflite.SubGraph.SubGraphStart(b)
+    tflite.SubGraph.SubGraphAddTensors(b, tensors_vec)
+    tflite.SubGraph.SubGraphAddInputs(b, in_graph)
+    tflite.SubGraph.SubGraphAddOutputs(b, out_graph)
+    tflite.SubGraph.SubGraphAddOperators(b, ops_vec)
+    tflite.SubGraph.SubGraphAddName(b, name_sg)
+    subgraph = tflite.SubGraph.SubGraphEnd(b)
+    opcodes_vec = main6.create_offset_vector(b, opcode_offs)
+    subgraphs_vec = main6.create_offset_vector(b, [subgraph])
+    buffers_vec = main6.create_offset_vector(b, buffer_offs)
+    description = b.CreateString("benchmark model")
+    tflite.Model.ModelStart(b)
+    tflite.Model.ModelAddVersion(b, 3)
+    tflite.Model.ModelAddOperatorCodes(b, opcodes_vec)
+    tflite.Model.ModelAddSubgraphs(b, subgraphs_vec)
+    tflite.Model.ModelAddBuffers(b, buffers_vec)
+    tflite.Model.ModelAddDescription(b, description)
+    b.Finish(tflite.Model.ModelEnd(b), b"TFL3")
+    main6.write_builder(b, path, external)
+
+
+def check_output(input_path, output_path):
+    """Problemas da saída de um entry point contra a entrada ([] = reescrita válida).
+
+    Confere o identificador do arquivo, os opcodes (builtin_code e deprecated_builtin_code),
+    a sequência de operadores de cada subgraph, keep_num_dims=1 em todo FULLY_CONNECTED e o
+    tamanho, a posição e os primeiros bytes de cada buffer (inline ou externo).
+    """
+    src_data, out_data = main6.map_file(input_path), main6.map_file(output_path)
+    try:
+        return output_problems(src_data, out_data)
+    finally:
+        src_data.close()
+        out_data.close()
+
+
+def output_problems(src_data, out_data):
+    if out_data[4:8] != b"TFL3":
+        return ["missing TFL3 file identifier"]
+    try:
+        src, out = graph_ir.build_ir(src_data), graph_ir.build_ir(out_data)
+    except (IndexError, ValueError) as e:
+        return ["unreadable output: %s" % e]
+    problems = []
+    buf = np.frombuffer(out_data, dtype=np.uint8)
+    opcodes = graph_ir.table_vector(buf, graph_ir.offset_field(buf, [graph_ir.root_table(buf)],
+                                                               graph_ir.MODEL_VT_OPERATOR_CODES)[0])
+    deprecated = graph_ir.scalar_field(buf, opcodes, graph_ir.OPCODE_VT_DEPRECATED_BUILTIN_CODE, np.int8)
+    builtin = graph_ir.scalar_field(buf, opcodes, graph_ir.OPCODE_VT_BUILTIN_CODE, np.int32)
+    if not np.array_equal(out.opcode_builtin, src.opcode_builtin):
+        problems.append("opcodes %s, expected %s" % (out.opcode_builtin.tolist(), src.opcode_builtin.tolist()))
+    elif not np.array_equal(deprecated, np.minimum(builtin, main6.PLACEHOLDER_FOR_GREATER_OP_CODES)):
+        problems.append("deprecated_builtin_code %s doesn't match builtin_code %s"
+                        % (deprecated.tolist(), builtin.tolist()))
+    if len(out.subgraphs) != len(src.subgraphs):
+        problems.append("%d subgraphs, expected %d" % (len(out.subgraphs), len(src.subgraphs)))
+    builtin_fc, options_fc = main6.fc_enums()
+    for i, (g, h) in enumerate(zip(src.subgraphs, out.subgraphs)):
+        if not np.array_equal(src.opcode_builtin[g.op_opcode], out.opcode_builtin[h.op_opcode]):
+            problems.append("subgraph %d: %d operators, expected %d (or different ops)"
+                            % (i, h.num_operators, g.num_operators))
+            continue
+        fc = h.op_pos[out.opcode_builtin[h.op_opcode] == builtin_fc]
+        options = graph_ir.offset_field(buf, fc, graph_ir.OPERATOR_VT_BUILTIN_OPTIONS)
+        types = graph_ir.scalar_field(buf, fc, graph_ir.OPERATOR_VT_BUILTIN_OPTIONS_TYPE, np.uint8)
+        keep = np.zeros(len(fc), dtype=np.uint8)
+        present = (options >= 0) & (types == options_fc)
+        keep[present] = graph_ir.scalar_field(buf, options[present], main6.FC_VT_KEEP_NUM_DIMS, np.uint8)
+        if (keep != 1).any():
+            problems.append("subgraph %d: %d of %d FULLY_CONNECTED ops without keep_num_dims=1"
+                            % (i, int((keep != 1).sum()), len(fc)))
+    if not np.array_equal(out.buffer_data_size, src.buffer_data_size):
+        problems.append("buffer sizes differ from the input")
+    else:
+        for b in np.flatnonzero(src.buffer_data_size).tolist():
+            pos, size = int(out.buffer_data_pos[b]), int(out.buffer_data_size[b])
+            head = min(size, CHECK_BYTES)
+            if pos + size > len(out_data) or out_data[pos:pos + head] != \
+                    src_data[int(src.buffer_data_pos[b]):int(src.buffer_data_pos[b]) + head]:
+                problems.append("buffer %d: data differs from the input" % b)
+                break
+    del buf, src, out  # views into the maps, which the caller closes
+    return problems
+
+
+def run_entry(entry, input_path, output_path):
+    # process_seconds is the cold-start figure: interpreter, imports and rewrite. The worker is a
+    # fresh bench_worker.py process that imports only the entry point's module (not main6, as this
+    # script does), so process time and peak RSS belong to that entry point alone.
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, WORKER, *ENTRY_POINTS[entry], input_path, output_path],
+                          capture_output=True, text=True)
+    process_seconds = time.perf_counter() - start
+    lines = proc.stdout.strip().splitlines()
+    try:
+        result = json.loads(lines[-1])
+    except (IndexError, ValueError):
+        result = {"seconds": None, "peak_rss": None,
+                  "error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "worker failed"}
+    result["process_seconds"] = process_seconds
+    return result
+
+
+def run_suite(specs, entries, work_dir, repeat=1, regenerate=False):
+    """Gera (ou reaproveita) os modelos e roda cada entry point `repeat` vezes; guarda o melhor tempo."""
+    model_dir = os.path.join(work_dir, "models")
+    os.makedirs(model_dir, exist_ok=True)
+    results = []
+    for spec in specs:
+        path = os.path.join(model_dir, spec["name"] + ".tflite")
+        if regenerate or not os.path.exists(path):
+            print("Generating", path)
+            generate_model(path, spec["ops"], spec["fc_share"], spec["buffers"], spec["weight_bytes"])
+        input_bytes = os.path.getsize(path)
+        for entry in entries:
+            output_path = os.path.join(work_dir, "%s.%s.tflite" % (spec["name"], entry))
+            runs = [run_entry(entry, path, output_path) for _ in range(repeat)]
+            invalid = None
+            if not runs[-1]["error"]:
+                # numbers only count for a correct rewrite
+                problems = check_output(path, output_path) if os.path.exists(output_path) else ["no output"]
+                invalid = "; ".join(problems) or None
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            ok = [r for r in runs if not r["error"]] if not invalid else []
+            best = min(ok, key=lambda r: r["seconds"]) if ok else runs[-1]
+            result = {"model": spec["name"], "entry": entry, "input_bytes": input_bytes,
+                      "status": "ok" if ok else "invalid" if invalid else "error",
+                      "error": None if ok else invalid or best["error"],
+                      "seconds": best["seconds"] if ok else None,
+                      "process_seconds": best["process_seconds"] if ok else None,
+                      "peak_rss": max(r["peak_rss"] for r in ok) if ok else None,
+                      "mb_per_s": input_bytes / best["seconds"] / 1e6 if ok and best["seconds"] else None}
+            results.append(result)
+            if ok:
+                print("%-14s %-6s %9.3fs %8.1f MB/s %8.1f MB RSS" % (
+                    spec["name"], entry, result["seconds"], result["mb_per_s"], result["peak_rss"] / 1e6))
+            else:
+                print("%-14s %-6s %s: %s" % (spec["name"], entry, result["status"], result["error"]))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Runs slower or bigger (peak RSS) than the baseline by more than threshold, or newly failing."""
+    base = {(r["model"], r["entry"]): r for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        old = base.get((r["model"], r["entry"]))
+        if old is None or old["status"] != "ok":
+            continue
+        if r["status"] != "ok":
+            regressions.append("%s/%s: now fails (%s)" % (r["model"], r["entry"], r["error"]))
+            continue
+        for key in ("seconds", "peak_rss"):
+            if r[key] > old[key] * (1 + threshold):
+                regressions.append("%s/%s: %s %.4g -> %.4g (+%.0f%%)" % (
+                    r["model"], r["entry"], key, old[key], r[key], 100 * (r[key] / old[key] - 1)))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the keep_num_dims rewrite scripts on synthetic models.")
+    parser.add_argument("--suite", choices=sorted(SUITES), default="small")
+    parser.add_argument("--entries", default=",".join(ENTRY_POINTS),
+                        help="comma-separated entry points (default: %(default)s)")
+    parser.add_argument("--work-dir", default="bench", help="generated models and outputs (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per model and entry point, best time is kept")
+    parser.add_argument("--regenerate", action="store_true", help="rebuild the synthetic models even if present")
+    parser.add_argument("--report", help="write this run's results as JSON")
+    parser.add_argument("--baseline", help="JSON baseline to compare against (fails on regressions)")
+    parser.add_argument("--save-baseline", action="store_true", help="write this run to --baseline instead")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed slowdown/RSS growth before failing, as a fraction (default: %(default)s)")
+    args = parser.parse_args()
+
+    entries = [e for e in args.entries.split(",") if e]
+    unknown = [e for e in entries if e not in ENTRY_POINTS]
+    if unknown:
+        parser.error("unknown entry points: %s" % ", ".join(unknown))
+    results = run_suite(SUITES[args.suite], entries, args.work_dir, args.repeat, args.regenerate)
+    report = {"suite": args.suite, "python": sys.version.split()[0], "results": results}
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print("Baseline saved:", args.baseline)
+    elif args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for line in regressions:
+            print("REGRESSION", line)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,202 @@
+import importlib
+import importlib.machinery
+import importlib.util
+import json
+import os
+import re
+import sys
+import tempfile
+
+# bump when the cached data (symbols or table_copy layouts) changes shape
+CACHE_FORMAT = 1
+# the generated modules, when tflite itself isn't imported, live under this name instead
+PRIVATE_PACKAGE = "_tflite_bindings"
+# the symbol/layout table stays in memory unless this names a file to persist it in (opt-in)
+CACHE_PATH = os.path.expanduser(os.environ.get("TFLITE_BINDINGS_CACHE", "")) or None
+DEF_RE = re.compile(r"^(?:def|class) (\w+)", re.M)
+ENUM_RE = re.compile(r"^class (\w+)\(object\):\n((?:    \w+ = -?\d+\n)+)", re.M)
+MEMBER_RE = re.compile(r"^    (\w+) = -?\d+$", re.M)
+VERSION_RE = re.compile(r"^__version__ = ['\"]([^'\"]+)['\"]", re.M)
+
+_cache = None
+_dirty = False
+
+
+def package_key(spec):
+    init = spec.origin
+    return "%d:%s:%d" % (CACHE_FORMAT, os.path.dirname(init), os.stat(init).st_mtime_ns)
+
+
+def scan_symbols(pkg_dir):
+    """Mapa símbolo -> [módulo, caminho do atributo] lido do texto dos bindings, sem importá-los.
+
+    Cobre funções/classes de nível de módulo (OperatorCodeStart) e os nomes planos dos enums
+    (BuiltinOperator_FULLY_CONNECTED) que alguns scripts procuram direto no pacote.
+    Nomes definidos em mais de um módulo (Start, End...) ficam de fora.
+    """
+    symbols = {}
+    ambiguous = set()
+    for name in sorted(os.listdir(pkg_dir)):
+        if not name.endswith(".py") or name.startswith("_"):
+            continue
+        mod = name[:-3]
+        with open(os.path.join(pkg_dir, name)) as f:
+            text = f.read()
+        found = {sym: [mod, sym] for sym in DEF_RE.findall(text)}
+        for enum, body in ENUM_RE.findall(text):
+            for member in MEMBER_RE.findall(body):
+                found["%s_%s" % (enum, member)] = [mod, "%s.%s" % (enum, member)]
+        for sym, target in found.items():
+            if sym in symbols:
+                ambiguous.add(sym)
+            symbols[sym] = target
+    for sym in ambiguous:
+        del symbols[sym]
+    return symbols
+
+
+def load_cache(spec):
+    global _cache
+    if _cache is not None:
+        return _cache
+    key = package_key(spec)
+    try:
+        if CACHE_PATH is None:
+            raise OSError("no on-disk cache")
+        with open(CACHE_PATH) as f:
+            cache = json.load(f)
+        if cache.get("key") != key:
+            cache = None
+    except (OSError, ValueError):
+        cache = None
+    if cache is None:
+        pkg_dir = os.path.dirname(spec.origin)
+        with open(spec.origin) as f:
+            version = VERSION_RE.search(f.read())
+        cache = {"key": key, "version": version.group(1) if version else "",
+                 "modules": sorted(n[:-3] for n in os.listdir(pkg_dir) if n.endswith(".py") and n[0] != "_"),
+                 "symbols": scan_symbols(pkg_dir), "layouts": {}, "unions": {}}
+        mark_dirty()
+    _cache = cache
+    return cache
+
+
+def mark_dirty():
+    global _dirty
+    _dirty = True
+
+
+def save_cache():
+    """Grava o cache se algo foi resolvido pela primeira vez nesta execução (escrita atômica).
+
+    Só com TFLITE_BINDINGS_CACHE; se o diretório não puder ser escrito a tabela fica só em memória.
+    """
+    global _dirty
+    if not _dirty or _cache is None or CACHE_PATH is None:
+        return
+    try:
+        cache_dir = os.path.dirname(os.path.abspath(CACHE_PATH))
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(_cache, f)
+            os.replace(tmp, CACHE_PATH)
+        except OSError:
+            os.remove(tmp)
+            raise
+        _dirty = False
+    except OSError:
+        pass
+
+
+def cached(section, name):
+    return _cache[section].get(name) if _cache is not None else None
+
+
+def store(section, name, value):
+    if _cache is not None:
+        _cache[section][name] = value
+        mark_dirty()
+
+
+class PrivateLoader(importlib.machinery.SourceFileLoader):
+    """Carrega um módulo gerado como PRIVATE_PACKAGE.<nome>, com os `from tflite.X import` (que os
+    accessors fazem na primeira chamada) apontando para o mesmo pacote privado.
+
+    Compila do fonte e não grava .pyc: o __pycache__ é do pacote tflite de verdade.
+    """
+
+    def get_code(self, fullname):
+        path = self.get_filename(fullname)
+        source = self.get_data(path).replace(b"from tflite.", b"from %s." % PRIVATE_PACKAGE.encode())
+        return compile(source, path, "exec", dont_inherit=True)
+
+
+class PrivateFinder:
+    """Meta path finder que só responde pelos nomes PRIVATE_PACKAGE.<módulo gerado>."""
+
+    def __init__(self, pkg_dir):
+        self.pkg_dir = pkg_dir
+
+    def find_spec(self, fullname, path=None, target=None):
+        package, _, name = fullname.partition(".")
+        if package != PRIVATE_PACKAGE:
+            return None
+        if not name:
+            return importlib.machinery.ModuleSpec(fullname, None, is_package=True)
+        origin = os.path.join(self.pkg_dir, name + ".py")
+        if "." in name or not os.path.exists(origin):
+            return None
+        return importlib.util.spec_from_file_location(fullname, origin, loader=PrivateLoader(fullname, origin))
+
+
+class Bindings:
+    """Os bindings tflite com cada módulo gerado importado só quando usado.
+
+    Atributos resolvem para o módulo gerado de mesmo nome (tfl.Model é o módulo, mesmo nos
+    bindings que reexportam a classe) ou, pela tabela de símbolos, para a função/enum plana
+    (tfl.BuiltinOperator_FULLY_CONNECTED). Se tflite já foi importado, são os módulos dele;
+    senão o __init__ do pacote (que importa os ~190 módulos) não roda: os módulos são
+    carregados sob PRIVATE_PACKAGE e o tflite do processo continua intocado.
+    """
+
+    def __init__(self, spec, cache):
+        self.__file__ = spec.origin
+        self.__version__ = cache["version"]
+        self._modules = set(cache["modules"])
+        self._symbols = cache["symbols"]
+        self._package = "tflite"
+        if "tflite" not in sys.modules:
+            self._package = PRIVATE_PACKAGE
+            if not any(isinstance(f, PrivateFinder) for f in sys.meta_path):
+                sys.meta_path.append(PrivateFinder(os.path.dirname(spec.origin)))
+
+    def module(self, name):
+        """O módulo gerado `name` (ImportError se não existir)."""
+        if name not in self._modules:
+            raise ImportError("no tflite binding module %r" % name)
+        return importlib.import_module("%s.%s" % (self._package, name))
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if name in self._modules:
+            value = self.module(name)
+        elif name in self._symbols:
+            mod, path = self._symbols[name]
+            value = self.module(mod)
+            for part in path.split("."):
+                value = getattr(value, part)
+        else:
+            raise AttributeError("tflite bindings have no attribute %r" % name)
+        setattr(self, name, value)
+        return value
+
+
+def lazy_bindings():
+    spec = importlib.util.find_spec("tflite")
+    return Bindings(spec, load_cache(spec))
+
+
+tfl = lazy_bindings()
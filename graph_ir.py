@@ -0,0 +1,205 @@
+import numpy as np
+
+# vtable offsets (4 + 2 * slot) in schema.fbs
+MODEL_VT_OPERATOR_CODES = 6
+MODEL_VT_SUBGRAPHS = 8
+MODEL_VT_BUFFERS = 12
+OPCODE_VT_DEPRECATED_BUILTIN_CODE = 4
+OPCODE_VT_CUSTOM_CODE = 6
+OPCODE_VT_VERSION = 8
+OPCODE_VT_BUILTIN_CODE = 10
+SUBGRAPH_VT_TENSORS = 4
+SUBGRAPH_VT_INPUTS = 6
+SUBGRAPH_VT_OUTPUTS = 8
+SUBGRAPH_VT_OPERATORS = 10
+SUBGRAPH_VT_NAME = 12
+TENSOR_VT_SHAPE = 4
+TENSOR_VT_TYPE = 6
+TENSOR_VT_BUFFER = 8
+TENSOR_VT_NAME = 10
+TENSOR_VT_QUANTIZATION = 12
+TENSOR_VT_IS_VARIABLE = 14
+OPERATOR_VT_OPCODE_INDEX = 4
+OPERATOR_VT_INPUTS = 6
+OPERATOR_VT_OUTPUTS = 8
+OPERATOR_VT_BUILTIN_OPTIONS_TYPE = 10
+OPERATOR_VT_BUILTIN_OPTIONS = 12
+OPERATOR_VT_INTERMEDIATES = 20
+BUFFER_VT_DATA = 4
+BUFFER_VT_OFFSET = 6
+BUFFER_VT_SIZE = 8
+
+
+def gather(buf, pos, dtype):
+    """Lê um escalar little-endian em cada posição de pos (vetorizado)."""
+    dtype = np.dtype(dtype).newbyteorder("<")
+    pos = np.asarray(pos, dtype=np.int64)
+    if pos.size == 0:
+        return np.zeros(0, dtype=dtype)
+    return buf[pos[:, None] + np.arange(dtype.itemsize)].view(dtype).ravel()
+
+
+def field_pos(buf, tables, vt_off):
+    """Posição absoluta do campo vt_off em cada tabela, ou -1 quando o campo está ausente."""
+    tables = np.asarray(tables, dtype=np.int64)
+    vt = tables - gather(buf, tables, np.int32)
+    vt_size = gather(buf, vt, np.uint16)
+    fo = np.zeros(len(tables), dtype=np.int64)
+    has = vt_size > vt_off
+    fo[has] = gather(buf, vt[has] + vt_off, np.uint16)
+    return np.where(fo != 0, tables + fo, -1)
+
+
+def scalar_field(buf, tables, vt_off, dtype, default=0):
+    pos = field_pos(buf, tables, vt_off)
+    out = np.full(len(pos), default, dtype=dtype)
+    present = pos >= 0
+    out[present] = gather(buf, pos[present], dtype)
+    return out
+
+
+def offset_field(buf, tables, vt_off):
+    """Destino de um campo uoffset (tabela, vetor ou string) em cada tabela, ou -1."""
+    pos = field_pos(buf, tables, vt_off)
+    present = pos >= 0
+    out = np.full(len(pos), -1, dtype=np.int64)
+    out[present] = pos[present] + gather(buf, pos[present], np.uint32)
+    return out
+
+
+def vector_field(buf, tables, vt_off, dtype):
+    """Vetores escalares de todas as tabelas em formato CSR: (offsets[n + 1], valores concatenados)."""
+    starts = offset_field(buf, tables, vt_off)
+    present = starts >= 0
+    lengths = np.zeros(len(starts), dtype=np.int64)
+    lengths[present] = gather(buf, starts[present], np.uint32)
+    offsets = np.zeros(len(starts) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    itemsize = np.dtype(dtype).itemsize
+    index = np.arange(offsets[-1], dtype=np.int64) - np.repeat(offsets[:-1], lengths)
+    elem_pos = np.repeat(starts + 4, lengths) + index * itemsize
+    return offsets, gather(buf, elem_pos, dtype)
+
+
+def table_vector(buf, start):
+    """Posições das tabelas de um vetor de tabelas que começa em start."""
+    if start < 0:
+        return np.zeros(0, dtype=np.int64)
+    n = int(gather(buf, [start], np.uint32)[0])
+    elem_pos = start + 4 + 4 * np.arange(n, dtype=np.int64)
+    return elem_pos + gather(buf, elem_pos, np.uint32)
+
+
+def root_table(buf):
+    return int(gather(buf, [0], np.uint32)[0])
+
+
+def opcode_builtin_codes(buf, opcodes):
+    # deprecated_builtin_code caps at 127; the real code is the larger of the two fields
+    deprecated = scalar_field(buf, opcodes, OPCODE_VT_DEPRECATED_BUILTIN_CODE, np.int8)
+    builtin = scalar_field(buf, opcodes, OPCODE_VT_BUILTIN_CODE, np.int32)
+    return np.maximum(deprecated.astype(np.int32), builtin)
+
+
+class StringTable:
+    """Strings internadas: cada texto distinto guardado uma vez, referenciado por id (-1 = ausente)."""
+
+    def __init__(self):
+        self.strings = []
+        self.ids = {}
+
+    def intern(self, s):
+        i = self.ids.get(s)
+        if i is None:
+            i = self.ids[s] = len(self.strings)
+            self.strings.append(s)
+        return i
+
+    def intern_all(self, buf, starts):
+        ids = np.full(len(starts), -1, dtype=np.int32)
+        present = np.flatnonzero(starts >= 0)
+        lengths = gather(buf, starts[present], np.uint32)
+        raw = buf.data
+        for i, start, n in zip(present.tolist(), starts[present].tolist(), lengths.tolist()):
+            ids[i] = self.intern(bytes(raw[start + 4:start + 4 + n]).decode("utf-8", "replace"))
+        return ids
+
+    def get(self, i):
+        return self.strings[i] if i >= 0 else None
+
+
+class SubgraphIR:
+    """Um subgraph como struct-of-arrays: escalares em arrays numpy, vetores em CSR."""
+
+    def __init__(self, buf, pos, strings):
+        tensors = table_vector(buf, offset_field(buf, [pos], SUBGRAPH_VT_TENSORS)[0])
+        operators = table_vector(buf, offset_field(buf, [pos], SUBGRAPH_VT_OPERATORS)[0])
+        self.tensor_pos = tensors
+        self.tensor_type = scalar_field(buf, tensors, TENSOR_VT_TYPE, np.int8)
+        self.tensor_buffer = scalar_field(buf, tensors, TENSOR_VT_BUFFER, np.uint32)
+        self.tensor_name = strings.intern_all(buf, offset_field(buf, tensors, TENSOR_VT_NAME))
+        self.shape_offsets, self.shape_values = vector_field(buf, tensors, TENSOR_VT_SHAPE, np.int32)
+        # posição da tabela QuantizationParameters (-1 = sem quantização); lida sob demanda
+        self.tensor_quantization = offset_field(buf, tensors, TENSOR_VT_QUANTIZATION)
+        self.tensor_is_variable = scalar_field(buf, tensors, TENSOR_VT_IS_VARIABLE, np.uint8).astype(bool)
+        self.op_pos = operators
+        self.op_opcode = scalar_field(buf, operators, OPERATOR_VT_OPCODE_INDEX, np.uint32)
+        self.op_input_offsets, self.op_inputs = vector_field(buf, operators, OPERATOR_VT_INPUTS, np.int32)
+        self.op_output_offsets, self.op_outputs = vector_field(buf, operators, OPERATOR_VT_OUTPUTS, np.int32)
+        self.op_intermediate_offsets, self.op_intermediates = vector_field(buf, operators, OPERATOR_VT_INTERMEDIATES,
+                                                                           np.int32)
+        _, self.inputs = vector_field(buf, [pos], SUBGRAPH_VT_INPUTS, np.int32)
+        _, self.outputs = vector_field(buf, [pos], SUBGRAPH_VT_OUTPUTS, np.int32)
+        self.name = strings.intern_all(buf, offset_field(buf, [pos], SUBGRAPH_VT_NAME))[0]
+
+    @property
+    def num_tensors(self):
+        return len(self.tensor_type)
+
+    @property
+    def num_operators(self):
+        return len(self.op_opcode)
+
+    def shape(self, t):
+        return self.shape_values[self.shape_offsets[t]:self.shape_offsets[t + 1]]
+
+    def op_input(self, op):
+        return self.op_inputs[self.op_input_offsets[op]:self.op_input_offsets[op + 1]]
+
+    def op_output(self, op):
+        return self.op_outputs[self.op_output_offsets[op]:self.op_output_offsets[op + 1]]
+
+
+class ModelIR:
+    """Modelo inteiro em arrays compactos, montado direto dos bytes do flatbuffer sem os accessors."""
+
+    def __init__(self, data):
+        buf = np.frombuffer(data, dtype=np.uint8)
+        root = root_table(buf)
+        self.strings = StringTable()
+        opcodes = table_vector(buf, offset_field(buf, [root], MODEL_VT_OPERATOR_CODES)[0])
+        self.opcode_builtin = opcode_builtin_codes(buf, opcodes)
+        self.opcode_version = scalar_field(buf, opcodes, OPCODE_VT_VERSION, np.int32, default=1)
+        self.opcode_custom = self.strings.intern_all(buf, offset_field(buf, opcodes, OPCODE_VT_CUSTOM_CODE))
+        buffers = table_vector(buf, offset_field(buf, [root], MODEL_VT_BUFFERS)[0])
+        data_starts = offset_field(buf, buffers, BUFFER_VT_DATA)
+        self.buffer_data_pos = np.where(data_starts >= 0, data_starts + 4, -1)
+        self.buffer_data_size = np.zeros(len(buffers), dtype=np.int64)
+        present = data_starts >= 0
+        self.buffer_data_size[present] = gather(buf, data_starts[present], np.uint32)
+        # pesos fora do flatbuffer: Buffer.offset/size apontam para o arquivo (offset 1 é o placeholder do conversor)
+        offsets = scalar_field(buf, buffers, BUFFER_VT_OFFSET, np.uint64).astype(np.int64)
+        self.buffer_external = ~present & (offsets > 1)
+        self.buffer_data_pos[self.buffer_external] = offsets[self.buffer_external]
+        self.buffer_data_size[self.buffer_external] = scalar_field(
+            buf, buffers, BUFFER_VT_SIZE, np.uint64)[self.buffer_external].astype(np.int64)
+        self.subgraphs = [SubgraphIR(buf, pos, self.strings)
+                          for pos in table_vector(buf, offset_field(buf, [root], MODEL_VT_SUBGRAPHS)[0])]
+
+    @property
+    def num_buffers(self):
+        return len(self.buffer_data_size)
+
+
+def build_ir(data):
+    return ModelIR(data)
@@ -0,0 +1,87 @@
+import contextlib
+import cProfile
+import json
+import time
+import tracemalloc
+
+
+class PhaseRecorder:
+    """Tempo, itens, bytes emitidos no builder e (opcional) memória alocada por fase do rewrite.
+
+    Fases não se aninham: cada uma mede só o próprio trecho. Com trace_memory as alocações
+    Python vêm do tracemalloc; com profile_path a execução inteira passa pelo cProfile.
+    """
+
+    def __init__(self, trace_memory=False, profile_path=None):
+        self.trace_memory = trace_memory
+        self.profile_path = profile_path
+        self.phases = []
+        self.total_seconds = None
+
+    @contextlib.contextmanager
+    def session(self):
+        started = self.trace_memory and not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        profiler = cProfile.Profile() if self.profile_path else None
+        if profiler:
+            profiler.enable()
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.total_seconds = time.perf_counter() - start
+            if profiler:
+                profiler.disable()
+                profiler.dump_stats(self.profile_path)
+            if started:
+                tracemalloc.stop()
+
+    @contextlib.contextmanager
+    def phase(self, name, builder=None, **labels):
+        """Mede o bloco; o chamador pode preencher entry["items"] com quantas tabelas/buffers tratou."""
+        entry = dict(phase=name, items=None, **labels)
+        tracing = tracemalloc.is_tracing()
+        out_start = builder.Offset() if builder is not None else None
+        if tracing:
+            mem_start = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield entry
+        finally:
+            entry["seconds"] = time.perf_counter() - start
+            if builder is not None:
+                entry["output_bytes"] = builder.Offset() - out_start
+            if tracing:
+                current, peak = tracemalloc.get_traced_memory()
+                entry["alloc_bytes"] = current - mem_start
+                entry["peak_alloc_bytes"] = peak - mem_start
+            self.phases.append(entry)
+
+    def totals(self):
+        # per phase name, summed over subgraphs
+        totals = {}
+        for entry in self.phases:
+            t = totals.setdefault(entry["phase"], {"seconds": 0.0, "items": 0})
+            t["seconds"] += entry["seconds"]
+            t["items"] += entry["items"] or 0
+            for key in ("output_bytes", "alloc_bytes", "padding_bytes", "dropped"):
+                if key in entry:
+                    t[key] = t.get(key, 0) + entry[key]
+            if "peak_alloc_bytes" in entry:
+                t["peak_alloc_bytes"] = max(t.get("peak_alloc_bytes", 0), entry["peak_alloc_bytes"])
+        return totals
+
+    def report(self):
+        return {"total_seconds": self.total_seconds, "totals": self.totals(), "phases": self.phases}
+
+    def write(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def summary(self):
+        lines = []
+        for name, t in self.totals().items():
+            lines.append("%-10s %8.4fs %8d items" % (name, t["seconds"], t["items"]))
+        return "\n".join(lines)
@@ -4,38 +4,29 @@
 
 import sys
 import flatbuffers
-import tflite
 import struct
 
+import numpy as np
+
+import graph_ir
+from bindings import tfl as tflite
+from model_io import builder_size_hint, create_buffer, create_quantization, map_file, write_builder
+
+PLACEHOLDER_FOR_GREATER_OP_CODES = 127
+
 def get(fn_name):
     return getattr(tflite, fn_name, None)
 
-def read_file(path):
-    with open(path, "rb") as f:
-        return f.read()
+def copy_quantization(builder, data, pos):
+    """Copia a QuantizationParameters na posição pos do modelo original."""
+    q = tflite.QuantizationParameters.QuantizationParameters()
+    q.Init(data, pos)
+    return create_quantization(builder, q)
 
 def main(in_path, out_path):
-    data = read_file(in_path)
-    # obter raiz do modelo (binding gerado costuma expor Model.Model.GetRootAsModel)
-    ModelGetRoot = None
-    for cand in ("Model.Model.GetRootAsModel", "Model.GetRootAsModel"):
-        parts = cand.split(".")
-        try:
-            # dynamic import chain
-            obj = tflite
-            for p in parts:
-                obj = getattr(obj, p) if isinstance(obj, type) or hasattr(obj, p) else None
-        except Exception:
-            obj = None
-        if obj:
-            ModelGetRoot = obj
-            break
-    # fallback: tentar acesso direto comum
-    if ModelGetRoot is None:
-        try:
-            ModelGetRoot = tflite.Model.Model.GetRootAsModel
-        except Exception:
-            pass
+    data = map_file(in_path)
+    # obter raiz do modelo: o pacote preguiçoso resolve tflite.Model como módulo em qualquer versão dos bindings
+    ModelGetRoot = getattr(getattr(tflite.Model, "Model", None), "GetRootAsModel", None)
     if ModelGetRoot is None:
         print("Não encontrei Model.GetRootAsModel no módulo tflite. Rode:")
         print("print([n for n in dir(tflite) if 'Model' in n or 'GetRoot' in n])")
@@ -50,94 +41,26 @@ def main(in_path, out_path):
         print("Não encontrei enums BuiltinOperator_FULLY_CONNECTED ou BuiltinOptions_FullyConnectedOptions no módulo tflite.")
         raise SystemExit(1)
 
-    # coletar operator codes (copiar como estão)
-    opcodes = []
-    n_opcodes = model.OperatorCodesLength()
-    for i in range(n_opcodes):
-        oc = model.OperatorCodes(i)
-        # cada OperatorCode tem: BuiltinCode(), Version(), maybe CustomCode()
-        opcodes.append({
-            "builtin_code": oc.BuiltinCode(),
-            "version": oc.Version(),
-            "custom_code": oc.CustomCode().decode('utf-8') if oc.CustomCode() else None
-        })
-
-    # coletar buffers (copiar dados brutos)
-    buffers = []
-    for i in range(model.BuffersLength()):
-        buf = model.Buffers(i)
-        b = buf.DataAsNumpy() if hasattr(buf, "DataAsNumpy") else (buf.Data() if hasattr(buf, "Data") else None)
-        # DataAsNumpy retorna numpy array or None; normalize to bytes or None
-        if b is None:
-            buffers.append(None)
-        else:
-            # b may be memoryview/bytes/numpy => convert to bytes
-            try:
-                buffers.append(bytes(b))
-            except Exception:
-                # fallback iterate
-                buffers.append(b.tobytes() if hasattr(b, "tobytes") else bytes(b))
-
-    # coletar subgraphs
-    subgraphs = []
-    for sg_i in range(model.SubgraphsLength()):
-        sg = model.Subgraphs(sg_i)
-        # tensors
-        tensors = []
-        for t_i in range(sg.TensorsLength()):
-            t = sg.Tensors(t_i)
-            # name decode safely
-            name = t.Name().decode('utf-8') if t.Name() else ""
-            # shape vector
-            shape = [t.Shape(j) for j in range(t.ShapeLength())]
-            tensors.append({
-                "name": name,
-                "shape": shape,
-                "type": t.Type(),
-                "buffer": t.Buffer(),
-                "quantization": None  # ignored for simplicity
-            })
-        # operators
-        operators = []
-        for op_i in range(sg.OperatorsLength()):
-            op = sg.Operators(op_i)
-            # read inputs
-            inputs = [op.Inputs(j) for j in range(op.InputsLength())]
-            outputs = [op.Outputs(j) for j in range(op.OutputsLength())]
-            opcode_index = op.OpcodeIndex()
-            # builtins options type & raw bytes if present
-            btype = op.BuiltinOptionsType()
-            b_off = op.BuiltinOptions()
-            # we can't directly extract raw flatbuffer of builtin options easily via accessor;
-            # we'll rebuild everything, injecting new options when opcode is FULLY_CONNECTED
-            operators.append({
-                "inputs": inputs,
-                "outputs": outputs,
-                "opcode_index": opcode_index,
-                "builtin_options_type": btype,
-                "builtin_options_offset": b_off
-            })
-        # inputs/outputs indices
-        sg_inputs = [sg.Inputs(j) for j in range(sg.InputsLength())]
-        sg_outputs = [sg.Outputs(j) for j in range(sg.OutputsLength())]
-        subgraphs.append({
-            "name": sg.Name().decode('utf-8') if sg.Name() else "",
-            "tensors": tensors,
-            "inputs": sg_inputs,
-            "outputs": sg_outputs,
-            "operators": operators
-        })
+    # IR compacto (arrays numpy + CSR + strings internadas) lido direto dos bytes, sem um dict por tabela
+    ir = graph_ir.build_ir(data)
+    view = memoryview(data)
+    strings = ir.strings.strings
+    # pesos inline ou externos (Buffer.offset/size): fatias sem cópia do mmap
+    buffer_views = [view[pos:pos + size] if size else None
+                    for pos, size in zip(ir.buffer_data_pos.tolist(), ir.buffer_data_size.tolist())]
 
     # Agora reconstruir o modelo com um novo Builder, copiando tudo mas injetando FullyConnectedOptions.keep_num_dims=1
-    builder = flatbuffers.Builder(len(data) + 1024)
+    builder = flatbuffers.Builder(builder_size_hint(model, data, buffer_views))
 
     # Funções geradas
     OperatorCodeStart = get("OperatorCodeStart"); OperatorCodeAddBuiltinCode = get("OperatorCodeAddBuiltinCode")
+    OperatorCodeAddDeprecatedBuiltinCode = get("OperatorCodeAddDeprecatedBuiltinCode")
     OperatorCodeAddVersion = get("OperatorCodeAddVersion"); OperatorCodeAddCustomCode = get("OperatorCodeAddCustomCode")
     OperatorCodeEnd = get("OperatorCodeEnd")
-    BufferStart = get("BufferStart"); BufferAddData = get("BufferAddData"); BufferEnd = get("BufferEnd")
+    BufferStart = get("BufferStart"); BufferEnd = get("BufferEnd")
     TensorStart = get("TensorStart"); TensorAddShape = get("TensorAddShape"); TensorAddType = get("TensorAddType")
     TensorAddBuffer = get("TensorAddBuffer"); TensorAddName = get("TensorAddName"); TensorEnd = get("TensorEnd")
+    TensorAddQuantization = get("TensorAddQuantization")
     SubGraphStart = get("SubGraphStart"); SubGraphAddTensors = get("SubGraphAddTensors")
     SubGraphAddInputs = get("SubGraphAddInputs"); SubGraphAddOutputs = get("SubGraphAddOutputs")
     SubGraphAddName = get("SubGraphAddName"); SubGraphAddOperators = get("SubGraphAddOperators"); SubGraphEnd = get("SubGraphEnd")
@@ -147,6 +70,7 @@ def main(in_path, out_path):
     OperatorEnd = get("OperatorEnd")
     ModelStart = get("ModelStart"); ModelAddOperatorCodes = get("ModelAddOperatorCodes"); ModelAddSubgraphs = get("ModelAddSubgraphs")
     ModelAddBuffers = get("ModelAddBuffers"); ModelAddDescription = get("ModelAddDescription"); ModelEnd = get("ModelEnd")
+    ModelAddVersion = get("ModelAddVersion")
 
     # sanity checks
     required = [OperatorCodeStart, OperatorCodeAddBuiltinCode, OperatorCodeEnd, BufferStart, BufferEnd,
@@ -157,50 +81,46 @@ def main(in_path, out_path):
         print("print([n for n in dir(tflite) if any(k in n for k in ['Operator', 'Model', 'SubGraph', 'Buffer', 'Tensor', 'FullyConnectedOptions'])])")
         raise SystemExit(1)
 
-    # 1) criar buffers (buffer 0..N)
-    buffer_offsets = []
-    for b in buffers:
-        BufferStart(builder)
-        if b:
-            data_vec = builder.CreateByteVector(b)
-            BufferAddData(builder, data_vec)
-        buf_off = BufferEnd(builder)
-        buffer_offsets.append(buf_off)
+    # 1) criar buffers (buffer 0..N); pesos externos (Buffer.offset/size) voltam para dentro do flatbuffer
+    buffer_offsets = [create_buffer(builder, v) for v in buffer_views]
 
     # 2) criar tensors (por subgraph) - manter nome strings
     # Para reconstruir subgraphs mais facilmente, vamos criar cada tensor e guardar seus offsets
     all_subgraph_tensor_offsets = []
-    for sg in subgraphs:
+    for sg in ir.subgraphs:
         t_offsets = []
-        for t in sg["tensors"]:
-            name_off = builder.CreateString(t["name"])
-            # shape vector
-            if len(t["shape"]) > 0:
-                builder.StartVector(4, len(t["shape"]), 4)
-                for d in reversed(t["shape"]):
-                    builder.PrependInt32(d)
-                shape_vec = builder.EndVector()
-            else:
-                shape_vec = 0
+        types, bufs, names = sg.tensor_type.tolist(), sg.tensor_buffer.tolist(), sg.tensor_name.tolist()
+        quants = sg.tensor_quantization.tolist()
+        for t_i in range(sg.num_tensors):
+            name_off = builder.CreateSharedString(strings[names[t_i]] if names[t_i] >= 0 else "")
+            shape = sg.shape(t_i)
+            shape_vec = builder.CreateNumpyVector(shape) if len(shape) else 0
+            # scale/zero_point por canal: sem eles os modelos int8 perdem os kernels inteiros
+            quant_off = copy_quantization(builder, data, quants[t_i]) if quants[t_i] >= 0 else 0
             TensorStart(builder)
             if shape_vec:
                 TensorAddShape(builder, shape_vec)
-            TensorAddType(builder, t["type"])
-            TensorAddBuffer(builder, t["buffer"])
+            TensorAddType(builder, types[t_i])
+            TensorAddBuffer(builder, bufs[t_i])
             TensorAddName(builder, name_off)
+            if quant_off:
+                TensorAddQuantization(builder, quant_off)
             t_off = TensorEnd(builder)
             t_offsets.append(t_off)
         all_subgraph_tensor_offsets.append(t_offsets)
 
     # 3) criar OperatorCodes (copiar)
     opcodes_offsets = []
-    for oc in opcodes:
+    for code, version, custom in zip(ir.opcode_builtin.tolist(), ir.opcode_version.tolist(), ir.opcode_custom.tolist()):
+        custom_off = builder.CreateSharedString(strings[custom]) if custom >= 0 else 0
         OperatorCodeStart(builder)
-        OperatorCodeAddBuiltinCode(builder, oc["builtin_code"])
-        if oc["version"] is not None:
-            OperatorCodeAddVersion(builder, oc["version"])
-        if oc["custom_code"]:
-            OperatorCodeAddCustomCode(builder, builder.CreateString(oc["custom_code"]))
+        if OperatorCodeAddDeprecatedBuiltinCode:
+            # readers take deprecated_builtin_code for every code below the placeholder (127)
+            OperatorCodeAddDeprecatedBuiltinCode(builder, min(code, PLACEHOLDER_FOR_GREATER_OP_CODES))
+        OperatorCodeAddBuiltinCode(builder, code)
+        OperatorCodeAddVersion(builder, version)
+        if custom_off:
+            OperatorCodeAddCustomCode(builder, custom_off)
         op_off = OperatorCodeEnd(builder)
         opcodes_offsets.append(op_off)
 
@@ -208,108 +128,85 @@ def main(in_path, out_path):
     subgraph_offsets = []
     # prepare references to FullyConnectedOptions builder funcs
     fc_start = get("FullyConnectedOptionsStart"); fc_add_keep = get("FullyConnectedOptionsAddKeepNumDims"); fc_end = get("FullyConnectedOptionsEnd")
-    for sidx, sg in enumerate(subgraphs):
-        # criar operators vector
+    if not (fc_start and fc_add_keep and fc_end):
+        print("Funções FullyConnectedOptions não encontradas no binding.")
+        raise SystemExit(1)
+    fc_opcodes = np.flatnonzero(ir.opcode_builtin == BuiltinOperator_FULLY_CONNECTED)
+    for sidx, sg in enumerate(ir.subgraphs):
+        # consulta vetorizada: quais operadores são FULLY_CONNECTED
+        is_fc = np.isin(sg.op_opcode, fc_opcodes).tolist()
+        opcode_index = sg.op_opcode.tolist()
         op_offsets = []
-        for op in sg["operators"]:
-            # inputs vector
-            builder.StartVector(4, len(op["inputs"]), 4)
-            for i in reversed(op["inputs"]):
-                builder.PrependInt32(i)
-            inputs_vec = builder.EndVector()
-            # outputs vector
-            builder.StartVector(4, len(op["outputs"]), 4)
-            for o in reversed(op["outputs"]):
-                builder.PrependInt32(o)
-            outputs_vec = builder.EndVector()
-
-            OperatorStart(builder)
-            OperatorAddOpcodeIndex(builder, op["opcode_index"])
-            OperatorAddInputs(builder, inputs_vec)
-            OperatorAddOutputs(builder, outputs_vec)
-
+        for op_i in range(sg.num_operators):
+            # vetores e options antes de OperatorStart (o builder não aceita objetos aninhados)
+            inputs_vec = builder.CreateNumpyVector(sg.op_input(op_i))
+            outputs_vec = builder.CreateNumpyVector(sg.op_output(op_i))
+            fc_off = 0
             # se opcode corresponde a FULLY_CONNECTED, criar/injetar FullyConnectedOptions with keep_num_dims=1
-            opcode_builtin = opcodes[op["opcode_index"]]["builtin_code"] if op["opcode_index"] < len(opcodes) else None
-            if opcode_builtin == BuiltinOperator_FULLY_CONNECTED:
-                if not (fc_start and fc_add_keep and fc_end):
-                    print("Funções FullyConnectedOptions não encontradas no binding.")
-                    raise SystemExit(1)
+            if is_fc[op_i]:
                 fc_start(builder)
                 fc_add_keep(builder, 1)
                 fc_off = fc_end(builder)
+            # demais opções não são copiadas (copiá-las com fidelidade requer extra parsing)
+
+            OperatorStart(builder)
+            OperatorAddOpcodeIndex(builder, opcode_index[op_i])
+            OperatorAddInputs(builder, inputs_vec)
+            OperatorAddOutputs(builder, outputs_vec)
+            if fc_off:
                 OperatorAddBuiltinOptions(builder, fc_off)
                 OperatorAddBuiltinOptionsType(builder, BuiltinOptions_FullyConnectedOptions)
-            else:
-                # sem opções: nada a fazer (copiá-las com fidelidade requer extra parsing; mantemos sem opções)
-                pass
-
             op_off = OperatorEnd(builder)
             op_offsets.append(op_off)
 
-        # criar vector de operators
-        SubGraphStart(builder)
         # tensors vector para esta subgraph
         tvecs = all_subgraph_tensor_offsets[sidx]
         builder.StartVector(4, len(tvecs), 4)
         for tro in reversed(tvecs):
             builder.PrependUOffsetTRelative(tro)
         tensors_vec = builder.EndVector()
-        SubGraphAddTensors(builder, tensors_vec)
-
-        # inputs vector
-        builder.StartVector(4, len(sg["inputs"]), 4)
-        for ii in reversed(sg["inputs"]):
-            builder.PrependInt32(ii)
-        inputs_vec = builder.EndVector()
-        SubGraphAddInputs(builder, inputs_vec)
-        # outputs vector
-        builder.StartVector(4, len(sg["outputs"]), 4)
-        for oo in reversed(sg["outputs"]):
-            builder.PrependInt32(oo)
-        outputs_vec = builder.EndVector()
-        SubGraphAddOutputs(builder, outputs_vec)
-
-        SubGraphAddName(builder, builder.CreateString(sg["name"]))
-
+        inputs_vec = builder.CreateNumpyVector(sg.inputs)
+        outputs_vec = builder.CreateNumpyVector(sg.outputs)
+        name_off = builder.CreateSharedString(strings[sg.name] if sg.name >= 0 else "")
         # operators vector
         builder.StartVector(4, len(op_offsets), 4)
         for opo in reversed(op_offsets):
             builder.PrependUOffsetTRelative(opo)
         ops_vec = builder.EndVector()
-        SubGraphAddOperators(builder, ops_vec)
 
+        SubGraphStart(builder)
+        SubGraphAddTensors(builder, tensors_vec)
+        SubGraphAddInputs(builder, inputs_vec)
+        SubGraphAddOutputs(builder, outputs_vec)
+        SubGraphAddName(builder, name_off)
+        SubGraphAddOperators(builder, ops_vec)
         sg_off = SubGraphEnd(builder)
         subgraph_offsets.append(sg_off)
 
-    # 5) montar Model: operator codes, subgraphs, buffers
+    # 5) montar Model: operator codes, subgraphs, buffers (vetores e string antes de ModelStart)
+    vecs = []
+    for offsets in (opcodes_offsets, subgraph_offsets, buffer_offsets):
+        builder.StartVector(4, len(offsets), 4)
+        for off in reversed(offsets):
+            builder.PrependUOffsetTRelative(off)
+        vecs.append(builder.EndVector())
+    description = builder.CreateString("Injected keep_num_dims=1 into FullyConnected ops")
     ModelStart(builder)
-    # operator codes vector
-    builder.StartVector(4, len(opcodes_offsets), 4)
-    for oc in reversed(opcodes_offsets):
-        builder.PrependUOffsetTRelative(oc)
-    ModelAddOperatorCodes(builder, builder.EndVector())
-    # subgraphs vector
-    builder.StartVector(4, len(subgraph_offsets), 4)
-    for so in reversed(subgraph_offsets):
-        builder.PrependUOffsetTRelative(so)
-    ModelAddSubgraphs(builder, builder.EndVector())
-    # buffers vector
-    builder.StartVector(4, len(buffer_offsets), 4)
-    for bo in reversed(buffer_offsets):
-        builder.PrependUOffsetTRelative(bo)
-    ModelAddBuffers(builder, builder.EndVector())
-    ModelAddDescription(builder, builder.CreateString("Injected keep_num_dims=1 into FullyConnected ops"))
+    ModelAddVersion(builder, 3)
+    ModelAddOperatorCodes(builder, vecs[0])
+    ModelAddSubgraphs(builder, vecs[1])
+    ModelAddBuffers(builder, vecs[2])
+    ModelAddDescription(builder, description)
     model_off = ModelEnd(builder)
 
-    builder.Finish(model_off)
-    out_bytes = builder.Output()
-
-    with open(out_path, "wb") as f:
-        f.write(out_bytes)
+    # o interpretador recusa modelos sem o identificador de arquivo
+    builder.Finish(model_off, b"TFL3")
+    # gravar direto do bytearray do builder (builder.Output() faria mais uma cópia do modelo inteiro)
+    write_builder(builder, out_path)
 
     print(f"Wrote new model to {out_path} — ALL FullyConnected ops now have keep_num_dims=1 (injected).")
 
-if _name_ == "_main_":
+if __name__ == "__main__":
     if len(sys.argv) < 3:
         print("Uso: python inject_keep_num_dims.py input.tflite output.tflite")
         sys.exit(1)
@@ -1,51 +1,34 @@
 import flatbuffers
-import tflite
 import sys
 
+from bindings import tfl as tflite
+from model_io import (buffer_data_view, builder_size_hint, create_buffer, create_quantization, create_string, map_file,
+                      vec_int, write_builder)
+
 def inject_keep_num_dims(input_path, output_path):
-    data = open(input_path, "rb").read()
+    data = map_file(input_path)
     model = tflite.Model.Model.GetRootAsModel(data, 0)
 
-    builder = flatbuffers.Builder(2 * len(data))
-
-    # helpers
-    def vec_int(values):
-        builder.StartVector(4, len(values), 4)
-        for v in reversed(values):
-            builder.PrependInt32(v)
-        return builder.EndVector()
+    # zero-copy slices of every buffer (inline or external) inside the original bytes
+    views = [buffer_data_view(data, model.Buffers(i)) for i in range(model.BuffersLength())]
+    builder = flatbuffers.Builder(builder_size_hint(model, data, views))
 
     # === Buffers ===
-    buffers = []
-    for i in range(model.BuffersLength()):
-        buf = model.Buffers(i)
-        raw = buf.DataAsNumpy() if hasattr(buf, "DataAsNumpy") else buf.Data()
-        if raw is None:
-            t = None
-        else:
-            try: t = bytes(raw)
-            except: t = raw.tobytes()
-        builder.StartVector(1, len(t) if t else 0, 1) if t else None
-        if t:
-            for b in reversed(t):
-                builder.PrependUint8(b)
-            data_vec = builder.EndVector()
-        else:
-            data_vec = 0
-        tflite.Buffer.BufferStart(builder)
-        if data_vec != 0:
-            tflite.Buffer.BufferAddData(builder, data_vec)
-        buffers.append(tflite.Buffer.BufferEnd(builder))
+    buffers = [create_buffer(builder, v) for v in views]
 
     # === OperatorCodes ===
     opcodes = []
     for i in range(model.OperatorCodesLength()):
         oc = model.OperatorCodes(i)
+        # strings and vectors go in before the table that points at them: the builder can't nest
+        custom = create_string(builder, oc.CustomCode())
         tflite.OperatorCode.OperatorCodeStart(builder)
+        # readers take deprecated_builtin_code for every code below PLACEHOLDER_FOR_GREATER_OP_CODES (127)
+        tflite.OperatorCode.OperatorCodeAddDeprecatedBuiltinCode(builder, min(oc.BuiltinCode(), 127))
         tflite.OperatorCode.OperatorCodeAddBuiltinCode(builder, oc.BuiltinCode())
         tflite.OperatorCode.OperatorCodeAddVersion(builder, oc.Version())
-        if oc.CustomCode():
-            tflite.OperatorCode.OperatorCodeAddCustomCode(builder, builder.CreateString(oc.CustomCode().decode()))
+        if custom:
+            tflite.OperatorCode.OperatorCodeAddCustomCode(builder, custom)
         opcodes.append(tflite.OperatorCode.OperatorCodeEnd(builder))
 
     # === Subgraphs (tensors, operators, etc) ===
@@ -57,15 +40,18 @@ def inject_keep_num_dims(input_path, output_path):
         tensors = []
         for ti in range(sg.TensorsLength()):
             t = sg.Tensors(ti)
-            name = builder.CreateString(t.Name().decode() if t.Name() else "")
+            name = create_string(builder, t.Name())
             shape = [t.Shape(j) for j in range(t.ShapeLength())]
-            shape_vec = vec_int(shape) if shape else 0
+            shape_vec = vec_int(builder, shape)
+            # scale/zero_point por canal: sem eles os modelos int8 perdem os kernels inteiros
+            quant = create_quantization(builder, t.Quantization())
 
             tflite.Tensor.TensorStart(builder)
             if shape_vec: tflite.Tensor.TensorAddShape(builder, shape_vec)
             tflite.Tensor.TensorAddType(builder, t.Type())
             tflite.Tensor.TensorAddBuffer(builder, t.Buffer())
             tflite.Tensor.TensorAddName(builder, name)
+            if quant: tflite.Tensor.TensorAddQuantization(builder, quant)
             tensors.append(tflite.Tensor.TensorEnd(builder))
 
         # operators
@@ -76,22 +62,23 @@ def inject_keep_num_dims(input_path, output_path):
             inputs = [op.Inputs(j) for j in range(op.InputsLength())]
             outputs = [op.Outputs(j) for j in range(op.OutputsLength())]
 
-            inp_vec = vec_int(inputs)
-            out_vec = vec_int(outputs)
-
-            tflite.Operator.OperatorStart(builder)
-            tflite.Operator.OperatorAddOpcodeIndex(builder, op.OpcodeIndex())
-            tflite.Operator.OperatorAddInputs(builder, inp_vec)
-            tflite.Operator.OperatorAddOutputs(builder, out_vec)
+            inp_vec = vec_int(builder, inputs)
+            out_vec = vec_int(builder, outputs)
 
             # ---- APPLY keep_num_dims = TRUE ----
+            # FullyConnectedOptions is built before OperatorStart: the builder can't nest tables
+            opt = 0
             opcode = model.OperatorCodes(op.OpcodeIndex()).BuiltinCode()
             if opcode == tflite.BuiltinOperator.BuiltinOperator().FULLY_CONNECTED:
-                # build FullyConnectedOptions
                 tflite.FullyConnectedOptions.FullyConnectedOptionsStart(builder)
                 tflite.FullyConnectedOptions.FullyConnectedOptionsAddKeepNumDims(builder, True)
                 opt = tflite.FullyConnectedOptions.FullyConnectedOptionsEnd(builder)
 
+            tflite.Operator.OperatorStart(builder)
+            tflite.Operator.OperatorAddOpcodeIndex(builder, op.OpcodeIndex())
+            tflite.Operator.OperatorAddInputs(builder, inp_vec)
+            tflite.Operator.OperatorAddOutputs(builder, out_vec)
+            if opt:
                 tflite.Operator.OperatorAddBuiltinOptions(builder, opt)
                 tflite.Operator.OperatorAddBuiltinOptionsType(
                     builder,
@@ -101,56 +88,61 @@ def inject_keep_num_dims(input_path, output_path):
             ops.append(tflite.Operator.OperatorEnd(builder))
 
         # inputs / outputs
-        in_vec  = vec_int([sg.Inputs(i)  for i in range(sg.InputsLength())])
-        out_vec = vec_int([sg.Outputs(i) for i in range(sg.OutputsLength())])
-        name = builder.CreateString(sg.Name().decode() if sg.Name() else "")
-
-        tflite.SubGraph.SubGraphStart(builder)
+        in_vec  = vec_int(builder, [sg.Inputs(i)  for i in range(sg.InputsLength())])
+        out_vec = vec_int(builder, [sg.Outputs(i) for i in range(sg.OutputsLength())])
+        name = create_string(builder, sg.Name())
 
         # tensors
         builder.StartVector(4, len(tensors), 4)
         for t in reversed(tensors):
             builder.PrependUOffsetTRelative(t)
-        tflite.SubGraph.SubGraphAddTensors(builder, builder.EndVector())
-
-        tflite.SubGraph.SubGraphAddInputs(builder, in_vec)
-        tflite.SubGraph.SubGraphAddOutputs(builder, out_vec)
-        tflite.SubGraph.SubGraphAddName(builder, name)
+        tensors_vec = builder.EndVector()
 
         # operators
         builder.StartVector(4, len(ops), 4)
         for o in reversed(ops):
             builder.PrependUOffsetTRelative(o)
-        tflite.SubGraph.SubGraphAddOperators(builder, builder.EndVector())
+        ops_vec = builder.EndVector()
 
+        tflite.SubGraph.SubGraphStart(builder)
+        tflite.SubGraph.SubGraphAddTensors(builder, tensors_vec)
+        tflite.SubGraph.SubGraphAddInputs(builder, in_vec)
+        tflite.SubGraph.SubGraphAddOutputs(builder, out_vec)
+        tflite.SubGraph.SubGraphAddName(builder, name)
+        tflite.SubGraph.SubGraphAddOperators(builder, ops_vec)
         subgraphs.append(tflite.SubGraph.SubGraphEnd(builder))
 
-    # === Model ===
-    tflite.Model.ModelStart(builder)
-
+    # === Model === (every vector and the description before ModelStart)
     # operator codes
     builder.StartVector(4, len(opcodes), 4)
     for oc in reversed(opcodes):
         builder.PrependUOffsetTRelative(oc)
-    tflite.Model.ModelAddOperatorCodes(builder, builder.EndVector())
+    opcodes_vec = builder.EndVector()
 
     # subgraphs
     builder.StartVector(4, len(subgraphs), 4)
     for sg in reversed(subgraphs):
         builder.PrependUOffsetTRelative(sg)
-    tflite.Model.ModelAddSubgraphs(builder, builder.EndVector())
+    subgraphs_vec = builder.EndVector()
 
     # buffers
     builder.StartVector(4, len(buffers), 4)
     for b in reversed(buffers):
         builder.PrependUOffsetTRelative(b)
-    tflite.Model.ModelAddBuffers(builder, builder.EndVector())
+    buffers_vec = builder.EndVector()
+    description = builder.CreateString("Injected keep_num_dims")
 
-    tflite.Model.ModelAddDescription(builder, builder.CreateString("Injected keep_num_dims"))
+    tflite.Model.ModelStart(builder)
+    tflite.Model.ModelAddVersion(builder, 3)
+    tflite.Model.ModelAddOperatorCodes(builder, opcodes_vec)
+    tflite.Model.ModelAddSubgraphs(builder, subgraphs_vec)
+    tflite.Model.ModelAddBuffers(builder, buffers_vec)
+    tflite.Model.ModelAddDescription(builder, description)
     model_off = tflite.Model.ModelEnd(builder)
 
-    builder.Finish(model_off)
-    open(output_path, "wb").write(builder.Output())
+    builder.Finish(model_off, b"TFL3")
+    # write straight from the builder's bytearray, no Output() copy
+    write_builder(builder, output_path)
     print(f"[OK] Modelo salvo em: {output_path}")
 
 
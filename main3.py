@@ -1,36 +1,15 @@
 import flatbuffers
-import importlib
-import tflite
 import sys
 
-def get_mod(name):
-    return importlib.import_module(name)
-
-def vec_int(builder, values):
-    if not values:
-        return 0
-    builder.StartVector(4, len(values), 4)
-    for v in reversed(values):
-        builder.PrependInt32(v)
-    return builder.EndVector()
-
-def create_buffer_offset(builder, data_bytes):
-    # Use CreateByteVector (which is safe to call anytime when not inside a table)
-    if not data_bytes:
-        # create empty buffer (no data)
-        tflite.Buffer.BufferStart(builder)
-        buf_off = tflite.Buffer.BufferEnd(builder)
-        return buf_off
-    data_vec = builder.CreateByteVector(data_bytes)
-    tflite.Buffer.BufferStart(builder)
-    tflite.Buffer.BufferAddData(builder, data_vec)
-    buf_off = tflite.Buffer.BufferEnd(builder)
-    return buf_off
-
-def create_tensor_offset(builder, name_str, shape_list, ttype, buffer_idx):
-    # create name and shape vector BEFORE starting the Tensor table
-    name_off = builder.CreateString(name_str) if name_str else 0
+from bindings import tfl as tflite
+from model_io import (buffer_data_view, builder_size_hint, create_buffer, create_quantization, map_file, vec_int,
+                      write_builder)
+
+def create_tensor_offset(builder, name_str, shape_list, ttype, buffer_idx, quantization=None):
+    # create name, shape vector and quantization BEFORE starting the Tensor table
+    name_off = builder.CreateSharedString(name_str) if name_str else 0
     shape_vec = vec_int(builder, shape_list) if shape_list else 0
+    quant_off = create_quantization(builder, quantization)
 
     tflite.Tensor.TensorStart(builder)
     if shape_vec:
@@ -39,14 +18,16 @@ def create_tensor_offset(builder, name_str, shape_list, ttype, buffer_idx):
     tflite.Tensor.TensorAddBuffer(builder, buffer_idx)
     if name_off:
         tflite.Tensor.TensorAddName(builder, name_off)
+    if quant_off:
+        tflite.Tensor.TensorAddQuantization(builder, quant_off)
     return tflite.Tensor.TensorEnd(builder)
 
 def inject(input_path, output_path):
-    data = open(input_path, "rb").read()
+    data = map_file(input_path)
 
     # import Model class safely
     try:
-        model_mod = importlib.import_module("tflite.Model")
+        model_mod = tflite.module("Model")
         ModelGetRoot = getattr(model_mod, "Model").GetRootAsModel
     except Exception:
         # fallback
@@ -54,41 +35,25 @@ def inject(input_path, output_path):
 
     model = ModelGetRoot(data, 0)
 
-    # prepare builder with enough size
-    builder = flatbuffers.Builder(max(1024, len(data) * 2))
-
-    # --- BUFFERS: collect raw bytes from original model and create buffer offsets ---
-    orig_buffers = []
-    for i in range(model.BuffersLength()):
-        b = model.Buffers(i)
-        # get raw bytes (DataAsNumpy may exist)
-        raw = None
-        if hasattr(b, "DataAsNumpy"):
-            raw = b.DataAsNumpy()
-        else:
-            try:
-                raw = b.Data()
-            except Exception:
-                raw = None
-        if raw is None:
-            orig_buffers.append(None)
-        else:
-            try:
-                orig_buffers.append(bytes(raw))
-            except Exception:
-                orig_buffers.append(raw.tobytes())
+    # --- BUFFERS: zero-copy views into the original model (inline or external), copied once into the builder ---
+    orig_buffers = [buffer_data_view(data, model.Buffers(i)) for i in range(model.BuffersLength())]
+
+    # prepare builder sized from the input layout (no regrowth, no 2x preallocation)
+    builder = flatbuffers.Builder(builder_size_hint(model, data, orig_buffers))
 
     buffer_offsets = []
     for rb in orig_buffers:
-        buffer_offsets.append(create_buffer_offset(builder, rb))
+        buffer_offsets.append(create_buffer(builder, rb))
 
     # --- OPERATOR CODES ---
     opcode_offsets = []
     for i in range(model.OperatorCodesLength()):
         oc = model.OperatorCodes(i)
         # prepare custom_code string BEFORE starting OperatorCode table
-        custom_off = builder.CreateString(oc.CustomCode().decode()) if oc.CustomCode() else 0
+        custom_off = builder.CreateSharedString(oc.CustomCode().decode()) if oc.CustomCode() else 0
         tflite.OperatorCode.OperatorCodeStart(builder)
+        # readers take deprecated_builtin_code for every code below PLACEHOLDER_FOR_GREATER_OP_CODES (127)
+        tflite.OperatorCode.OperatorCodeAddDeprecatedBuiltinCode(builder, min(oc.BuiltinCode(), 127))
         tflite.OperatorCode.OperatorCodeAddBuiltinCode(builder, oc.BuiltinCode())
         tflite.OperatorCode.OperatorCodeAddVersion(builder, oc.Version())
         if custom_off:
@@ -110,7 +75,7 @@ def inject(input_path, output_path):
             t = sg.Tensors(ti)
             name = t.Name().decode() if t.Name() else ""
             shape = [t.Shape(j) for j in range(t.ShapeLength())] if t.ShapeLength() else []
-            tensor_offsets.append(create_tensor_offset(builder, name, shape, t.Type(), t.Buffer()))
+            tensor_offsets.append(create_tensor_offset(builder, name, shape, t.Type(), t.Buffer(), t.Quantization()))
 
         # OPERATORS: for each operator, create inputs/outputs vectors BEFORE starting Operator table
         op_offsets = []
@@ -121,25 +86,27 @@ def inject(input_path, output_path):
             inp_vec = vec_int(builder, inputs) if inputs else 0
             out_vec = vec_int(builder, outputs) if outputs else 0
 
-            tflite.Operator.OperatorStart(builder)
-            tflite.Operator.OperatorAddOpcodeIndex(builder, op.OpcodeIndex())
-            if inp_vec:
-                tflite.Operator.OperatorAddInputs(builder, inp_vec)
-            if out_vec:
-                tflite.Operator.OperatorAddOutputs(builder, out_vec)
-
-            # If this operator is FULLY_CONNECTED, build FullyConnectedOptions BEFORE ending operator
+            # If this operator is FULLY_CONNECTED, build FullyConnectedOptions BEFORE starting the operator
             opcode_idx = op.OpcodeIndex()
             builtin_code = model.OperatorCodes(opcode_idx).BuiltinCode() if opcode_idx < model.OperatorCodesLength() else None
+            fc_off = 0
             if builtin_code == BUILTIN_FULLY:
                 # build options (these are simple: no vectors inside)
                 tflite.FullyConnectedOptions.FullyConnectedOptionsStart(builder)
                 tflite.FullyConnectedOptions.FullyConnectedOptionsAddKeepNumDims(builder, 1)
                 fc_off = tflite.FullyConnectedOptions.FullyConnectedOptionsEnd(builder)
+            # else: leave options absent (copying arbitrary existing options exactly is more involved)
+
+            tflite.Operator.OperatorStart(builder)
+            tflite.Operator.OperatorAddOpcodeIndex(builder, op.OpcodeIndex())
+            if inp_vec:
+                tflite.Operator.OperatorAddInputs(builder, inp_vec)
+            if out_vec:
+                tflite.Operator.OperatorAddOutputs(builder, out_vec)
+            if fc_off:
                 tflite.Operator.OperatorAddBuiltinOptions(builder, fc_off)
                 if BUILTINOPT_FC is not None:
                     tflite.Operator.OperatorAddBuiltinOptionsType(builder, BUILTINOPT_FC)
-            # else: leave options absent (copying arbitrary existing options exactly is more involved)
 
             op_offsets.append(tflite.Operator.OperatorEnd(builder))
 
@@ -164,7 +131,7 @@ def inject(input_path, output_path):
             builder.PrependUOffsetTRelative(oo)
         ops_vec = builder.EndVector()
 
-        name_off = builder.CreateString(sg.Name().decode() if sg.Name() else "")
+        name_off = builder.CreateSharedString(sg.Name().decode() if sg.Name() else "")
 
         tflite.SubGraph.SubGraphStart(builder)
         tflite.SubGraph.SubGraphAddTensors(builder, tensors_vec)
@@ -195,18 +162,20 @@ def inject(input_path, output_path):
         builder.PrependUOffsetTRelative(b_off)
     buffers_vec = builder.EndVector()
 
+    description = builder.CreateString("Injected keep_num_dims")
+
     # build model
     tflite.Model.ModelStart(builder)
+    tflite.Model.ModelAddVersion(builder, 3)
     tflite.Model.ModelAddOperatorCodes(builder, opcodes_vec)
     tflite.Model.ModelAddSubgraphs(builder, subgraphs_vec)
     tflite.Model.ModelAddBuffers(builder, buffers_vec)
-    tflite.Model.ModelAddDescription(builder, builder.CreateString("Injected keep_num_dims"))
+    tflite.Model.ModelAddDescription(builder, description)
     model_off = tflite.Model.ModelEnd(builder)
-    builder.Finish(model_off)
+    # the interpreter rejects a model without the file identifier
+    builder.Finish(model_off, b"TFL3")
 
-    out = builder.Output()
-    with open(output_path, "wb") as f:
-        f.write(out)
+    write_builder(builder, output_path)
     print("[OK] Saved:", output_path)
 
 
@@ -214,9 +183,5 @@ if __name__ == "__main__":
     if len(sys.argv) != 3:
         print("Usage: python inject_keep_num_dims_fixed.py input.tflite output.tflite")
         sys.exit(1)
-    inject = inject  # no-op to satisfy linters
-    inject = None
-    # call function
-    inject = locals().get('inject') or globals().get('inject')  # ensure name resolution
     inject(sys.argv[1], sys.argv[2])
 
@@ -1,36 +1,15 @@
 import flatbuffers
-import importlib
 import sys
-import tflite
+
+from bindings import tfl as tflite
+from model_io import (buffer_data_view, builder_size_hint, create_buffer, create_quantization, create_string, map_file,
+                      vec_int, write_builder)
 
 
 # ------------------------------------------------------------
 # Helpers
 # ------------------------------------------------------------
 
-def vec_int(builder, values):
-    if not values:
-        return 0
-    builder.StartVector(4, len(values), 4)
-    for v in reversed(values):
-        builder.PrependInt32(v)
-    return builder.EndVector()
-
-
-def create_string(builder, s):
-    return builder.CreateString(s) if s else 0
-
-
-def create_buffer(builder, raw_bytes):
-    if not raw_bytes:
-        tflite.Buffer.BufferStart(builder)
-        return tflite.Buffer.BufferEnd(builder)
-    off = builder.CreateByteVector(raw_bytes)
-    tflite.Buffer.BufferStart(builder)
-    tflite.Buffer.BufferAddData(builder, off)
-    return tflite.Buffer.BufferEnd(builder)
-
-
 def load_fc_options_from_original(data, op, fc_enum_type):
     """Lê as FullyConnectedOptions originais para preservar fused_activation_function."""
     if op.BuiltinOptionsType() != fc_enum_type:
@@ -57,18 +36,16 @@ def load_fc_options_from_original(data, op, fc_enum_type):
 # ------------------------------------------------------------
 
 def inject_keepdims(input_path, output_path):
-    data = open(input_path, "rb").read()
+    data = map_file(input_path)
 
     # Carregar Model class
     try:
-        ModelClass = importlib.import_module("tflite.Model").Model
+        ModelClass = tflite.module("Model").Model
     except Exception:
         ModelClass = tflite.Model.Model
 
     model = ModelClass.GetRootAsModel(data, 0)
 
-    builder = flatbuffers.Builder(len(data) * 3)
-
     # Enums
     BUILTIN_FC = getattr(tflite, "BuiltinOperator_FULLY_CONNECTED", None)
     BUILTINOPTIONS_FC = getattr(tflite, "BuiltinOptions_FullyConnectedOptions", None)
@@ -76,20 +53,9 @@ def inject_keepdims(input_path, output_path):
     # ---------------------------------------------------------
     # Buffers
     # ---------------------------------------------------------
-    orig_buffers = []
-    for i in range(model.BuffersLength()):
-        b = model.Buffers(i)
-        if hasattr(b, "DataAsNumpy"):
-            raw = b.DataAsNumpy()
-        else:
-            raw = b.Data()
-        if raw is None:
-            orig_buffers.append(None)
-        else:
-            try:
-                orig_buffers.append(bytes(raw))
-            except:
-                orig_buffers.append(raw.tobytes())
+    # Fatias do arquivo original, copiadas uma única vez para dentro do builder
+    orig_buffers = [buffer_data_view(data, model.Buffers(i)) for i in range(model.BuffersLength())]
+    builder = flatbuffers.Builder(builder_size_hint(model, data, orig_buffers))
 
     buffer_offs = [create_buffer(builder, rb) for rb in orig_buffers]
 
@@ -102,6 +68,8 @@ def inject_keepdims(input_path, output_path):
         cc = oc.CustomCode().decode() if oc.CustomCode() else None
         cc_off = create_string(builder, cc)
         tflite.OperatorCode.OperatorCodeStart(builder)
+        # readers take deprecated_builtin_code for every code below PLACEHOLDER_FOR_GREATER_OP_CODES (127)
+        tflite.OperatorCode.OperatorCodeAddDeprecatedBuiltinCode(builder, min(oc.BuiltinCode(), 127))
         tflite.OperatorCode.OperatorCodeAddBuiltinCode(builder, oc.BuiltinCode())
         tflite.OperatorCode.OperatorCodeAddVersion(builder, oc.Version())
         if cc_off:
@@ -124,6 +92,8 @@ def inject_keepdims(input_path, output_path):
 
             name_off = create_string(builder, name)
             shape_off = vec_int(builder, shape)
+            # scale/zero_point por canal: sem eles os modelos int8 perdem os kernels inteiros
+            quant_off = create_quantization(builder, t.Quantization())
 
             tflite.Tensor.TensorStart(builder)
             if shape_off:
@@ -132,6 +102,8 @@ def inject_keepdims(input_path, output_path):
             tflite.Tensor.TensorAddBuffer(builder, t.Buffer())
             if name_off:
                 tflite.Tensor.TensorAddName(builder, name_off)
+            if quant_off:
+                tflite.Tensor.TensorAddQuantization(builder, quant_off)
             tensor_offs.append(tflite.Tensor.TensorEnd(builder))
 
         # Operators
@@ -152,16 +124,11 @@ def inject_keepdims(input_path, output_path):
             except:
                 builtin = None
 
-            tflite.Operator.OperatorStart(builder)
-            tflite.Operator.OperatorAddOpcodeIndex(builder, opcode_idx)
-            if in_vec:
-                tflite.Operator.OperatorAddInputs(builder, in_vec)
-            if out_vec:
-                tflite.Operator.OperatorAddOutputs(builder, out_vec)
-
             # ---------------------------------------------------------
             # Se for FULLY_CONNECTED → copiar options e injetar keep_num_dims
+            # (a tabela de options é criada antes de OperatorStart: o builder não aceita aninhar)
             # ---------------------------------------------------------
+            fc_off = 0
             if builtin == BUILTIN_FC:
                 fused = load_fc_options_from_original(data, op, BUILTINOPTIONS_FC)
 
@@ -176,6 +143,14 @@ def inject_keepdims(input_path, output_path):
 
                 fc_off = tflite.FullyConnectedOptions.FullyConnectedOptionsEnd(builder)
 
+            tflite.Operator.OperatorStart(builder)
+            tflite.Operator.OperatorAddOpcodeIndex(builder, opcode_idx)
+            if in_vec:
+                tflite.Operator.OperatorAddInputs(builder, in_vec)
+            if out_vec:
+                tflite.Operator.OperatorAddOutputs(builder, out_vec)
+
+            if fc_off:
                 tflite.Operator.OperatorAddBuiltinOptions(builder, fc_off)
 
                 if BUILTINOPTIONS_FC is not None:
@@ -232,18 +207,19 @@ def inject_keepdims(input_path, output_path):
         builder.PrependUOffsetTRelative(x)
     buffers_vec = builder.EndVector()
 
+    description = builder.CreateString("Injected keep_num_dims")
+
     tflite.Model.ModelStart(builder)
     tflite.Model.ModelAddVersion(builder, 3)
     tflite.Model.ModelAddOperatorCodes(builder, opcodes_vec)
     tflite.Model.ModelAddSubgraphs(builder, subgraphs_vec)
     tflite.Model.ModelAddBuffers(builder, buffers_vec)
-    tflite.Model.ModelAddDescription(builder, builder.CreateString("Injected keep_num_dims"))
+    tflite.Model.ModelAddDescription(builder, description)
     model_off = tflite.Model.ModelEnd(builder)
 
     builder.Finish(model_off, b"TFL3")
 
-    with open(output_path, "wb") as f:
-        f.write(builder.Output())
+    write_builder(builder, output_path)
 
     print("✔ Modelo salvo:", output_path)
     print("✔ keep_num_dims = TRUE aplicado")
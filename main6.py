@@ -1,144 +1,928 @@
+import argparse
+import concurrent.futures
 import flatbuffers
-import importlib
+import hashlib
+import numpy as np
+import shutil
+import struct
 import sys
-import tflite
-
-def vec_int(builder, values):
-    if not values:
-        return 0
-    builder.StartVector(4, len(values), 4)
-    for v in reversed(values):
-        builder.PrependInt32(v)
-    return builder.EndVector()
 
-def create_string(builder, s):
-    return builder.CreateString(s) if s else 0
+import bindings
+import graph_ir
+import instrument
+import model_cache
+import model_io
+import shape_infer
+import table_copy
+import weight_compress
+from bindings import tfl as tflite
+from model_io import (EXTERNAL_ALIGNMENT, buffer_data_range, buffer_data_view, builder_size_hint, check_alignment,
+                      create_buffer, create_external_buffer, create_string, is_external, map_file, vec_int,
+                      write_builder)
+
+# vtable offsets (4 + 2 * slot) of the fields the patch mode touches
+OPERATOR_VT_OPCODE_INDEX = 4
+OPERATOR_VT_BUILTIN_OPTIONS = 12
+FC_VT_FUSED_ACTIVATION_FUNCTION = 4
+FC_VT_KEEP_NUM_DIMS = 8
+# every FullyConnectedOptions field (fused_activation_function .. quantized_bias_type) is one byte
+FC_BYTE_FIELDS = 5
+TENSOR_VT_BUFFER = 8
+TENSOR_VT_NAME = 10
+# BuiltinOperator.PLACEHOLDER_FOR_GREATER_OP_CODES: cap of OperatorCode.deprecated_builtin_code
+PLACEHOLDER_FOR_GREATER_OP_CODES = 127
+# Buffer.data start in the rebuilt file: runtimes that use mmapped weights in place (XNNPack) want 16 or 64
+WEIGHT_ALIGNMENT = 16
+# flatbuffers can't address past 2 GB; above this the rebuild moves big buffers out automatically
+EXTERNAL_AUTO_SIZE = (1 << 31) - (64 << 20)
+EXTERNAL_DEFAULT_THRESHOLD = 1 << 20
+
+def enum_value(flat_name, enum_name, member):
+    value = getattr(tflite, flat_name, None)
+    if value is not None:
+        return value
+    enum = getattr(tflite, enum_name, None)
+    enum = getattr(enum, enum_name, enum)
+    return getattr(enum, member, None)
+
+def enum_names(enum_name):
+    enum = getattr(tflite, enum_name, None)
+    enum = getattr(enum, enum_name, enum)
+    return {v: k for k, v in vars(enum).items() if not k.startswith("_") and isinstance(v, int)}
 
-def create_buffer(builder, raw_bytes):
-    if not raw_bytes:
-        tflite.Buffer.BufferStart(builder)
-        return tflite.Buffer.BufferEnd(builder)
-    off = builder.CreateByteVector(raw_bytes)
-    tflite.Buffer.BufferStart(builder)
-    tflite.Buffer.BufferAddData(builder, off)
-    return tflite.Buffer.BufferEnd(builder)
+def int_vector(values):
+    # *AsNumpy returns 0 instead of an array when the vector is absent
+    return values if isinstance(values, np.ndarray) else np.zeros(0, dtype=np.int32)
 
-def load_fc_options_from_original(data, op, fc_enum_type):
+def hash_buffer(view):
+    # hashlib releases the GIL on large inputs, so this runs in parallel threads
+    return (len(view), hashlib.blake2b(view, digest_size=32).digest()) if view else None
+
+def dedup_buffers(views, workers=None):
+    """Keep one copy of each distinct non-empty buffer; returns (kept views, old index -> new index)."""
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        digests = list(pool.map(hash_buffer, views))
+    kept, remap, seen = [], [], {}
+    for view, digest in zip(views, digests):
+        if digest is not None and digest in seen:
+            remap.append(seen[digest])
+            continue
+        if digest is not None:
+            seen[digest] = len(kept)
+        remap.append(len(kept))
+        kept.append(view)
+    return kept, remap
+
+def fc_options_pos(op, fc_enum_type):
+    """Posição da FullyConnectedOptions original do operador, ou None se ele não tiver."""
     if op.BuiltinOptionsType() != fc_enum_type:
-        return 0
+        return None
     offset = op.BuiltinOptions()
-    if offset == 0:
-        return 0
-    try:
-        FC = tflite.FullyConnectedOptions.FullyConnectedOptions
-        obj = FC()
-        obj.Init(data, offset)
-        if hasattr(obj, "FusedActivationFunction"):
-            return obj.FusedActivationFunction()
-        return 0
-    except Exception:
-        return 0
+    if not offset:
+        return None
+    # bindings recentes devolvem uma flatbuffers.table.Table em vez do offset
+    return offset.Pos if hasattr(offset, "Pos") else offset
 
-def inject_keepdims(input_path, output_path):
-    data = open(input_path, "rb").read()
+def load_model(data):
     try:
-        ModelClass = importlib.import_module("tflite.Model").Model
+        ModelClass = tflite.module("Model").Model
     except Exception:
         ModelClass = tflite.Model.Model
-    model = ModelClass.GetRootAsModel(data, 0)
-    builder = flatbuffers.Builder(max(1024, len(data) * 2))
-    BUILTIN_FC = getattr(tflite, "BuiltinOperator_FULLY_CONNECTED", None)
-    BUILTINOPTIONS_FC = getattr(tflite, "BuiltinOptions_FullyConnectedOptions", None)
-    orig_buffers = []
-    for i in range(model.BuffersLength()):
-        b = model.Buffers(i)
-        if hasattr(b, "DataAsNumpy"):
-            raw = b.DataAsNumpy()
-        else:
-            raw = b.Data() if hasattr(b, "Data") else None
-        if raw is None:
-            orig_buffers.append(None)
-        else:
-            try:
-                orig_buffers.append(bytes(raw))
-            except:
-                orig_buffers.append(raw.tobytes())
-    buffer_offs = [create_buffer(builder, rb) for rb in orig_buffers]
-    opcode_offs = []
-    for i in range(model.OperatorCodesLength()):
-        oc = model.OperatorCodes(i)
-        cc = oc.CustomCode().decode() if oc.CustomCode() else None
-        cc_off = create_string(builder, cc)
-        tflite.OperatorCode.OperatorCodeStart(builder)
-        tflite.OperatorCode.OperatorCodeAddBuiltinCode(builder, oc.BuiltinCode())
-        tflite.OperatorCode.OperatorCodeAddVersion(builder, oc.Version())
-        if cc_off:
-            tflite.OperatorCode.OperatorCodeAddCustomCode(builder, cc_off)
-        opcode_offs.append(tflite.OperatorCode.OperatorCodeEnd(builder))
-    subgraph_offs = []
+    return ModelClass.GetRootAsModel(data, 0)
+
+def fc_enums():
+    return (enum_value("BuiltinOperator_FULLY_CONNECTED", "BuiltinOperator", "FULLY_CONNECTED"),
+            enum_value("BuiltinOptions_FullyConnectedOptions", "BuiltinOptions", "FullyConnectedOptions"))
+
+def fc_option_values(data, fc_pos):
+    """Todos os campos (um byte cada) da FullyConnectedOptions em fc_pos, por slot, com keep_num_dims=1.
+
+    fc_pos None = operador sem options (tudo default). None se a tabela tiver mais campos do que
+    FC_BYTE_FIELDS (schema mais novo, com campos que não sabemos copiar).
+    """
+    n_fields = (FC_VT_KEEP_NUM_DIMS - 4) // 2 + 1
+    values = [0] * n_fields
+    if fc_pos is not None:
+        old = flatbuffers.table.Table(data, fc_pos)
+        vt = fc_pos - struct.unpack_from("<i", data, fc_pos)[0]
+        n_fields = max(n_fields, (struct.unpack_from("<H", data, vt)[0] - 4) // 2)
+        if n_fields > FC_BYTE_FIELDS:
+            return None
+        values = []
+        for slot in range(n_fields):
+            o = old.Offset(4 + 2 * slot)
+            values.append(data[fc_pos + o] if o else 0)
+    values[(FC_VT_KEEP_NUM_DIMS - 4) // 2] = 1
+    return values
+
+def pack_fc_options(data, fc_pos):
+    """Serializa uma FullyConnectedOptions autocontida copiando os campos da original e com keep_num_dims=1."""
+    values = fc_option_values(data, fc_pos)
+    if values is None:
+        return None
+    n_fields = len(values)
+    vtable = struct.pack("<%dH" % (2 + n_fields), 4 + 2 * n_fields, 4 + n_fields,
+                         *[4 + slot for slot in range(n_fields)])
+    vtable += b"\0" * (-len(vtable) % 4)
+    table = struct.pack("<i", len(vtable)) + bytes(values)
+    table += b"\0" * (-len(table) % 4)
+    return len(vtable), vtable + table
+
+def patch_keepdims(input_path, output_path, recorder=None):
+    """Reescreve keep_num_dims=1 direto numa cópia do arquivo, sem reconstruir o modelo.
+
+    Quando o campo existe na tabela de options ele é sobrescrito no lugar; senão uma nova
+    FullyConnectedOptions é anexada ao fim do arquivo e só o ponteiro builtin_options do
+    operador é realocado. Operadores FC sem options caem no rebuild completo.
+    """
+    rec = recorder or instrument.PhaseRecorder()
+    with rec.phase("load"):
+        data = map_file(input_path)
+        model = load_model(data)
+        BUILTIN_FC, BUILTINOPTIONS_FC = fc_enums()
+        fc_opcodes = {i for i in range(model.OperatorCodesLength())
+                      if model.OperatorCodes(i).BuiltinCode() == BUILTIN_FC}
+    tail = bytearray(b"\0" * (-len(data) % 4))
+    relocated = {}
+    patches = []
+    in_place = appended = 0
     for sg_i in range(model.SubgraphsLength()):
         sg = model.Subgraphs(sg_i)
-        tensor_offs = []
+        with rec.phase("scan", subgraph=sg_i) as phase:
+            phase["items"] = sg.OperatorsLength()
+            for oi in range(sg.OperatorsLength()):
+                op = sg.Operators(oi)
+                if op.OpcodeIndex() not in fc_opcodes:
+                    continue
+                o = op._tab.Offset(OPERATOR_VT_BUILTIN_OPTIONS)
+                if op.BuiltinOptionsType() != BUILTINOPTIONS_FC or o == 0:
+                    print("FULLY_CONNECTED without FullyConnectedOptions, falling back to full rebuild")
+                    return inject_keepdims(input_path, output_path, recorder=recorder)
+                field_pos = op._tab.Pos + o
+                fc_pos = op._tab.Indirect(field_pos)
+                keep = flatbuffers.table.Table(data, fc_pos).Offset(FC_VT_KEEP_NUM_DIMS)
+                if keep:
+                    patches.append((fc_pos + keep, b"\1"))
+                    in_place += 1
+                    continue
+                if fc_pos not in relocated:
+                    packed = pack_fc_options(data, fc_pos)
+                    if packed is None:
+                        print("Unknown FullyConnectedOptions layout, falling back to full rebuild")
+                        return inject_keepdims(input_path, output_path, recorder=recorder)
+                    table_off, blob = packed
+                    relocated[fc_pos] = len(data) + len(tail) + table_off
+                    tail += blob
+                new_pos = relocated[fc_pos]
+                if new_pos - field_pos >= 1 << 32:
+                    raise ValueError("appended options table is out of uoffset range")
+                patches.append((field_pos, struct.pack("<I", new_pos - field_pos)))
+                appended += 1
+    with rec.phase("copy") as phase:
+        phase["items"] = len(data)
+        shutil.copyfile(input_path, output_path)
+    with rec.phase("write") as phase:
+        phase["items"] = len(patches)
+        with open(output_path, "r+b") as f:
+            for pos, value in patches:
+                f.seek(pos)
+                f.write(value)
+            f.seek(len(data))
+            f.write(tail)
+    print("Patched:", output_path, "(%d in place, %d relocated)" % (in_place, appended))
+
+def scan_keepdims(input_path, recorder=None):
+    """Conta os FULLY_CONNECTED e quantos já têm keep_num_dims=1, sem reconstruir nada.
+
+    Lê só opcodes, a lista de operadores e as tabelas de options dos FC direto do mmap:
+    tensores e pesos nunca são tocados, então só as páginas de metadados são carregadas.
+    """
+    rec = recorder or instrument.PhaseRecorder()
+    with rec.phase("scan") as phase:
+        data = map_file(input_path)
+        buf = np.frombuffer(data, dtype=np.uint8)
+        BUILTIN_FC, BUILTINOPTIONS_FC = fc_enums()
+        root = graph_ir.root_table(buf)
+        opcodes = graph_ir.table_vector(buf, graph_ir.offset_field(buf, [root], graph_ir.MODEL_VT_OPERATOR_CODES)[0])
+        fc_opcodes = np.flatnonzero(graph_ir.opcode_builtin_codes(buf, opcodes) == BUILTIN_FC)
+        subgraphs = graph_ir.table_vector(buf, graph_ir.offset_field(buf, [root], graph_ir.MODEL_VT_SUBGRAPHS)[0])
+        ops = [graph_ir.table_vector(buf, graph_ir.offset_field(buf, [sg], graph_ir.SUBGRAPH_VT_OPERATORS)[0])
+               for sg in subgraphs]
+        ops = np.concatenate(ops) if ops else np.zeros(0, dtype=np.int64)
+        fc = ops[np.isin(graph_ir.scalar_field(buf, ops, graph_ir.OPERATOR_VT_OPCODE_INDEX, np.uint32), fc_opcodes)]
+        options = graph_ir.offset_field(buf, fc, graph_ir.OPERATOR_VT_BUILTIN_OPTIONS)
+        has_options = (options >= 0) & (graph_ir.scalar_field(
+            buf, fc, graph_ir.OPERATOR_VT_BUILTIN_OPTIONS_TYPE, np.uint8) == BUILTINOPTIONS_FC)
+        options = options[has_options]
+        keep = graph_ir.scalar_field(buf, options, FC_VT_KEEP_NUM_DIMS, np.uint8)
+        fused = graph_ir.scalar_field(buf, options, FC_VT_FUSED_ACTIVATION_FUNCTION, np.int8)
+        phase["items"] = len(ops)
+    names = enum_names("ActivationFunctionType")
+    values, counts = np.unique(fused, return_counts=True)
+    return {
+        "input": input_path,
+        "subgraphs": len(subgraphs),
+        "operators": len(ops),
+        "fc_ops": len(fc),
+        "keep_num_dims": int(np.count_nonzero(keep)),
+        "without_options": int(len(fc) - len(options)),
+        "fused_activations": {names.get(v, str(v)): c for v, c in zip(values.tolist(), counts.tolist())},
+        "compliant": bool(np.count_nonzero(keep) == len(fc)),
+    }
+
+def print_scan(report):
+    fused = ", ".join("%s=%d" % item for item in sorted(report["fused_activations"].items()))
+    print("%s: %d FULLY_CONNECTED, %d with keep_num_dims=1, %d without options%s -> %s"
+          % (report["input"], report["fc_ops"], report["keep_num_dims"], report["without_options"],
+             " (%s)" % fused if fused else "", "compliant" if report["compliant"] else "needs rewrite"))
+
+class RewriteContext:
+    """Estado compartilhado pelos hooks durante a única travessia do modelo."""
+
+    def __init__(self, data, model):
+        self.data = data
+        self.model = model
+        self.builtin_codes = [model.OperatorCodes(i).BuiltinCode() for i in range(model.OperatorCodesLength())]
+        self.subgraph_index = None
+        self.subgraph = None
+        self.copier = None
+        # passes whose prepare already ran, in pipeline order
+        self.prepared = []
+        self._ir = None
+
+    @property
+    def ir(self):
+        # struct-of-arrays view of the input, built on first use for vectorized queries
+        if self._ir is None:
+            self._ir = graph_ir.build_ir(self.data)
+        return self._ir
+
+    def builtin_code(self, opcode_index):
+        return self.builtin_codes[opcode_index] if opcode_index < len(self.builtin_codes) else None
+
+# returned by a hook to leave the table (or buffer) out; the remaining ones are renumbered
+DROP = object()
+
+class Transform:
+    """Base dos passes do rebuild: sobrescreva só os hooks necessários.
+
+    Os hooks de tabela recebem o accessor original e os campos já alterados por passes
+    anteriores (None enquanto ninguém mexeu na tabela) e devolvem os campos a emitir, ou
+    DROP para remover a tabela. Índices de tensor, buffer e opcode nos campos são sempre os
+    da entrada. Todos os passes rodam na mesma travessia e na mesma serialização.
+    """
+
+    def prepare(self, ctx):
+        # called once before the buffers, e.g. to plan removals that span subgraphs
+        pass
+
+    def edits(self, ctx, index):
+        # (operators, tensors, {tensor: replacement}) this pass drops/rewires in subgraph index,
+        # known once prepare ran: later passes plan against the graph as it will be written
+        return set(), set(), {}
+
+    def buffer(self, ctx, index, view):
+        return view
+
+    def subgraph(self, ctx, index, sg):
+        # called before the tensors of each rebuilt subgraph, e.g. to plan removals
+        pass
+
+    def opcode(self, ctx, index, oc, fields):
+        return fields
+
+    def tensor(self, ctx, index, t, fields):
+        return fields
+
+    def operator(self, ctx, index, op, fields):
+        return fields
+
+    # Tables a pass adds: fields dicts appended after the input's opcodes/tensors (their
+    # indices continue the input numbering from base) or emitted before the input's operators.
+
+    def extra_opcodes(self, ctx, base):
+        return []
+
+    def extra_tensors(self, ctx, index, base):
+        return []
+
+    def extra_operators(self, ctx, index):
+        return []
+
+def opcode_fields(oc):
+    return {"builtin_code": oc.BuiltinCode(), "version": oc.Version(),
+            "custom_code": oc.CustomCode().decode() if oc.CustomCode() else None}
+
+def quantization_fields(q, copier=None):
+    # min/max/scale/zero_point as numpy views of the input (AsNumpy returns 0 for an absent vector);
+    # per-channel arrays are copied in bulk by CreateNumpyVector, never element by element
+    if q is None:
+        return None
+    fields = {key: None if isinstance(arr, int) else arr
+              for key, arr in (("min", q.MinAsNumpy()), ("max", q.MaxAsNumpy()),
+                               ("scale", q.ScaleAsNumpy()), ("zero_point", q.ZeroPointAsNumpy()))}
+    fields["quantized_dimension"] = q.QuantizedDimension()
+    fields["details_type"], fields["details"] = 0, None
+    details_type = q.DetailsType()
+    details = q.Details() if details_type else None
+    member = table_copy.union_member("QuantizationDetails", details_type) if details else None
+    if copier is not None and member:
+        pos = details.Pos if hasattr(details, "Pos") else details
+        fields["details_type"] = details_type
+        fields["details"] = lambda builder: copier.copy(member, pos) or 0
+    return fields
+
+def tensor_fields(t, copier=None):
+    signature = t.ShapeSignatureAsNumpy()
+    return {"name": t.Name().decode() if t.Name() else "",
+            "shape": int_vector(t.ShapeAsNumpy()),
+            "shape_signature": None if isinstance(signature, int) else signature,
+            "type": t.Type(), "buffer": t.Buffer(), "is_variable": t.IsVariable(),
+            "quantization": quantization_fields(t.Quantization(), copier)}
+
+def operator_fields(op, copier=None):
+    # options: None, or a callable(builder) -> offset, called before OperatorStart;
+    # with a copier the original builtin options are carried over as raw bytes
+    custom = op.CustomOptionsAsNumpy()
+    mutating = op.MutatingVariableInputsAsNumpy()
+    fields = {"opcode_index": op.OpcodeIndex(),
+              "inputs": int_vector(op.InputsAsNumpy()),
+              "outputs": int_vector(op.OutputsAsNumpy()),
+              "intermediates": int_vector(op.IntermediatesAsNumpy()),
+              "options_type": 0, "options": None,
+              "custom_options": None if isinstance(custom, int) else custom,
+              "custom_options_format": op.CustomOptionsFormat(),
+              "mutating_variable_inputs": None if isinstance(mutating, int) else mutating}
+    options_type = op.BuiltinOptionsType()
+    options = op.BuiltinOptions() if options_type else None
+    member = table_copy.union_member("BuiltinOptions", options_type) if options else None
+    if copier is not None and member:
+        pos = options.Pos if hasattr(options, "Pos") else options
+        fields["options_type"] = options_type
+        fields["options"] = lambda builder: copier.copy(member, pos) or 0
+    return fields
+
+def emit_opcode(builder, fields):
+    cc_off = create_string(builder, fields["custom_code"])
+    tflite.OperatorCode.OperatorCodeStart(builder)
+    if hasattr(tflite.OperatorCode, "OperatorCodeAddDeprecatedBuiltinCode"):
+        # readers take deprecated_builtin_code for every code below the placeholder
+        tflite.OperatorCode.OperatorCodeAddDeprecatedBuiltinCode(
+            builder, min(fields["builtin_code"], PLACEHOLDER_FOR_GREATER_OP_CODES))
+    tflite.OperatorCode.OperatorCodeAddBuiltinCode(builder, fields["builtin_code"])
+    tflite.OperatorCode.OperatorCodeAddVersion(builder, fields["version"])
+    if cc_off:
+        tflite.OperatorCode.OperatorCodeAddCustomCode(builder, cc_off)
+    return tflite.OperatorCode.OperatorCodeEnd(builder)
+
+def emit_quantization(builder, fields):
+    Q = tflite.QuantizationParameters
+    vecs = {key: builder.CreateNumpyVector(fields[key]) if fields[key] is not None else 0
+            for key in ("min", "max", "scale", "zero_point")}
+    details_off = fields["details"](builder) if fields["details"] else 0
+    Q.QuantizationParametersStart(builder)
+    if vecs["min"]:
+        Q.QuantizationParametersAddMin(builder, vecs["min"])
+    if vecs["max"]:
+        Q.QuantizationParametersAddMax(builder, vecs["max"])
+    if vecs["scale"]:
+        Q.QuantizationParametersAddScale(builder, vecs["scale"])
+    if vecs["zero_point"]:
+        Q.QuantizationParametersAddZeroPoint(builder, vecs["zero_point"])
+    if details_off:
+        Q.QuantizationParametersAddDetailsType(builder, fields["details_type"])
+        Q.QuantizationParametersAddDetails(builder, details_off)
+    Q.QuantizationParametersAddQuantizedDimension(builder, fields["quantized_dimension"])
+    return Q.QuantizationParametersEnd(builder)
+
+def emit_tensor(builder, fields):
+    name_off = create_string(builder, fields["name"])
+    shape_off = vec_int(builder, fields["shape"])
+    signature = fields.get("shape_signature")
+    signature_off = builder.CreateNumpyVector(np.asarray(signature, dtype=np.int32)) if signature is not None else 0
+    quant_off = emit_quantization(builder, fields["quantization"]) if fields.get("quantization") else 0
+    tflite.Tensor.TensorStart(builder)
+    if shape_off:
+        tflite.Tensor.TensorAddShape(builder, shape_off)
+    if signature_off:
+        tflite.Tensor.TensorAddShapeSignature(builder, signature_off)
+    tflite.Tensor.TensorAddType(builder, fields["type"])
+    tflite.Tensor.TensorAddBuffer(builder, fields["buffer"])
+    if name_off:
+        tflite.Tensor.TensorAddName(builder, name_off)
+    if quant_off:
+        tflite.Tensor.TensorAddQuantization(builder, quant_off)
+    if fields.get("is_variable"):
+        tflite.Tensor.TensorAddIsVariable(builder, True)
+    return tflite.Tensor.TensorEnd(builder)
+
+def emit_operator(builder, fields):
+    in_vec = vec_int(builder, fields["inputs"])
+    out_vec = vec_int(builder, fields["outputs"])
+    inter_vec = vec_int(builder, fields.get("intermediates", ()))
+    custom, mutating = fields.get("custom_options"), fields.get("mutating_variable_inputs")
+    custom_vec = builder.CreateNumpyVector(custom) if custom is not None and len(custom) else 0
+    mutating_vec = builder.CreateNumpyVector(mutating) if mutating is not None and len(mutating) else 0
+    options_off = fields["options"](builder) if fields["options"] else 0
+    tflite.Operator.OperatorStart(builder)
+    tflite.Operator.OperatorAddOpcodeIndex(builder, fields["opcode_index"])
+    if in_vec:
+        tflite.Operator.OperatorAddInputs(builder, in_vec)
+    if out_vec:
+        tflite.Operator.OperatorAddOutputs(builder, out_vec)
+    if options_off:
+        tflite.Operator.OperatorAddBuiltinOptions(builder, options_off)
+        tflite.Operator.OperatorAddBuiltinOptionsType(builder, fields["options_type"])
+    if custom_vec:
+        tflite.Operator.OperatorAddCustomOptions(builder, custom_vec)
+        tflite.Operator.OperatorAddCustomOptionsFormat(builder, fields["custom_options_format"])
+    if mutating_vec:
+        tflite.Operator.OperatorAddMutatingVariableInputs(builder, mutating_vec)
+    if inter_vec:
+        tflite.Operator.OperatorAddIntermediates(builder, inter_vec)
+    return tflite.Operator.OperatorEnd(builder)
+
+def create_fc_options(builder, values):
+    # every FullyConnectedOptions field is one byte: write them by slot, whatever the bindings know about
+    builder.StartObject(len(values))
+    for slot, value in enumerate(values):
+        builder.PrependUint8Slot(slot, value, 0)
+    return builder.EndObject()
+
+class KeepNumDims(Transform):
+    """FullyConnectedOptions.keep_num_dims=1 em todo FULLY_CONNECTED, preservando os demais campos
+    (ativação, weights_format, asymmetric_quantize_inputs, quantized_bias_type)."""
+
+    def __init__(self):
+        self.builtin_fc, self.options_fc = fc_enums()
+
+    def operator(self, ctx, index, op, fields):
+        if fields is DROP or ctx.builtin_code(op.OpcodeIndex()) != self.builtin_fc:
+            return fields
+        fields = fields or operator_fields(op, ctx.copier)
+        values = fc_option_values(ctx.data, fc_options_pos(op, self.options_fc))
+        if values is None:
+            raise ValueError("FullyConnectedOptions of operator %d has fields this tool can't copy" % index)
+        fields["options_type"] = self.options_fc
+        fields["options"] = lambda builder: create_fc_options(builder, values)
+        return fields
+
+class RemoveReshapes(Transform):
+    """Remove os RESHAPE que ficam redundantes com keep_num_dims=1 (vai depois de KeepNumDims).
+
+    Com keep_num_dims o FC já devolve input.shape[:-1] + [units], então saem o RESHAPE que
+    achatava a entrada (só as dimensões iniciais), o que restaurava o rank da saída e os
+    RESHAPE identidade. As comparações usam as shapes propagadas com keep_num_dims=1
+    (shape_infer), não as declaradas. Os consumidores passam a ler o tensor do outro lado do RESHAPE e os
+    tensores intermediários (e o tensor de shape constante) são removidos. Só shapes estáticas;
+    tensores de entrada/saída do subgraph nunca mudam.
+    """
+
+    def __init__(self):
+        self.builtin_fc = fc_enums()[0]
+        self.builtin_reshape = enum_value("BuiltinOperator_RESHAPE", "BuiltinOperator", "RESHAPE")
+        self.plans = []
+        self.drop_ops, self.drop_tensors, self.alias = set(), set(), {}
+
+    def prepare(self, ctx):
+        # every subgraph is planned up front so later passes (RemoveDead) see what goes away
+        self.plans = [self.plan(ctx, i, ctx.model.Subgraphs(i)) for i in range(ctx.model.SubgraphsLength())]
+
+    def edits(self, ctx, index):
+        return self.plans[index]
+
+    def subgraph(self, ctx, index, sg):
+        self.drop_ops, self.drop_tensors, self.alias = self.plans[index]
+        self.graph = ctx.ir.subgraphs[index]
+
+    def plan(self, ctx, index, sg):
+        drop_ops, drop_tensors, alias = set(), set(), {}
+        g = ctx.ir.subgraphs[index]
+        codes = ctx.ir.opcode_builtin[g.op_opcode] if g.num_operators else np.zeros(0, dtype=np.int32)
+        reshapes = set(np.flatnonzero(codes == self.builtin_reshape).tolist())
+        if not reshapes:
+            return drop_ops, drop_tensors, alias
+        in_ops = np.repeat(np.arange(g.num_operators), np.diff(g.op_input_offsets))
+        out_ops = np.repeat(np.arange(g.num_operators), np.diff(g.op_output_offsets))
+        used, made = g.op_inputs >= 0, g.op_outputs >= 0
+        n_consumers = np.bincount(g.op_inputs[used], minlength=g.num_tensors)
+        consumer = np.full(g.num_tensors, -1, dtype=np.int64)
+        consumer[g.op_inputs[used]] = in_ops[used]  # only read where there is a single consumer
+        producer = np.full(g.num_tensors, -1, dtype=np.int64)
+        producer[g.op_outputs[made]] = out_ops[made]
+        graph_io = set(g.inputs.tolist()) | set(g.outputs.tolist())
+        # shapes as they are once every FC keeps its leading dims, not the declared ones: a RESHAPE
+        # that flattened an FC output looks like an identity on the declared shapes
+        inferred = shape_infer.ShapeInference(ctx.data, ctx.model, ctx.ir, keep_num_dims=True).infer(index)
+
+        def shape(t):
+            return inferred[t][0] if t in inferred else tuple(g.shape(t).tolist())
+
+        def static(t):
+            if t in inferred:
+                return min(inferred[t][0] + inferred[t][1], default=0) >= 0
+            sig = sg.Tensors(t).ShapeSignatureAsNumpy()
+            return min(shape(t), default=0) >= 0 and (isinstance(sig, int) or not (sig < 0).any())
+
+        def same_quantization(a, b):
+            qa, qb = (quantization_fields(sg.Tensors(t).Quantization()) for t in (a, b))
+            if (qa is None) != (qb is None) or g.tensor_type[a] != g.tensor_type[b]:
+                return False
+            return qa is None or all(np.array_equal(qa[k], qb[k]) for k in ("scale", "zero_point"))
+
+        def inner(t):
+            # a tensor only one RESHAPE and one other op touch, so it can vanish with the RESHAPE
+            return t not in graph_io and n_consumers[t] == 1 and static(t)
+
+        def remove(r, gone, kept):
+            drop_ops.add(r)
+            drop_tensors.add(gone)
+            alias[gone] = kept
+            ins = g.op_input(r)
+            if len(ins) > 1 and ins[1] >= 0 and n_consumers[ins[1]] == 1 and producer[ins[1]] < 0 \
+                    and ins[1] not in graph_io:
+                drop_tensors.add(int(ins[1]))
+
+        for op in np.flatnonzero(codes == self.builtin_fc).tolist():
+            ins, outs = g.op_input(op).tolist(), g.op_output(op).tolist()
+            if len(ins) < 2 or len(outs) != 1 or len(g.shape(ins[1])) != 2 or min(ins[:2] + outs) < 0:
+                continue
+            x, y, units = ins[0], outs[0], int(g.shape(ins[1])[0])
+            r1, r2 = producer[x], consumer[y]
+            src = dst = None
+            if r1 in reshapes and r1 not in drop_ops and inner(x):
+                src = int(g.op_input(r1)[0])
+                if not (static(src) and shape(src)[-1:] == shape(x)[-1:] and same_quantization(src, x)):
+                    src = None
+            if r2 in reshapes and inner(y) and g.op_input(r2)[0] == y:
+                dst = int(g.op_output(r2)[0])
+                if not (static(dst) and same_quantization(y, dst)):
+                    dst = None
+            if src is not None and dst is not None and shape(src)[:-1] + (units,) == shape(dst):
+                remove(r1, x, src)
+                remove(r2, y, dst)
+            elif dst is not None and shape(x)[:-1] + (units,) == shape(dst):
+                remove(r2, y, dst)
+            elif src is not None and shape(src)[:-1] + (units,) == shape(y):
+                remove(r1, x, src)
+        for r in sorted(reshapes - drop_ops):
+            x, y = int(g.op_input(r)[0]), int(g.op_output(r)[0])
+            if y not in graph_io and static(x) and static(y) and shape(x) == shape(y) and same_quantization(x, y):
+                remove(r, y, x)
+        return drop_ops, drop_tensors, alias
+
+    def resolve(self, t):
+        while t in self.alias:
+            t = self.alias[t]
+        return t
+
+    def tensor(self, ctx, index, t, fields):
+        return DROP if index in self.drop_tensors else fields
+
+    def operator(self, ctx, index, op, fields):
+        if fields is DROP or index in self.drop_ops:
+            return DROP
+        if not self.alias or not any(int(t) in self.alias for t in np.concatenate(
+                [self.graph.op_input(index), self.graph.op_output(index)])):
+            return fields
+        fields = fields or operator_fields(op, ctx.copier)
+        fields["inputs"] = [self.resolve(int(t)) for t in fields["inputs"]]
+        fields["outputs"] = [self.resolve(int(t)) for t in fields["outputs"]]
+        return fields
+
+class InferShapes(Transform):
+    """Grava em shape e shape_signature as shapes propagadas com keep_num_dims=1 (vai depois de KeepNumDims).
+
+    Assim o interpreter planeja a memória uma vez, sem redimensionar tensores no AllocateTensors.
+    Constantes nunca mudam de shape.
+    """
+
+    def __init__(self):
+        self.changed = {}
+
+    def subgraph(self, ctx, index, sg):
+        # the engine holds the mmap, so it isn't kept on the (pickled) transform
+        engine = shape_infer.ShapeInference(ctx.data, ctx.model, ctx.ir, keep_num_dims=True)
+        g = ctx.ir.subgraphs[index]
+        self.changed = {t: dims for t, dims in engine.infer(index).items()
+                        if ctx.ir.buffer_data_size[g.tensor_buffer[t]] == 0}
+
+    def tensor(self, ctx, index, t, fields):
+        if fields is DROP or index not in self.changed:
+            return fields
+        fields = fields or tensor_fields(t, ctx.copier)
+        fields["shape"], fields["shape_signature"] = (np.asarray(d, dtype=np.int32) for d in self.changed[index])
+        return fields
+
+class RemoveDead(Transform):
+    """Remove operadores, tensores, buffers e opcodes que não alcançam nenhuma saída de subgraph.
+
+    Uma passada de trás para frente em cada subgraph (os operadores já vêm em ordem topológica)
+    marca vivo todo operador com alguma saída viva, e as entradas dele. Operadores com efeito
+    colateral ficam sempre: sem saídas, de estado/controle de fluxo, custom ou que leem um tensor
+    variável. Buffers sem tensor vivo (menos o buffer 0, o vazio) e opcodes sem operador vivo
+    saem do modelo; os índices são compactados na mesma serialização. A liveness é calculada no
+    grafo como os passes anteriores o deixam (edits): o tensor de shape de um RESHAPE removido
+    por RemoveReshapes leva junto o buffer dele.
+    """
+
+    SIDE_EFFECTS = {"ASSIGN_VARIABLE", "CALL", "CALL_ONCE", "CUSTOM", "DELEGATE", "IF", "WHILE"}
+
+    def __init__(self):
+        self.live_ops, self.live_tensors = [], []
+        self.used_buffers = self.used_opcodes = None
+
+    def prepare(self, ctx):
+        ir = ctx.ir
+        names = enum_names("BuiltinOperator")
+        keep = np.array([code for code, name in names.items() if name in self.SIDE_EFFECTS], dtype=np.int32)
+        self.used_buffers = np.zeros(ir.num_buffers, dtype=bool)
+        self.used_buffers[:1] = True
+        self.used_opcodes = np.zeros(len(ir.opcode_builtin), dtype=bool)
+        self.live_ops, self.live_tensors = [], []
+        for sg_i, g in enumerate(ir.subgraphs):
+            op_inputs, op_outputs, gone_ops, gone_tensors = self.edited(ctx, sg_i, g)
+            in_ops = np.repeat(np.arange(g.num_operators), np.diff(g.op_input_offsets))
+            out_ops = np.repeat(np.arange(g.num_operators), np.diff(g.op_output_offsets))
+            used = op_inputs >= 0
+            reads_variable = np.zeros(g.num_operators, dtype=bool)
+            reads_variable[in_ops[used][g.tensor_is_variable[op_inputs[used]]]] = True
+            codes = ir.opcode_builtin[np.minimum(g.op_opcode, len(ir.opcode_builtin) - 1)] \
+                if g.num_operators else np.zeros(0, dtype=np.int32)
+            root = ((np.diff(g.op_output_offsets) == 0) | np.isin(codes, keep) | reads_variable) & ~gone_ops
+            live_op = np.zeros(g.num_operators, dtype=bool)
+            live = np.zeros(g.num_tensors, dtype=bool)
+            live[g.outputs[g.outputs >= 0]] = True
+            ins, outs = op_inputs.tolist(), op_outputs.tolist()
+            in_off, out_off = g.op_input_offsets.tolist(), g.op_output_offsets.tolist()
+            for op in range(g.num_operators - 1, -1, -1):
+                if gone_ops[op]:
+                    continue
+                if root[op] or any(t >= 0 and live[t] for t in outs[out_off[op]:out_off[op + 1]]):
+                    live_op[op] = True
+                    for t in ins[in_off[op]:in_off[op + 1]]:
+                        if t >= 0:
+                            live[t] = True
+            # every output and intermediate of a kept operator stays, even if nothing reads it
+            made = op_outputs >= 0
+            live[op_outputs[made & live_op[out_ops]]] = True
+            inter_ops = np.repeat(np.arange(g.num_operators), np.diff(g.op_intermediate_offsets))
+            inter = g.op_intermediates >= 0
+            live[g.op_intermediates[inter & live_op[inter_ops]]] = True
+            live[g.inputs[g.inputs >= 0]] = True
+            live &= ~gone_tensors
+            self.live_ops.append(live_op)
+            self.live_tensors.append(live)
+            self.used_buffers[g.tensor_buffer[live]] = True
+            self.used_opcodes[g.op_opcode[live_op]] = True
+
+    def edited(self, ctx, index, g):
+        """op_inputs/op_outputs do subgraph com os tensores religados pelos passes anteriores, e as
+        máscaras dos operadores e tensores que eles removem."""
+        gone_ops = np.zeros(g.num_operators, dtype=bool)
+        gone_tensors = np.zeros(g.num_tensors, dtype=bool)
+        alias = {}
+        for tr in ctx.prepared:
+            ops, tensors, rewired = tr.edits(ctx, index)
+            gone_ops[list(ops)] = True
+            gone_tensors[list(tensors)] = True
+            alias.update(rewired)
+        if not alias:
+            return g.op_inputs, g.op_outputs, gone_ops, gone_tensors
+        resolved = np.arange(g.num_tensors, dtype=g.op_inputs.dtype)
+        for t in alias:
+            target = t
+            while target in alias:
+                target = alias[target]
+            resolved[t] = target
+
+        def rewire(ts):
+            return np.where(ts >= 0, resolved[np.maximum(ts, 0)], ts)
+        return rewire(g.op_inputs), rewire(g.op_outputs), gone_ops, gone_tensors
+
+    def buffer(self, ctx, index, view):
+        return view if self.used_buffers[index] else DROP
+
+    def opcode(self, ctx, index, oc, fields):
+        return fields if self.used_opcodes[index] else DROP
+
+    def tensor(self, ctx, index, t, fields):
+        return fields if self.live_tensors[ctx.subgraph_index][index] else DROP
+
+    def operator(self, ctx, index, op, fields):
+        return fields if self.live_ops[ctx.subgraph_index][index] else DROP
+
+class CompressWeights(Transform):
+    """Comprime no estágio de buffers os pesos float32 de FULLY_CONNECTED, CONV_2D e DEPTHWISE_CONV_2D.
+
+    fp16: o buffer vira float16 num tensor novo e um DEQUANTIZE no início do subgraph refaz o
+    tensor float32 original, que fica sem buffer; os consumidores não mudam.
+    int8: quantização só dos pesos, simétrica e por canal de saída (eixo 0; 3 no depthwise);
+    o tensor vira INT8 com scale/zero_point e o operador passa a usar o kernel híbrido.
+    Só entram buffers cujos tensores são todos pesos desses operadores (no int8, lidos só como
+    peso), inline ou externos (Buffer.offset/size). Vai por último, para não recriar pesos que
+    outro pass removeu.
+    """
+
+    MODES = ("fp16", "int8")
+    WEIGHT_AXIS = {"FULLY_CONNECTED": 0, "CONV_2D": 0, "DEPTHWISE_CONV_2D": 3}
+    # op_version: DEQUANTIZE with a float16 input
+    DEQUANTIZE_FP16_VERSION = 3
+
+    def __init__(self, mode):
+        if mode not in self.MODES:
+            raise ValueError("weight compression must be one of %s, got %r" % (", ".join(self.MODES), mode))
+        self.mode = mode
+        self.float32 = enum_value("TensorType_FLOAT32", "TensorType", "FLOAT32")
+        self.float16 = enum_value("TensorType_FLOAT16", "TensorType", "FLOAT16")
+        self.int8 = enum_value("TensorType_INT8", "TensorType", "INT8")
+        self.builtin_dequantize = enum_value("BuiltinOperator_DEQUANTIZE", "BuiltinOperator", "DEQUANTIZE")
+        self.buffers, self.weights, self.scales = {}, [], {}
+        self.opcode_index = None
+        self.added = []
+
+    def prepare(self, ctx):
+        ir = ctx.ir
+        names = enum_names("BuiltinOperator")
+        # channel axis of the weight operand (input 1) of each opcode, -1 if it has none to compress
+        opcode_axis = np.array([self.WEIGHT_AXIS.get(names.get(int(code)), -1) for code in ir.opcode_builtin] + [-1])
+        refs = np.zeros(ir.num_buffers, dtype=np.int64)
+        plans = []
+        for g in ir.subgraphs:
+            refs += np.bincount(g.tensor_buffer, minlength=ir.num_buffers)
+            in_ops = np.repeat(np.arange(g.num_operators), np.diff(g.op_input_offsets))
+            slot = np.arange(len(g.op_inputs)) - g.op_input_offsets[in_ops]
+            axes = opcode_axis[np.minimum(g.op_opcode, len(opcode_axis) - 1)][in_ops]
+            used = g.op_inputs >= 0
+            weight = used & (slot == 1) & (axes >= 0)
+            pairs = np.unique(np.stack([g.op_inputs[weight], axes[weight]], axis=1), axis=0)
+            other = set(g.op_inputs[used & ~weight].tolist()) | set(g.inputs.tolist()) | set(g.outputs.tolist())
+            tensors, counts = np.unique(pairs[:, 0], return_counts=True)
+            plan = {}
+            for t, axis in pairs.tolist():
+                b = int(g.tensor_buffer[t])
+                shape = tuple(g.shape(t).tolist())
+                if counts[np.searchsorted(tensors, t)] > 1 or g.tensor_type[t] != self.float32 \
+                        or g.tensor_is_variable[t] or g.tensor_quantization[t] >= 0 or axis >= len(shape) \
+                        or ir.buffer_data_size[b] == 0 or ir.buffer_data_size[b] != 4 * shape_infer.dim_prod(shape) \
+                        or (self.mode == "int8" and t in other):
+                    continue
+                # buffer_data_size covers external weights too, so they are planned like inline ones
+                plan[t] = (b, axis, shape)
+            plans.append(plan)
+        # a buffer is rewritten only if every tensor reading it is a weight planned the same way
+        uses = {}
+        for plan in plans:
+            for b, axis, shape in plan.values():
+                uses.setdefault(b, []).append((axis, shape))
+        self.buffers = {b: specs[0] for b, specs in uses.items()
+                        if len(specs) == refs[b] and (self.mode == "fp16" or len(set(specs)) == 1)}
+        self.weights = [{t: b for t, (b, _, _) in plan.items() if b in self.buffers} for plan in plans]
+
+    def buffer(self, ctx, index, view):
+        if view is DROP or index not in self.buffers:
+            return view
+        axis, shape = self.buffers[index]
+        if view is None or len(view) != 4 * shape_infer.dim_prod(shape):
+            raise ValueError("buffer %d: expected %d float32 weights, got %d bytes"
+                             % (index, shape_infer.dim_prod(shape), len(view or b"")))
+        if self.mode == "fp16":
+            return weight_compress.to_float16(view)
+        view, self.scales[index] = weight_compress.quantize_int8(view, shape, axis)
+        return view
+
+    def extra_opcodes(self, ctx, base):
+        if self.mode != "fp16" or not self.buffers:
+            return []
+        self.opcode_index = base
+        return [{"builtin_code": self.builtin_dequantize, "version": self.DEQUANTIZE_FP16_VERSION,
+                 "custom_code": None}]
+
+    def subgraph(self, ctx, index, sg):
+        self.added = []
+
+    def tensor(self, ctx, index, t, fields):
+        b = self.weights[ctx.subgraph_index].get(index)
+        if fields is DROP or b is None:
+            return fields
+        fields = fields or tensor_fields(t, ctx.copier)
+        if self.mode == "fp16":
+            self.added.append((index, {"name": fields["name"] + "_float16" if fields["name"] else "",
+                                       "shape": fields["shape"], "type": self.float16, "buffer": b}))
+            fields["buffer"] = 0
+        else:
+            axis = self.buffers[b][0]
+            scales = self.scales[b]
+            fields["type"] = self.int8
+            fields["quantization"] = {"min": None, "max": None, "scale": scales,
+                                      "zero_point": np.zeros(len(scales), dtype=np.int64),
+                                      "quantized_dimension": axis, "details_type": 0, "details": None}
+        return fields
+
+    def extra_tensors(self, ctx, index, base):
+        self.added = [(weight, base + k, fields) for k, (weight, fields) in enumerate(self.added)]
+        return [fields for _, _, fields in self.added]
+
+    def extra_operators(self, ctx, index):
+        return [{"opcode_index": self.opcode_index, "inputs": [half], "outputs": [weight],
+                 "options_type": 0, "options": None} for weight, half, _ in self.added]
+
+def create_offset_vector(builder, offsets):
+    builder.StartVector(4, len(offsets), 4)
+    for x in reversed(offsets):
+        builder.PrependUOffsetTRelative(x)
+    return builder.EndVector()
+
+def build_subgraph(ctx, builder, sg_i, transforms, buffer_remap, strip_names=False, rec=None, opcode_remap=None):
+    """Serializa o subgraph sg_i (tensores, operadores e a tabela SubGraph) e devolve o offset.
+
+    buffer_remap/opcode_remap: índice na entrada -> índice na saída (opcode_remap None = o mesmo).
+    """
+    rec = rec or instrument.PhaseRecorder()
+    model = ctx.model
+    sg = model.Subgraphs(sg_i)
+    ctx.subgraph_index, ctx.subgraph = sg_i, sg
+    for tr in transforms:
+        tr.subgraph(ctx, sg_i, sg)
+    tensor_offs = []
+    kept = np.ones(sg.TensorsLength(), dtype=bool)
+    with rec.phase("tensors", builder, subgraph=sg_i) as phase:
         for ti in range(sg.TensorsLength()):
             t = sg.Tensors(ti)
-            name = t.Name().decode() if t.Name() else ""
-            shape = [t.Shape(j) for j in range(t.ShapeLength())] if t.ShapeLength() else []
-            name_off = create_string(builder, name)
-            shape_off = vec_int(builder, shape) if shape else 0
-            tflite.Tensor.TensorStart(builder)
-            if shape_off:
-                tflite.Tensor.TensorAddShape(builder, shape_off)
-            tflite.Tensor.TensorAddType(builder, t.Type())
-            tflite.Tensor.TensorAddBuffer(builder, t.Buffer())
-            if name_off:
-                tflite.Tensor.TensorAddName(builder, name_off)
-            tensor_offs.append(tflite.Tensor.TensorEnd(builder))
-        op_offs = []
+            fields = None
+            for tr in transforms:
+                fields = tr.tensor(ctx, ti, t, fields)
+            if fields is DROP:
+                kept[ti] = False
+                continue
+            if fields is None:
+                off = ctx.copier.copy("Tensor", t._tab.Pos, {TENSOR_VT_BUFFER: ("<I", buffer_remap[t.Buffer()])},
+                                      drop=(TENSOR_VT_NAME,) if strip_names else ())
+                if off is not None:
+                    tensor_offs.append(off)
+                    continue
+                fields = tensor_fields(t, ctx.copier)
+            fields["buffer"] = buffer_remap[fields["buffer"]]
+            if strip_names:
+                fields["name"] = ""
+            tensor_offs.append(emit_tensor(builder, fields))
+        extra = []
+        for tr in transforms:
+            extra.extend(tr.extra_tensors(ctx, sg_i, len(kept) + len(extra)))
+        for fields in extra:
+            fields["buffer"] = buffer_remap[fields["buffer"]]
+            if strip_names:
+                fields["name"] = ""
+            tensor_offs.append(emit_tensor(builder, fields))
+        kept = np.concatenate([kept, np.ones(len(extra), dtype=bool)])
+        phase["items"] = len(kept)
+        phase["dropped"] = int(len(kept) - len(tensor_offs))
+    # with tensors dropped every index is renumbered, so no operator can be copied as raw bytes
+    tensor_map = np.cumsum(kept) - 1 if not kept.all() else None
+
+    def remap(values):
+        values = np.asarray(values, dtype=np.int64)
+        if tensor_map is None or len(values) == 0:
+            return values
+        return np.where(values >= 0, tensor_map[np.maximum(values, 0)], values)
+
+    op_offs = []
+    with rec.phase("operators", builder, subgraph=sg_i) as phase:
+        extra = [fields for tr in transforms for fields in tr.extra_operators(ctx, sg_i)]
+        for fields in extra:
+            if opcode_remap:
+                fields["opcode_index"] = opcode_remap[fields["opcode_index"]]
+            fields["inputs"], fields["outputs"] = remap(fields["inputs"]), remap(fields["outputs"])
+            op_offs.append(emit_operator(builder, fields))
+        phase["items"] = sg.OperatorsLength() + len(extra)
         for oi in range(sg.OperatorsLength()):
             op = sg.Operators(oi)
-            inputs = [op.Inputs(j) for j in range(op.InputsLength())] if op.InputsLength() else []
-            outputs = [op.Outputs(j) for j in range(op.OutputsLength())] if op.OutputsLength() else []
-            in_vec = vec_int(builder, inputs) if inputs else 0
-            out_vec = vec_int(builder, outputs) if outputs else 0
-            opcode_idx = op.OpcodeIndex()
-            try:
-                builtin = model.OperatorCodes(opcode_idx).BuiltinCode()
-            except:
-                builtin = None
-            fc_off = 0
-            if builtin == BUILTIN_FC:
-                fused = load_fc_options_from_original(data, op, BUILTINOPTIONS_FC)
-                tflite.FullyConnectedOptions.FullyConnectedOptionsStart(builder)
-                if hasattr(tflite.FullyConnectedOptions, "FullyConnectedOptionsAddFusedActivationFunction"):
-                    tflite.FullyConnectedOptions.FullyConnectedOptionsAddFusedActivationFunction(builder, int(fused))
-                tflite.FullyConnectedOptions.FullyConnectedOptionsAddKeepNumDims(builder, 1)
-                fc_off = tflite.FullyConnectedOptions.FullyConnectedOptionsEnd(builder)
-            tflite.Operator.OperatorStart(builder)
-            tflite.Operator.OperatorAddOpcodeIndex(builder, opcode_idx)
-            if in_vec:
-                tflite.Operator.OperatorAddInputs(builder, in_vec)
-            if out_vec:
-                tflite.Operator.OperatorAddOutputs(builder, out_vec)
-            if fc_off:
-                tflite.Operator.OperatorAddBuiltinOptions(builder, fc_off)
-                if BUILTINOPTIONS_FC is not None:
-                    tflite.Operator.OperatorAddBuiltinOptionsType(builder, BUILTINOPTIONS_FC)
-                else:
-                    BO = getattr(tflite, "BuiltinOptions", None)
-                    if BO and hasattr(BO, "FullyConnectedOptions"):
-                        tflite.Operator.OperatorAddBuiltinOptionsType(builder, BO.FullyConnectedOptions)
-            op_offs.append(tflite.Operator.OperatorEnd(builder))
-        builder.StartVector(4, len(tensor_offs), 4)
-        for x in reversed(tensor_offs):
-            builder.PrependUOffsetTRelative(x)
-        tensors_vec = builder.EndVector()
-        builder.StartVector(4, len(op_offs), 4)
-        for x in reversed(op_offs):
-            builder.PrependUOffsetTRelative(x)
-        ops_vec = builder.EndVector()
-        in_graph = vec_int(builder, [sg.Inputs(i) for i in range(sg.InputsLength())]) if sg.InputsLength() else 0
-        out_graph = vec_int(builder, [sg.Outputs(i) for i in range(sg.OutputsLength())]) if sg.OutputsLength() else 0
-        name_sg = create_string(builder, sg.Name().decode() if sg.Name() else "")
+            fields = None
+            for tr in transforms:
+                fields = tr.operator(ctx, oi, op, fields)
+            if fields is DROP:
+                continue
+            if fields is None and tensor_map is None:
+                overrides = {OPERATOR_VT_OPCODE_INDEX: ("<I", opcode_remap[op.OpcodeIndex()])} if opcode_remap else None
+                off = ctx.copier.copy("Operator", op._tab.Pos, overrides)
+                if off is not None:
+                    op_offs.append(off)
+                    continue
+            fields = fields or operator_fields(op, ctx.copier)
+            if opcode_remap:
+                fields["opcode_index"] = opcode_remap[fields["opcode_index"]]
+            if tensor_map is not None:
+                fields["inputs"], fields["outputs"] = remap(fields["inputs"]), remap(fields["outputs"])
+                fields["intermediates"] = remap(fields.get("intermediates", ()))
+            op_offs.append(emit_operator(builder, fields))
+        phase["dropped"] = phase["items"] - len(op_offs)
+    with rec.phase("vectors", builder, subgraph=sg_i) as phase:
+        phase["items"] = len(tensor_offs) + len(op_offs)
+        tensors_vec = create_offset_vector(builder, tensor_offs)
+        ops_vec = create_offset_vector(builder, op_offs)
+        in_graph = vec_int(builder, remap(int_vector(sg.InputsAsNumpy())))
+        out_graph = vec_int(builder, remap(int_vector(sg.OutputsAsNumpy())))
+        name_sg = create_string(builder, sg.Name() if sg.Name() and not strip_names else "")
         tflite.SubGraph.SubGraphStart(builder)
         tflite.SubGraph.SubGraphAddTensors(builder, tensors_vec)
         if in_graph:
@@ -148,33 +932,424 @@ def inject_keepdims(input_path, output_path):
         tflite.SubGraph.SubGraphAddOperators(builder, ops_vec)
         if name_sg:
             tflite.SubGraph.SubGraphAddName(builder, name_sg)
-        subgraph_offs.append(tflite.SubGraph.SubGraphEnd(builder))
-    builder.StartVector(4, len(opcode_offs), 4)
-    for x in reversed(opcode_offs):
-        builder.PrependUOffsetTRelative(x)
-    opcodes_vec = builder.EndVector()
-    builder.StartVector(4, len(subgraph_offs), 4)
-    for x in reversed(subgraph_offs):
-        builder.PrependUOffsetTRelative(x)
-    subgraphs_vec = builder.EndVector()
-    builder.StartVector(4, len(buffer_offs), 4)
-    for x in reversed(buffer_offs):
-        builder.PrependUOffsetTRelative(x)
-    buffers_vec = builder.EndVector()
-    tflite.Model.ModelStart(builder)
-    tflite.Model.ModelAddVersion(builder, 3)
-    tflite.Model.ModelAddOperatorCodes(builder, opcodes_vec)
-    tflite.Model.ModelAddSubgraphs(builder, subgraphs_vec)
-    tflite.Model.ModelAddBuffers(builder, buffers_vec)
-    tflite.Model.ModelAddDescription(builder, builder.CreateString("Injected keep_num_dims"))
-    model_off = tflite.Model.ModelEnd(builder)
-    builder.Finish(model_off, b"TFL3")
-    with open(output_path, "wb") as f:
-        f.write(builder.Output())
+        return tflite.SubGraph.SubGraphEnd(builder)
+
+def serialize_subgraph(input_path, sg_i, transforms, buffer_remap, strip_names=False, opcode_remap=None):
+    """Worker: um subgraph num builder próprio; devolve (bytes, offset da tabela, minalign, fases).
+
+    Os offsets internos de um flatbuffer são relativos, então o trecho pode ser emendado
+    em outro builder desde que caia com o mesmo alinhamento (splice_fragment).
+    """
+    data = map_file(input_path)
+    ctx = RewriteContext(data, load_model(data))
+    builder = flatbuffers.Builder(1024)
+    ctx.copier = table_copy.TableCopier(builder, data)
+    rec = instrument.PhaseRecorder()
+    off = build_subgraph(ctx, builder, sg_i, transforms, buffer_remap, strip_names, rec, opcode_remap)
+    return bytes(builder.Bytes[builder.Head():]), off, builder.minalign, rec.phases
+
+def splice_fragment(builder, fragment, off, minalign):
+    # the fragment's end lands on a multiple of its own minalign, so every field keeps its alignment
+    builder.Prep(minalign, 0)
+    base = builder.Offset()
+    builder.Prep(1, len(fragment))
+    builder.head = builder.Head() - len(fragment)
+    builder.Bytes[builder.Head():builder.Head() + len(fragment)] = fragment
+    return base + off
+
+def rewrite_model(input_path, output_path, transforms, external_threshold=None, dedup=False, workers=None,
+                  description="Injected keep_num_dims", strip_names=False, recorder=None, subgraph_workers=None,
+                  reuse=None, alignment=WEIGHT_ALIGNMENT):
+    """Reconstrói o modelo aplicando todos os transforms numa única travessia e serialização.
+
+    strip_names omite os nomes de tensores e subgraphs (builds de release).
+    recorder (instrument.PhaseRecorder) recebe tempo/itens/bytes de cada fase.
+    subgraph_workers > 1 serializa cada subgraph num processo separado (os transforms precisam
+    ser picklable) enquanto buffers e opcodes são escritos aqui; os trechos são emendados no fim.
+    reuse: (bytes de uma saída anterior, {subgraph: posição da tabela nela}) para copiar esses
+    subgraphs já prontos em vez de reconstruí-los (modo incremental).
+    alignment: todo Buffer.data (e todo buffer externo) começa num múltiplo disso no arquivo.
+    """
+    check_alignment(alignment)
+    rec = recorder or instrument.PhaseRecorder()
+    first_phase = len(rec.phases)
+    with rec.phase("load"):
+        data = map_file(input_path)
+        model = load_model(data)
+        ctx = RewriteContext(data, model)
+    with rec.phase("prepare") as phase:
+        phase["items"] = len(transforms)
+        for tr in transforms:
+            tr.prepare(ctx)
+            ctx.prepared.append(tr)
+    with rec.phase("buffer_hooks") as phase:
+        orig_buffers = []
+        buffer_remap = []
+        dropped_bytes = 0
+        resized = []
+        for i in range(model.BuffersLength()):
+            view = original = buffer_data_view(data, model.Buffers(i))
+            for tr in transforms:
+                view = tr.buffer(ctx, i, view)
+            if view is not original and view is not DROP:
+                resized.append((len(original or b""), len(view or b"")))
+            if view is DROP:
+                dropped_bytes += len(original or b"")  # external buffers have no Buffer.data
+                buffer_remap.append(-1)
+                continue
+            buffer_remap.append(len(orig_buffers))
+            orig_buffers.append(view)
+        phase["items"] = model.BuffersLength()
+        phase["dropped"] = model.BuffersLength() - len(orig_buffers)
+    if dedup:
+        with rec.phase("dedup") as phase:
+            n_before = phase["items"] = len(orig_buffers)
+            orig_buffers, dedup_remap = dedup_buffers(orig_buffers, workers)
+            buffer_remap = [dedup_remap[j] if j >= 0 else -1 for j in buffer_remap]
+        print("Dedup: %d -> %d buffers" % (n_before, len(orig_buffers)))
+    opcode_hooks = []
+    with rec.phase("opcode_hooks") as phase:
+        phase["items"] = model.OperatorCodesLength()
+        for i in range(model.OperatorCodesLength()):
+            oc = model.OperatorCodes(i)
+            fields = None
+            for tr in transforms:
+                fields = tr.opcode(ctx, i, oc, fields)
+            opcode_hooks.append((oc, fields))
+        for tr in transforms:
+            opcode_hooks.extend((None, fields) for fields in tr.extra_opcodes(ctx, len(opcode_hooks)))
+        kept_opcodes = [fields is not DROP for _, fields in opcode_hooks]
+        phase["dropped"] = kept_opcodes.count(False)
+    # operators point at opcodes by index, so dropping one renumbers the rest
+    opcode_remap = (np.cumsum(kept_opcodes) - 1).tolist() if not all(kept_opcodes) else None
+    reuse_data, reuse_pos = reuse or (None, {})
+    pending = {}
+    rebuild = [sg_i for sg_i in range(model.SubgraphsLength()) if sg_i not in reuse_pos]
+    if subgraph_workers and subgraph_workers > 1 and len(rebuild) > 1:
+        pool = concurrent.futures.ProcessPoolExecutor(min(subgraph_workers, len(rebuild)))
+        pending = {sg_i: pool.submit(serialize_subgraph, input_path, sg_i, transforms, buffer_remap, strip_names,
+                                     opcode_remap)
+                   for sg_i in rebuild}
+    if external_threshold is None and sum(len(rb) for rb in orig_buffers if rb) >= EXTERNAL_AUTO_SIZE:
+        external_threshold = EXTERNAL_DEFAULT_THRESHOLD
+    builder = flatbuffers.Builder(builder_size_hint(model, data, orig_buffers, external_threshold, alignment))
+    # tables no transform touched are copied as raw bytes, keeping every field and option
+    ctx.copier = table_copy.TableCopier(builder, data)
+    buffer_offs = []
+    external = []
+    layout = {"padding": 0}
+    with rec.phase("buffers", builder) as phase:
+        phase["items"] = len(orig_buffers)
+        for rb in orig_buffers:
+            if is_external(rb, external_threshold):
+                buffer_offs.append(create_external_buffer(builder, len(rb)))
+                external.append((buffer_offs[-1], rb))
+            else:
+                buffer_offs.append(create_buffer(builder, rb, alignment, layout))
+        phase["padding_bytes"] = layout["padding"]
+    opcode_offs = []
+    with rec.phase("opcodes", builder) as phase:
+        phase["items"] = model.OperatorCodesLength()
+        for oc, fields in opcode_hooks:
+            if fields is not DROP:
+                opcode_offs.append(emit_opcode(builder, fields or opcode_fields(oc)))
+    subgraph_offs = []
+    reuse_copier = table_copy.TableCopier(builder, reuse_data) if reuse_pos else None
+    try:
+        for sg_i in range(model.SubgraphsLength()):
+            off = None
+            if sg_i in reuse_pos:
+                with rec.phase("reuse", builder, subgraph=sg_i) as phase:
+                    off = reuse_copier.copy("SubGraph", reuse_pos[sg_i])
+                    phase["items"] = 1 if off is not None else 0
+            if off is None and sg_i in pending:
+                with rec.phase("splice", builder, subgraph=sg_i) as phase:
+                    fragment, frag_off, minalign, phases = pending[sg_i].result()
+                    off = splice_fragment(builder, fragment, frag_off, minalign)
+                    phase["items"] = 1
+                rec.phases.extend(phases)
+            if off is None:
+                off = build_subgraph(ctx, builder, sg_i, transforms, buffer_remap, strip_names, rec, opcode_remap)
+            subgraph_offs.append(off)
+    finally:
+        if pending:
+            pool.shutdown(cancel_futures=True)
+    with rec.phase("model", builder) as phase:
+        phase["items"] = len(opcode_offs) + len(subgraph_offs) + len(buffer_offs)
+        opcodes_vec = create_offset_vector(builder, opcode_offs)
+        subgraphs_vec = create_offset_vector(builder, subgraph_offs)
+        buffers_vec = create_offset_vector(builder, buffer_offs)
+        description = builder.CreateString(description)
+        tflite.Model.ModelStart(builder)
+        tflite.Model.ModelAddVersion(builder, 3)
+        tflite.Model.ModelAddOperatorCodes(builder, opcodes_vec)
+        tflite.Model.ModelAddSubgraphs(builder, subgraphs_vec)
+        tflite.Model.ModelAddBuffers(builder, buffers_vec)
+        tflite.Model.ModelAddDescription(builder, description)
+        model_off = tflite.Model.ModelEnd(builder)
+    with rec.phase("finish", builder):
+        builder.Finish(model_off, b"TFL3")
+    with rec.phase("write") as phase:
+        phase["items"] = len(external)
+        phase["padding_bytes"] = write_builder(builder, output_path, external, max(alignment, EXTERNAL_ALIGNMENT))
+        layout["padding"] += phase["padding_bytes"]
+    bindings.save_cache()
     print("Wrote:", output_path)
+    print("Weight alignment %d: %d padding bytes over %d buffers"
+          % (alignment, layout["padding"], sum(1 for rb in orig_buffers if rb)))
+    dropped = {name: sum(e.get("dropped", 0) for e in rec.phases[first_phase:] if e["phase"] == name)
+               for name in ("operators", "tensors", "buffer_hooks", "opcode_hooks")}
+    if dropped["operators"] or dropped["tensors"]:
+        print("Removed %d operators and %d tensors" % (dropped["operators"], dropped["tensors"]))
+    if dropped["buffer_hooks"] or dropped["opcode_hooks"]:
+        print("Removed %d buffers (%d bytes) and %d opcodes"
+              % (dropped["buffer_hooks"], dropped_bytes, dropped["opcode_hooks"]))
+    if resized:
+        print("Rewrote %d weight buffers: %d -> %d bytes"
+              % (len(resized), sum(a for a, _ in resized), sum(b for _, b in resized)))
+    if external:
+        print("%d buffers stored after the flatbuffer" % len(external))
+
+def keepdims_transforms(remove_reshapes=False, infer_shapes=False, remove_dead=False, compress_weights=None):
+    transforms = [KeepNumDims()]
+    if remove_reshapes:
+        transforms.append(RemoveReshapes())
+    if infer_shapes:
+        transforms.append(InferShapes())
+    if remove_dead:
+        transforms.append(RemoveDead())
+    if compress_weights:
+        transforms.append(CompressWeights(compress_weights))
+    return transforms
+
+def inject_keepdims(input_path, output_path, external_threshold=None, dedup=False, workers=None, strip_names=False,
+                    recorder=None, subgraph_workers=None, alignment=WEIGHT_ALIGNMENT, remove_reshapes=False,
+                    infer_shapes=False, remove_dead=False, compress_weights=None):
+    transforms = keepdims_transforms(remove_reshapes, infer_shapes, remove_dead, compress_weights)
+    rewrite_model(input_path, output_path, transforms, external_threshold, dedup, workers, strip_names=strip_names,
+                  recorder=recorder, subgraph_workers=subgraph_workers, alignment=alignment)
+
+def metadata_digest(data, model):
+    # everything except the weight bytes (their sizes included): equal digests = weight-only change
+    spans = sorted(s for s in (buffer_data_range(model.Buffers(i)) for i in range(model.BuffersLength())) if s)
+    view = memoryview(data)
+    h = hashlib.blake2b(digest_size=32)
+    pos = 0
+    for start, size in spans:
+        if start > pos:
+            h.update(view[pos:start])
+        h.update(struct.pack("<QQ", start, size))
+        pos = max(pos, start + size)
+    h.update(view[pos:])
+    return h.digest()
+
+def buffer_mapping(in_data, out_data):
+    """Buffer de saída de cada buffer da entrada, pareando os tensores; None se não bater um a um."""
+    ir_in, ir_out = graph_ir.build_ir(in_data), graph_ir.build_ir(out_data)
+    if [g.num_tensors for g in ir_in.subgraphs] != [g.num_tensors for g in ir_out.subgraphs]:
+        return None
+    pairs = np.unique(np.stack([np.concatenate([g.tensor_buffer for g in ir.subgraphs] or [np.zeros(0, np.uint32)])
+                                for ir in (ir_in, ir_out)], axis=1), axis=0)
+    if len(np.unique(pairs[:, 0])) != len(pairs):
+        return None
+    mapping = dict(pairs.tolist())
+    if ir_in.num_buffers == ir_out.num_buffers:
+        for i in range(ir_in.num_buffers):
+            mapping.setdefault(i, i)
+    return mapping
+
+def incremental_keepdims(input_path, prev_input, prev_output, output_path, external_threshold=None, dedup=False,
+                         workers=None, strip_names=False, recorder=None, subgraph_workers=None,
+                         alignment=WEIGHT_ALIGNMENT, remove_reshapes=False, infer_shapes=False, remove_dead=False,
+                         compress_weights=None):
+    """Reescreve input_path reaproveitando prev_output, que deve ser a saída de prev_input com as mesmas opções.
+
+    Se só os pesos mudaram, prev_output é copiado e apenas os buffers cujo hash mudou são
+    sobrescritos no lugar. Senão o rebuild copia de prev_output os subgraphs que não mudaram.
+    """
+    rec = recorder or instrument.PhaseRecorder()
+    with rec.phase("load"):
+        data, prev_data, out_data = map_file(input_path), map_file(prev_input), map_file(prev_output)
+        model, prev_model, out_model = load_model(data), load_model(prev_data), load_model(out_data)
+    with rec.phase("hash") as phase:
+        same_layout = metadata_digest(data, model) == metadata_digest(prev_data, prev_model)
+        phase["items"] = 2
+    reason = "the graph or metadata changed"
+    if same_layout:
+        with rec.phase("hash") as phase:
+            views = [buffer_data_view(data, model.Buffers(i)) for i in range(model.BuffersLength())]
+            prev_views = [buffer_data_view(prev_data, prev_model.Buffers(i)) for i in range(prev_model.BuffersLength())]
+            with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+                digests = list(pool.map(hash_buffer, views))
+                prev_digests = list(pool.map(hash_buffer, prev_views))
+            changed = [i for i, (a, b) in enumerate(zip(digests, prev_digests)) if a != b]
+            phase["items"] = len(views) + len(prev_views)
+        # --infer-shapes/--remove-reshapes read shape constants from the input: a changed one can change the graph
+        shape_inputs = shape_infer.shape_buffers(graph_ir.build_ir(data)) \
+            if changed and (infer_shapes or remove_reshapes) else set()
+        shape_changed = [i for i in changed if i in shape_inputs]
+        mapping = buffer_mapping(prev_data, out_data) if changed and not shape_changed else {}
+        writes = None
+        if shape_changed:
+            reason = "buffer %d feeds a shape input read by --infer-shapes/--remove-reshapes" % shape_changed[0]
+        elif mapping is None:
+            reason = "the tensors of %s don't pair one to one with those of %s" % (prev_input, prev_output)
+        else:
+            writes = {}
+            for i in changed:
+                j = mapping.get(i)
+                span = buffer_data_range(out_model.Buffers(j)) if j is not None and j < out_model.BuffersLength() \
+                    else None
+                if span is None:
+                    reason = "buffer %d has no counterpart in %s" % (i, prev_output)
+                elif span[1] != len(views[i]):
+                    reason = "buffer %d changed size" % i
+                elif writes.get(j, (None, digests[i]))[1] != digests[i]:
+                    reason = "buffer %d shares its output copy with a buffer that changed differently" % i
+                else:
+                    writes[j] = (span[0], digests[i], views[i])
+                    continue
+                writes = None
+                break
+        # an output buffer shared (dedup) by inputs that no longer all match can't be patched in place
+        if writes is not None and not all(digests[i] == writes[j][1] for i, j in mapping.items()
+                                          if j in writes and i < len(digests)):
+            reason = "an output buffer is shared with an input buffer that did not change"
+            writes = None
+        if writes is not None:
+            with rec.phase("copy") as phase:
+                phase["items"] = len(out_data)
+                shutil.copyfile(prev_output, output_path)
+            with rec.phase("write") as phase:
+                phase["items"] = len(writes)
+                with open(output_path, "r+b") as f:
+                    for start, _, view in sorted(writes.values(), key=lambda w: w[0]):
+                        f.seek(start)
+                        f.write(view)
+            print("Incremental: %d of %d buffers changed, patched into a copy of %s"
+                  % (len(changed), len(views), prev_output))
+            return
+    reuse_pos = {}
+    n_buffers = {model.BuffersLength(), prev_model.BuffersLength(), out_model.BuffersLength()}
+    if not dedup and not remove_dead and not compress_weights and len(n_buffers) == 1:
+        # same buffer and opcode numbering everywhere, so a reused subgraph still points at the right tables
+        # (int8 scales come from the weights, so compressed subgraphs are never reused)
+        # (and with --infer-shapes/--remove-reshapes the shape constants it reads must match too)
+        with rec.phase("hash") as phase:
+            n = min(model.SubgraphsLength(), prev_model.SubgraphsLength(), out_model.SubgraphsLength())
+            ir = graph_ir.build_ir(data) if infer_shapes or remove_reshapes else None
+            for sg_i in range(n):
+                digest = table_copy.table_digest(data, "SubGraph", model.Subgraphs(sg_i)._tab.Pos)
+                if digest is None or digest != table_copy.table_digest(
+                        prev_data, "SubGraph", prev_model.Subgraphs(sg_i)._tab.Pos):
+                    continue
+                if ir is not None and any(
+                        buffer_data_view(data, model.Buffers(b)) != buffer_data_view(prev_data, prev_model.Buffers(b))
+                        for b in shape_infer.shape_buffers(ir, sg_i)):
+                    continue
+                reuse_pos[sg_i] = out_model.Subgraphs(sg_i)._tab.Pos
+            phase["items"] = n
+    print("Incremental: %s, rebuilding and reusing %d of %d subgraphs"
+          % (reason, len(reuse_pos), model.SubgraphsLength()))
+    transforms = keepdims_transforms(remove_reshapes, infer_shapes, remove_dead, compress_weights)
+    rewrite_model(input_path, output_path, transforms, external_threshold, dedup, workers, strip_names=strip_names,
+                  recorder=rec, subgraph_workers=subgraph_workers, reuse=(out_data, reuse_pos), alignment=alignment)
+
+# every module besides this one whose code shapes the output bytes: changing any of them invalidates the cache
+OUTPUT_MODULES = (bindings, graph_ir, model_io, shape_infer, table_copy, weight_compress)
+
+def cache_config(patch=False, external_threshold=None, dedup=False, strip_names=False, subgraph_workers=None,
+                 alignment=WEIGHT_ALIGNMENT, remove_reshapes=False, infer_shapes=False, remove_dead=False,
+                 compress_weights=None):
+    # everything that changes the output bytes, plus the version of this file and of the bindings;
+    # split subgraphs don't share strings/vtables, but the worker count itself doesn't matter
+    return {"transform": "keep_num_dims", "patch": patch, "external_threshold": external_threshold,
+            "dedup": dedup, "strip_names": strip_names, "alignment": None if patch else alignment,
+            "remove_reshapes": remove_reshapes and not patch, "infer_shapes": infer_shapes and not patch,
+            "remove_dead": remove_dead and not patch, "compress_weights": None if patch else compress_weights,
+            "split_subgraphs": bool(subgraph_workers and subgraph_workers > 1),
+            "tool": model_cache.tool_version(tflite, sys.modules[__name__], *OUTPUT_MODULES)}
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python inject_keep_num_dims_full.py input.tflite output.tflite")
-        sys.exit(1)
-    inject_keepdims(sys.argv[1], sys.argv[2])
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Set keep_num_dims=1 on every FULLY_CONNECTED op.")
+    parser.add_argument("input")
+    parser.add_argument("output", nargs="?")
+    parser.add_argument("--scan", action="store_true",
+                        help="only report the FULLY_CONNECTED ops and their keep_num_dims; write nothing")
+    parser.add_argument("--skip-compliant", action="store_true",
+                        help="write nothing if every FULLY_CONNECTED op already has keep_num_dims=1")
+    parser.add_argument("--patch", action="store_true",
+                        help="patch the options in a copy of the file instead of rebuilding the model")
+    parser.add_argument("--external-weights", type=int, metavar="BYTES",
+                        help="store buffers of at least BYTES after the flatbuffer (Buffer.offset/size)")
+    parser.add_argument("--dedup", action="store_true",
+                        help="store identical weight buffers once and point their tensors at the shared copy")
+    parser.add_argument("--strip-names", action="store_true", help="drop tensor and subgraph names (rebuild only)")
+    parser.add_argument("--remove-reshapes", action="store_true",
+                        help="drop RESHAPE ops around FULLY_CONNECTED made redundant by keep_num_dims (rebuild only)")
+    parser.add_argument("--infer-shapes", action="store_true",
+                        help="rewrite tensor shapes/shape_signature to match keep_num_dims (rebuild only)")
+    parser.add_argument("--remove-dead", action="store_true",
+                        help="drop operators, tensors, buffers and opcodes that reach no subgraph output (rebuild only)")
+    parser.add_argument("--compress-weights", choices=CompressWeights.MODES,
+                        help="store FULLY_CONNECTED/CONV weights as float16 (+ DEQUANTIZE) or per-channel int8 "
+                             "(rebuild only)")
+    parser.add_argument("--alignment", type=int, default=WEIGHT_ALIGNMENT, metavar="BYTES",
+                        help="weight buffer boundary, a power of two (rebuild only; default %(default)s)")
+    parser.add_argument("--workers", type=int, help="hashing threads for --dedup (default: all cores)")
+    parser.add_argument("--subgraph-workers", type=int, metavar="N",
+                        help="serialize subgraphs in N processes (pays off on models with many large subgraphs)")
+    parser.add_argument("--cache-dir", help="reuse outputs of earlier runs with the same input and options")
+    parser.add_argument("--cache-size", type=int, metavar="BYTES", help="evict least recently used entries past this")
+    parser.add_argument("--cache-link", action="store_true",
+                        help="hardlink cache hits instead of copying them (the output must not be modified in place)")
+    parser.add_argument("--incremental", nargs=2, metavar=("PREV_INPUT", "PREV_OUTPUT"),
+                        help="reuse PREV_OUTPUT (PREV_INPUT rewritten with the same options) where nothing changed")
+    parser.add_argument("--profile-report", metavar="JSON", help="write per-phase time/items/bytes to this file")
+    parser.add_argument("--trace-memory", action="store_true", help="add tracemalloc allocations to the phase report")
+    parser.add_argument("--cprofile", metavar="PROF", help="run under cProfile and dump the stats to this file")
+    args = parser.parse_args()
+    recorder = instrument.PhaseRecorder(args.trace_memory, args.cprofile)
+    if args.patch and args.incremental:
+        parser.error("--patch and --incremental are exclusive")
+    if not args.scan and args.output is None:
+        parser.error("the output path is required unless --scan is given")
+    try:
+        check_alignment(args.alignment)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.patch:
+        def rewrite(input_path, output_path):
+            patch_keepdims(input_path, output_path, recorder)
+    elif args.incremental:
+        def rewrite(input_path, output_path):
+            incremental_keepdims(input_path, args.incremental[0], args.incremental[1], output_path,
+                                 args.external_weights, args.dedup, args.workers, args.strip_names, recorder,
+                                 args.subgraph_workers, args.alignment, args.remove_reshapes, args.infer_shapes,
+                                 args.remove_dead, args.compress_weights)
+    else:
+        def rewrite(input_path, output_path):
+            inject_keepdims(input_path, output_path, args.external_weights, args.dedup, args.workers,
+                            args.strip_names, recorder, args.subgraph_workers, args.alignment, args.remove_reshapes,
+                            args.infer_shapes, args.remove_dead, args.compress_weights)
+    with recorder.session():
+        skip = False
+        if args.scan or args.skip_compliant:
+            report = scan_keepdims(args.input, recorder)
+            print_scan(report)
+            skip = args.scan or report["compliant"]
+        if skip:
+            if not args.scan:
+                print("Already compliant, %s not written" % args.output)
+        elif args.cache_dir:
+            config = cache_config(args.patch, args.external_weights, args.dedup, args.strip_names,
+                                  args.subgraph_workers, args.alignment, args.remove_reshapes,
+                                  args.infer_shapes, args.remove_dead, args.compress_weights)
+            if model_cache.cached_rewrite(rewrite, args.input, args.output, config, args.cache_dir, args.cache_size,
+                                          args.cache_link):
+                print("Cache hit:", args.output)
+        else:
+            rewrite(args.input, args.output)
+    if args.profile_report:
+        recorder.write(args.profile_report)
+        print(recorder.summary())
\ No newline at end of file
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import tempfile
+
+HASH_CHUNK = 16 << 20
+
+
+def file_digest(path):
+    h = hashlib.blake2b(digest_size=32)
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return h.hexdigest()
+        view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        for pos in range(0, len(view), HASH_CHUNK):
+            h.update(view[pos:pos + HASH_CHUNK])
+        view.release()
+    return h.hexdigest()
+
+
+def tool_version(*modules):
+    """Hash of the source of the modules doing the rewrite: any code change invalidates the cache."""
+    h = hashlib.blake2b(digest_size=16)
+    for mod in modules:
+        with open(mod.__file__, "rb") as f:
+            h.update(f.read())
+        h.update(str(getattr(mod, "__version__", "")).encode())
+    return h.hexdigest()
+
+
+def cache_key(input_path, config):
+    # input content + transform configuration (which should include the tool_version)
+    h = hashlib.blake2b(digest_size=32)
+    h.update(file_digest(input_path).encode())
+    h.update(json.dumps(config, sort_keys=True).encode())
+    return h.hexdigest()
+
+
+def entry_path(cache_dir, key):
+    return os.path.join(cache_dir, key[:2], key + ".tflite")
+
+
+def link_or_copy(src, dst):
+    # hardlink when cache and output share a filesystem, plain copy otherwise
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def evict(cache_dir, max_bytes):
+    """Remove as entradas usadas há mais tempo (mtime, atualizado a cada hit) até caber em max_bytes."""
+    entries = []
+    for root, _, files in os.walk(cache_dir):
+        for name in files:
+            if name.endswith(".tflite"):
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def cached_rewrite(rewrite, input_path, output_path, config, cache_dir, max_bytes=None, link=False):
+    """Roda rewrite(input_path, output_path) só se o resultado não estiver no cache.
+
+    Retorna True num hit. A saída de um hit é uma cópia da entrada do cache; com link=True
+    é um hardlink (sem cópia), que então não deve ser modificado no lugar.
+    """
+    entry = entry_path(cache_dir, cache_key(input_path, config))
+    if os.path.exists(entry):
+        os.utime(entry)
+        if link:
+            link_or_copy(entry, output_path)
+        else:
+            if os.path.lexists(output_path):
+                os.remove(output_path)
+            shutil.copyfile(entry, output_path)
+        return True
+    # the output may still be a hardlink to an entry from an earlier hit: writing through it
+    # ("wb" truncates in place) would overwrite that entry, so the rewrite gets a fresh file
+    if os.path.lexists(output_path):
+        os.remove(output_path)
+    rewrite(input_path, output_path)
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(entry), suffix=".tmp")
+    os.close(fd)
+    shutil.copyfile(output_path, tmp)
+    os.replace(tmp, entry)
+    if max_bytes is not None:
+        evict(cache_dir, max_bytes)
+    return False
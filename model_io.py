@@ -0,0 +1,152 @@
+import mmap
+import struct
+
+import flatbuffers
+import numpy as np
+
+from bindings import tfl as tflite
+
+# Leitura e escrita de modelos compartilhadas pelos scripts de rewrite: mmap da entrada, fatias
+# sem cópia dos pesos, memcpy único para dentro do builder e escrita direto do bytearray dele.
+
+BUFFER_VT_DATA = 4
+BUFFER_VT_OFFSET = 6
+# weights stored after the flatbuffer (Buffer.offset/size) start on this boundary
+EXTERNAL_ALIGNMENT = 16
+
+
+def map_file(path):
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def buffer_data_range(buf):
+    """(início, tamanho) dos bytes de Buffer.data no arquivo, ou de offset/size quando o peso está fora do flatbuffer."""
+    o = buf._tab.Offset(BUFFER_VT_DATA)
+    if o == 0:
+        offset = buf.Offset() if hasattr(buf, "Offset") else 0
+        return (offset, buf.Size()) if offset > 1 else None
+    return buf._tab.Vector(o), buf._tab.VectorLen(o)
+
+
+def buffer_data_view(data, buf):
+    """Fatia (sem cópia) dos bytes de um Buffer, ou None se vazio."""
+    span = buffer_data_range(buf)
+    return memoryview(data)[span[0]:span[0] + span[1]] if span else None
+
+
+def is_external(view, external_threshold):
+    return external_threshold is not None and view is not None and len(view) >= external_threshold
+
+
+def check_alignment(alignment):
+    if alignment < 1 or alignment & (alignment - 1):
+        raise ValueError("alignment must be a power of two, got %r" % alignment)
+    return alignment
+
+
+def builder_size_hint(model, data, views, external_threshold=None, alignment=4):
+    # inline weights once + metadata twice (FC options, vtables) so the builder never grows/copies mid-rebuild
+    weights = sum(len(v) for v in views if v)
+    inline = sum(len(v) + 12 + max(alignment, 4) for v in views if v and not is_external(v, external_threshold))
+    n_ops = sum(model.Subgraphs(i).OperatorsLength() for i in range(model.SubgraphsLength()))
+    return inline + 2 * max(0, len(data) - weights) + 32 * n_ops + 1024
+
+
+def vec_int(builder, values):
+    # one numpy-backed copy instead of a PrependInt32 per element
+    if len(values) == 0:
+        return 0
+    return builder.CreateNumpyVector(np.asarray(values, dtype=np.int32))
+
+
+def create_string(builder, s):
+    # interned: repeated names/custom codes are written once; keyed by bytes like the raw copier's strings
+    if not s:
+        return 0
+    return builder.CreateSharedString(s.encode() if isinstance(s, str) else s)
+
+
+def create_quantization(builder, q):
+    """Copia uma QuantizationParameters (ou None): vetores por canal lidos com *AsNumpy e gravados em bloco.
+
+    Sem scale/zero_point os modelos int8 perdem os kernels inteiros. QuantizationDetails (união
+    custom) não é copiada: recusar é melhor que gravar um modelo que quantiza errado.
+    """
+    if q is None:
+        return 0
+    if q.DetailsType():
+        raise ValueError("custom QuantizationDetails (type %d) are not supported here; use main6" % q.DetailsType())
+    Q = tflite.QuantizationParameters
+    vecs = [0 if isinstance(arr, int) else builder.CreateNumpyVector(arr)
+            for arr in (q.MinAsNumpy(), q.MaxAsNumpy(), q.ScaleAsNumpy(), q.ZeroPointAsNumpy())]
+    Q.QuantizationParametersStart(builder)
+    for add, vec in zip((Q.QuantizationParametersAddMin, Q.QuantizationParametersAddMax,
+                         Q.QuantizationParametersAddScale, Q.QuantizationParametersAddZeroPoint), vecs):
+        if vec:
+            add(builder, vec)
+    Q.QuantizationParametersAddQuantizedDimension(builder, q.QuantizedDimension())
+    return Q.QuantizationParametersEnd(builder)
+
+
+def create_byte_vector(builder, view, alignment=4):
+    """CreateByteVector que aceita memoryview: um único memcpy para dentro do builder.
+
+    alignment (potência de 2) vale para o início dos dados no arquivo final: o Finish alinha o
+    tamanho total ao maior Prep, então alinhar a distância até o fim basta. Devolve (offset, padding).
+    """
+    builder.assertNotNested()
+    builder.nested = True
+    n = len(view)
+    start = builder.Offset()
+    builder.Prep(max(alignment, 4), n)
+    padding = builder.Offset() - start
+    builder.head = builder.Head() - n
+    builder.Bytes[builder.Head():builder.Head() + n] = view
+    builder.vectorNumElems = n
+    return builder.EndVector(), padding
+
+
+def create_buffer(builder, raw_bytes, alignment=4, stats=None):
+    # stats (dict), if given, accumulates "padding" bytes spent on alignment
+    if not raw_bytes:
+        tflite.Buffer.BufferStart(builder)
+        return tflite.Buffer.BufferEnd(builder)
+    off, padding = create_byte_vector(builder, raw_bytes, alignment)
+    if stats is not None:
+        stats["padding"] = stats.get("padding", 0) + padding
+    tflite.Buffer.BufferStart(builder)
+    tflite.Buffer.BufferAddData(builder, off)
+    return tflite.Buffer.BufferEnd(builder)
+
+
+def create_external_buffer(builder, size):
+    tflite.Buffer.BufferStart(builder)
+    # placeholder: the real file offset is only known once the flatbuffer is finished
+    tflite.Buffer.BufferAddOffset(builder, 1)
+    tflite.Buffer.BufferAddSize(builder, size)
+    return tflite.Buffer.BufferEnd(builder)
+
+
+def write_builder(builder, path, external=(), alignment=EXTERNAL_ALIGNMENT):
+    # write straight from the builder's backing bytearray instead of copying it with Output();
+    # external buffers follow the flatbuffer, aligned, and get their placeholder Buffer.offset patched.
+    # Returns the padding inserted before the external buffers.
+    fb = memoryview(builder.Bytes)[builder.Head():]
+    layout = []
+    pos = len(fb)
+    padding = 0
+    for buf_off, view in external:
+        pad = -pos % alignment
+        padding += pad
+        pos += pad
+        tab = flatbuffers.table.Table(fb, len(fb) - buf_off)
+        struct.pack_into("<Q", fb, tab.Pos + tab.Offset(BUFFER_VT_OFFSET), pos)
+        layout.append((pos, view))
+        pos += len(view)
+    with open(path, "wb") as f:
+        f.write(fb)
+        for pos, view in layout:
+            f.write(b"\0" * (pos - f.tell()))
+            f.write(view)
+    return padding
@@ -0,0 +1,243 @@
+import math
+
+import numpy as np
+
+from bindings import tfl as tflite
+
+# TensorType values of the constant tensors read here (shape, axes, perm, paddings)
+INT_TYPES = {2: np.int32, 4: np.int64}
+PADDING_SAME = 0
+
+UNARY = {"ABS", "CAST", "CEIL", "COS", "DEQUANTIZE", "ELU", "EXP", "FLOOR", "GELU", "HARD_SWISH",
+         "L2_NORMALIZATION", "LEAKY_RELU", "LOCAL_RESPONSE_NORMALIZATION", "LOG", "LOG_SOFTMAX", "LOGICAL_NOT",
+         "LOGISTIC", "NEG", "ONES_LIKE", "QUANTIZE", "RELU", "RELU6", "RELU_0_TO_1", "RELU_N1_TO_1", "ROUND",
+         "RSQRT", "SIGN", "SIN", "SOFTMAX", "SQRT", "SQUARE", "TANH", "ZEROS_LIKE"}
+BROADCAST = {"ADD", "DIV", "EQUAL", "FLOOR_DIV", "FLOOR_MOD", "GREATER", "GREATER_EQUAL", "LESS", "LESS_EQUAL",
+             "LOGICAL_AND", "LOGICAL_OR", "MAXIMUM", "MINIMUM", "MUL", "NOT_EQUAL", "POW", "PRELU",
+             "SQUARED_DIFFERENCE", "SUB"}
+REDUCERS = {"MEAN", "REDUCE_ANY", "REDUCE_MAX", "REDUCE_MIN", "REDUCE_PROD", "SUM"}
+# ops whose second input is a constant read by the rules below (target shape, perm, paddings, axis/axes)
+CONST_INPUT_OPS = {"RESHAPE", "TRANSPOSE", "PAD", "PADV2", "EXPAND_DIMS"} | REDUCERS
+
+
+def builtin_names():
+    enum = getattr(tflite, "BuiltinOperator")
+    enum = getattr(enum, "BuiltinOperator", enum)
+    return {v: k for k, v in vars(enum).items() if not k.startswith("_") and isinstance(v, int)}
+
+
+def read_options(op, cls_name):
+    table = op.BuiltinOptions()
+    if not table:
+        return None
+    cls = getattr(tflite, cls_name)
+    obj = getattr(cls, cls_name, cls)()
+    # older bindings return the table offset instead of a flatbuffers Table
+    if hasattr(table, "Pos"):
+        obj.Init(table.Bytes, table.Pos)
+    else:
+        obj.Init(op._tab.Bytes, table)
+    return obj
+
+
+def shape_buffers(ir, sg_i=None):
+    """Índices dos buffers lidos como constantes pela inferência (de um subgraph ou de todos):
+    mudar um deles pode mudar as shapes."""
+    names = builtin_names()
+    op_names = [names.get(int(code)) for code in ir.opcode_builtin]
+    found = set()
+    for g in ir.subgraphs if sg_i is None else [ir.subgraphs[sg_i]]:
+        for op_i in range(g.num_operators):
+            code = g.op_opcode[op_i]
+            if code >= len(op_names) or op_names[code] not in CONST_INPUT_OPS:
+                continue
+            ins = g.op_input(op_i)
+            if len(ins) > 1 and ins[1] >= 0:
+                found.add(int(g.tensor_buffer[ins[1]]))
+    return found
+
+
+# Dims are tuples; -1 is an unknown (dynamic) size and poisons every product/sum it enters.
+
+def dim_prod(dims):
+    return -1 if any(d < 0 for d in dims) else math.prod(dims)
+
+
+def broadcast(a, b):
+    out = []
+    for x, y in zip((1,) * (len(b) - len(a)) + a, (1,) * (len(a) - len(b)) + b):
+        if x == 1 or x == y:
+            out.append(y)
+        elif y == 1:
+            out.append(x)
+        elif x < 0 or y < 0:
+            out.append(max(x, y))
+        else:
+            raise ValueError("shapes don't broadcast")
+    return tuple(out)
+
+
+def window(size, kernel, stride, dilation, padding):
+    if size < 0:
+        return -1
+    if padding == PADDING_SAME:
+        return (size + stride - 1) // stride
+    return (size - (kernel - 1) * dilation + stride - 1) // stride
+
+
+def normalize_axes(axes, rank):
+    return sorted({int(a) + rank if a < 0 else int(a) for a in axes})
+
+
+class ShapeInference:
+    """Propaga shapes estáticas (e shape_signature) pela lista de operadores de um subgraph.
+
+    Os operadores do TFLite já vêm em ordem topológica, então uma passada basta. Cada regra
+    recebe as dims das entradas e devolve as da saída 0; operador sem regra (ou cuja regra
+    falha) mantém as shapes declaradas. keep_num_dims força a semântica keep_num_dims=1 em
+    todo FULLY_CONNECTED, como depois do KeepNumDims.
+    """
+
+    def __init__(self, data, model, ir, keep_num_dims=False):
+        self.data = data
+        self.model = model
+        self.ir = ir
+        self.keep_num_dims = keep_num_dims
+        names = builtin_names()
+        self.op_names = [names.get(int(code)) for code in ir.opcode_builtin]
+        self.rules = {"FULLY_CONNECTED": self.fully_connected, "RESHAPE": self.reshape,
+                      "CONV_2D": self.conv_2d, "DEPTHWISE_CONV_2D": self.depthwise_conv_2d,
+                      "AVERAGE_POOL_2D": self.pool_2d, "MAX_POOL_2D": self.pool_2d, "L2_POOL_2D": self.pool_2d,
+                      "CONCATENATION": self.concatenation, "TRANSPOSE": self.transpose, "PAD": self.pad,
+                      "PADV2": self.pad, "SQUEEZE": self.squeeze, "EXPAND_DIMS": self.expand_dims}
+
+    def const(self, t):
+        # values of a constant int tensor, or None
+        g = self.graph
+        pos, size = self.ir.buffer_data_pos[g.tensor_buffer[t]], self.ir.buffer_data_size[g.tensor_buffer[t]]
+        dtype = INT_TYPES.get(int(g.tensor_type[t]))
+        if pos < 0 or dtype is None:
+            return None
+        return np.frombuffer(self.data, dtype=np.dtype(dtype).newbyteorder("<"),
+                             count=size // np.dtype(dtype).itemsize, offset=pos)
+
+    def infer(self, sg_i):
+        """{tensor: (shape, shape_signature)} dos tensores cuja shape a propagação mudou."""
+        g = self.graph = self.ir.subgraphs[sg_i]
+        sg = self.model.Subgraphs(sg_i)
+        shapes = [tuple(g.shape(t).tolist()) for t in range(g.num_tensors)]
+        signatures = list(shapes)
+        for t in range(g.num_tensors):
+            sig = sg.Tensors(t).ShapeSignatureAsNumpy()
+            if not isinstance(sig, int) and len(sig) == len(shapes[t]):
+                signatures[t] = tuple(sig.tolist())
+        declared = list(zip(shapes, signatures))
+        for op_i in range(g.num_operators):
+            name = self.op_names[g.op_opcode[op_i]] if g.op_opcode[op_i] < len(self.op_names) else None
+            outs = g.op_output(op_i)
+            rule = self.rules.get(name) or (self.same if name in UNARY else None) or \
+                (self.broadcast if name in BROADCAST else None) or (self.reduce if name in REDUCERS else None)
+            if rule is None or len(outs) == 0 or outs[0] < 0:
+                continue
+            ins = g.op_input(op_i).tolist()
+            op = sg.Operators(op_i)
+            try:
+                shape = rule(op, ins, [shapes[t] if t >= 0 else None for t in ins])
+                signature = rule(op, ins, [signatures[t] if t >= 0 else None for t in ins])
+            except (AttributeError, IndexError, TypeError, ValueError, ZeroDivisionError):
+                continue
+            if shape is None or signature is None or len(shape) != len(signature) or min(shape, default=0) < 0:
+                continue
+            shapes[outs[0]], signatures[outs[0]] = shape, signature
+        return {t: (shapes[t], signatures[t]) for t in range(g.num_tensors)
+                if (shapes[t], signatures[t]) != declared[t]}
+
+    def same(self, op, ins, dims):
+        return dims[0]
+
+    def broadcast(self, op, ins, dims):
+        return broadcast(dims[0], dims[1]) if len(dims) > 1 else dims[0]
+
+    def fully_connected(self, op, ins, dims):
+        x, w = dims[0], dims[1]
+        if len(w) != 2:
+            return None
+        options = read_options(op, "FullyConnectedOptions")
+        if self.keep_num_dims or (options is not None and options.KeepNumDims()):
+            return x[:-1] + (w[0],)
+        n = dim_prod(x)
+        return (n // w[1] if n >= 0 else -1, w[0])
+
+    def reshape(self, op, ins, dims):
+        target = self.const(ins[1]) if len(ins) > 1 and ins[1] >= 0 else None
+        if target is None:
+            options = read_options(op, "ReshapeOptions")
+            target = options.NewShapeAsNumpy() if options is not None else 0
+            if isinstance(target, int):
+                return None
+        target = [int(d) for d in target]
+        total = dim_prod(dims[0])
+        if target.count(-1) == 1 and total >= 0:
+            known = math.prod(d for d in target if d != -1)
+            target[target.index(-1)] = total // known
+        return tuple(target)
+
+    def conv_2d(self, op, ins, dims, depthwise=False):
+        x, f = dims[0], dims[1]
+        o = read_options(op, "DepthwiseConv2DOptions" if depthwise else "Conv2DOptions")
+        return (x[0], window(x[1], f[1], o.StrideH(), o.DilationHFactor(), o.Padding()),
+                window(x[2], f[2], o.StrideW(), o.DilationWFactor(), o.Padding()), f[3] if depthwise else f[0])
+
+    def depthwise_conv_2d(self, op, ins, dims):
+        return self.conv_2d(op, ins, dims, depthwise=True)
+
+    def pool_2d(self, op, ins, dims):
+        x = dims[0]
+        o = read_options(op, "Pool2DOptions")
+        return (x[0], window(x[1], o.FilterHeight(), o.StrideH(), 1, o.Padding()),
+                window(x[2], o.FilterWidth(), o.StrideW(), 1, o.Padding()), x[3])
+
+    def concatenation(self, op, ins, dims):
+        axis = read_options(op, "ConcatenationOptions").Axis()
+        axis += len(dims[0]) if axis < 0 else 0
+        sizes = [d[axis] for d in dims]
+        return dims[0][:axis] + (-1 if min(sizes) < 0 else sum(sizes),) + dims[0][axis + 1:]
+
+    def transpose(self, op, ins, dims):
+        perm = self.const(ins[1])
+        return tuple(dims[0][int(p)] for p in perm) if perm is not None else None
+
+    def pad(self, op, ins, dims):
+        paddings = self.const(ins[1])
+        if paddings is None:
+            return None
+        paddings = paddings.reshape(len(dims[0]), 2)
+        return tuple(d + int(p.sum()) if d >= 0 else -1 for d, p in zip(dims[0], paddings))
+
+    def squeeze(self, op, ins, dims):
+        options = read_options(op, "SqueezeOptions")
+        axes = options.SqueezeDimsAsNumpy() if options is not None else 0
+        if isinstance(axes, int) or len(axes) == 0:
+            if min(dims[0], default=0) < 0:
+                return None
+            return tuple(d for d in dims[0] if d != 1)
+        axes = normalize_axes(axes, len(dims[0]))
+        return tuple(d for i, d in enumerate(dims[0]) if i not in axes)
+
+    def expand_dims(self, op, ins, dims):
+        axis = self.const(ins[1])
+        if axis is None:
+            return None
+        axis = int(axis[0])
+        axis += len(dims[0]) + 1 if axis < 0 else 0
+        return dims[0][:axis] + (1,) + dims[0][axis:]
+
+    def reduce(self, op, ins, dims):
+        axes = self.const(ins[1])
+        if axes is None:
+            return None
+        axes = normalize_axes(axes, len(dims[0]))
+        options = read_options(op, "ReducerOptions")
+        if options is not None and options.KeepDims():
+            return tuple(1 if i in axes else d for i, d in enumerate(dims[0]))
+        return tuple(d for i, d in enumerate(dims[0]) if i not in axes)
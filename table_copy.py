@@ -0,0 +1,279 @@
+import hashlib
+import inspect
+import re
+import struct
+
+import bindings
+
+SLOT_RE = re.compile(r"builder\.Prepend(\w+)Slot\((\d+),")
+START_VECTOR_RE = re.compile(r"StartVector\((\d+), numElems, (\d+)\)")
+IMPORT_RE = re.compile(r"from tflite\.(\w+) import")
+# unions whose enum is not named after the field
+UNION_ENUMS = {"Details": "QuantizationDetails", "ArraySegments": "SparseIndexVector",
+               "ArrayIndices": "SparseIndexVector"}
+
+# class name -> (number of slots known to the bindings, {vtable offset: offset field spec}) or None
+LAYOUTS = {}
+UNION_MEMBERS = {}
+
+
+def table_layout(cls_name):
+    """Descobre, pelos bindings gerados, quais campos de uma tabela são offsets e para onde apontam.
+
+    Campos escalares e structs não aparecem: ficam inline e são copiados como bytes.
+    Devolve None se a classe não existir ou tiver algum campo que não sabemos copiar.
+    """
+    if cls_name in LAYOUTS:
+        return LAYOUTS[cls_name]
+    saved = bindings.cached("layouts", cls_name)
+    if saved is not None:
+        # persisted across runs by bindings: [n_slots, {vt offset: spec}] or [] for "can't copy"
+        layout = (saved[0], {int(k): tuple(v) for k, v in saved[1].items()}) if saved else None
+        LAYOUTS[cls_name] = layout
+        return layout
+    layout = None
+    try:
+        mod = bindings.tfl.module(cls_name)
+        cls = getattr(mod, cls_name)
+        prefix = cls_name + "Add"
+        n_slots = 0
+        fields = {}
+        for fn_name, fn in vars(mod).items():
+            if not fn_name.startswith(prefix) or not callable(fn):
+                continue
+            m = SLOT_RE.search(inspect.getsource(fn))
+            if not m:
+                continue
+            slot = int(m.group(2))
+            n_slots = max(n_slots, slot + 1)
+            if m.group(1) != "UOffsetTRelative":
+                continue
+            field = fn_name[len(prefix):]
+            accessor = inspect.getsource(getattr(cls, field))
+            child = IMPORT_RE.search(accessor)
+            start_vector = getattr(mod, "%sStart%sVector" % (cls_name, field), None)
+            if ".Union(" in accessor:
+                spec = ("union", UNION_ENUMS.get(field, field), 2 + 2 * slot)
+            elif start_vector is not None:
+                if ".String(" in accessor:
+                    spec = ("vector_string",)
+                elif child:
+                    spec = ("vector_table", child.group(1))
+                else:
+                    elem, align = START_VECTOR_RE.search(inspect.getsource(start_vector)).groups()
+                    spec = ("vector", int(elem), int(align))
+            elif ".String(" in accessor:
+                spec = ("string",)
+            elif child:
+                spec = ("table", child.group(1))
+            else:
+                raise ValueError("unknown offset field %s.%s" % (cls_name, field))
+            fields[4 + 2 * slot] = spec
+        layout = (n_slots, fields)
+    except (ImportError, AttributeError, OSError, TypeError, ValueError):
+        layout = None
+    LAYOUTS[cls_name] = layout
+    bindings.store("layouts", cls_name, list(layout) if layout else [])
+    return layout
+
+
+def union_member(enum_name, value):
+    if enum_name not in UNION_MEMBERS:
+        saved = bindings.cached("unions", enum_name)
+        if saved is not None:
+            UNION_MEMBERS[enum_name] = {int(k): v for k, v in saved.items()}
+        else:
+            try:
+                enum = bindings.tfl.module(enum_name)
+                enum = getattr(enum, enum_name)
+                UNION_MEMBERS[enum_name] = {v: k for k, v in vars(enum).items() if isinstance(v, int)}
+            except (ImportError, AttributeError):
+                UNION_MEMBERS[enum_name] = {}
+            bindings.store("unions", enum_name, UNION_MEMBERS[enum_name])
+    return UNION_MEMBERS[enum_name].get(value)
+
+
+def table_digest(data, cls_name, pos):
+    """Hash da subárvore da tabela, igual para conteúdo igual em qualquer posição do arquivo.
+
+    Os uoffsets (que mudam com a posição) entram como o hash do filho; None se não der.
+    """
+    layout = table_layout(cls_name)
+    if layout is None:
+        return None
+    n_slots, fields = layout
+    vt = pos - struct.unpack_from("<i", data, pos)[0]
+    vt_size, tbl_size = struct.unpack_from("<HH", data, vt)
+    h = hashlib.blake2b(bytes(data[vt:vt + vt_size]), digest_size=16)
+    inline = bytearray(data[pos + 4:pos + tbl_size])
+    for vt_off in range(4, vt_size, 2):
+        fo = struct.unpack_from("<H", data, vt + vt_off)[0]
+        spec = fields.get(vt_off)
+        if not fo or spec is None:
+            continue
+        inline[fo - 4:fo] = bytes(4)
+        target = pos + fo + struct.unpack_from("<I", data, pos + fo)[0]
+        child = child_digest(data, spec, target, pos, vt, vt_size)
+        if child is None:
+            return None
+        h.update(child)
+    h.update(inline)
+    return h.digest()
+
+
+def child_digest(data, spec, target, parent_pos, parent_vt, parent_vt_size):
+    kind = spec[0]
+    n = struct.unpack_from("<I", data, target)[0]
+    if kind == "table":
+        return table_digest(data, spec[1], target)
+    if kind == "string":
+        return hashlib.blake2b(data[target:target + 4 + n], digest_size=16).digest()
+    if kind == "vector":
+        return hashlib.blake2b(data[target:target + 4 + n * spec[1]], digest_size=16).digest()
+    if kind == "union":
+        _, enum_name, type_vt = spec
+        fo = struct.unpack_from("<H", data, parent_vt + type_vt)[0] if type_vt < parent_vt_size else 0
+        member = union_member(enum_name, data[parent_pos + fo] if fo else 0)
+        return table_digest(data, member, target) if member else None
+    h = hashlib.blake2b(struct.pack("<I", n), digest_size=16)
+    for i in range(n):
+        elem = target + 4 + 4 * i
+        elem += struct.unpack_from("<I", data, elem)[0]
+        if kind == "vector_string":
+            d = hashlib.blake2b(data[elem:elem + 4 + struct.unpack_from("<I", data, elem)[0]], digest_size=16).digest()
+        else:
+            d = table_digest(data, spec[1], elem)
+            if d is None:
+                return None
+        h.update(d)
+    return h.digest()
+
+
+class TableCopier:
+    """Copia subárvores do modelo original para um builder sem decodificar campo a campo.
+
+    Os bytes inline de cada tabela vão num único memcpy (alinhados como no original) e só
+    os uoffsets e o soffset do vtable são corrigidos; vetores escalares também são copiados
+    em bloco. Vtables idênticos são escritos uma vez só.
+    """
+
+    def __init__(self, builder, data):
+        self.builder = builder
+        self.data = data
+        self.vtables = {}
+
+    def u16(self, pos):
+        return struct.unpack_from("<H", self.data, pos)[0]
+
+    def u32(self, pos):
+        return struct.unpack_from("<I", self.data, pos)[0]
+
+    def copy(self, cls_name, pos, overrides=None, drop=()):
+        """Copia a tabela cls_name em pos; devolve o offset no builder ou None se não der.
+
+        overrides: {offset no vtable: (formato struct, valor)} para trocar escalares presentes.
+        drop: offsets no vtable de campos a omitir na cópia (ficam ausentes, com o valor default).
+        """
+        layout = table_layout(cls_name)
+        if layout is None:
+            return None
+        n_slots, fields = layout
+        data = self.data
+        vt = pos - struct.unpack_from("<i", data, pos)[0]
+        vt_size, tbl_size = self.u16(vt), self.u16(vt + 2)
+        children = []
+        dropped = []
+        for vt_off in range(4, vt_size, 2):
+            fo = self.u16(vt + vt_off)
+            if not fo:
+                continue
+            if (vt_off - 4) // 2 >= n_slots:
+                return None
+            if vt_off in drop:
+                dropped.append((vt_off, fo))
+                continue
+            spec = fields.get(vt_off)
+            if spec is None:
+                continue
+            child = self.copy_child(spec, pos + fo + self.u32(pos + fo), pos, vt, vt_size)
+            if child is None:
+                return None
+            children.append((fo, child))
+        patches = []
+        for vt_off, (fmt, value) in (overrides or {}).items():
+            fo = self.u16(vt + vt_off) if vt_off < vt_size else 0
+            if not fo:
+                if value:
+                    return None
+                continue
+            patches.append((fo, fmt, value))
+
+        b = self.builder
+        b.minalign = max(b.minalign, 8)
+        # keep the table start congruent to the original mod 8 so every inline field stays aligned
+        pad = -(b.Offset() + tbl_size + pos) % 8
+        b.Prep(1, pad + tbl_size)
+        b.Pad(pad)
+        b.head = b.Head() - tbl_size
+        b.Bytes[b.Head():b.Head() + tbl_size] = data[pos:pos + tbl_size]
+        table_off = b.Offset()
+        for fo, child in children:
+            struct.pack_into("<I", b.Bytes, b.Head() + fo, table_off - fo - child)
+        for fo, fmt, value in patches:
+            struct.pack_into(fmt, b.Bytes, b.Head() + fo, value)
+
+        key = bytes(data[vt:vt + vt_size])
+        if dropped:
+            vtable = bytearray(key)
+            for vt_off, fo in dropped:
+                struct.pack_into("<H", vtable, vt_off, 0)
+                if vt_off in fields:
+                    # no dangling uoffset left in the copied inline bytes
+                    struct.pack_into("<I", b.Bytes, b.Head() + fo, 0)
+            key = bytes(vtable)
+        vt_off = self.vtables.get(key)
+        if vt_off is None:
+            b.Prep(2, vt_size)
+            b.head = b.Head() - vt_size
+            b.Bytes[b.Head():b.Head() + vt_size] = key
+            vt_off = self.vtables[key] = b.Offset()
+        struct.pack_into("<i", b.Bytes, len(b.Bytes) - table_off, vt_off - table_off)
+        return table_off
+
+    def copy_child(self, spec, target, parent_pos, parent_vt, parent_vt_size):
+        b = self.builder
+        data = self.data
+        kind = spec[0]
+        if kind == "table":
+            return self.copy(spec[1], target)
+        if kind == "string":
+            n = self.u32(target)
+            return b.CreateSharedString(bytes(data[target + 4:target + 4 + n]))
+        if kind == "vector":
+            _, elem, align = spec
+            n = self.u32(target)
+            size = n * elem
+            b.StartVector(elem, n, align)
+            b.head = b.Head() - size
+            b.Bytes[b.Head():b.Head() + size] = data[target + 4:target + 4 + size]
+            return b.EndVector()
+        if kind == "union":
+            _, enum_name, type_vt = spec
+            fo = self.u16(parent_vt + type_vt) if type_vt < parent_vt_size else 0
+            member = union_member(enum_name, data[parent_pos + fo] if fo else 0)
+            return self.copy(member, target) if member else None
+        n = self.u32(target)
+        offs = []
+        for i in range(n):
+            elem = target + 4 + 4 * i
+            elem += self.u32(elem)
+            if kind == "vector_string":
+                offs.append(b.CreateSharedString(bytes(data[elem + 4:elem + 4 + self.u32(elem)])))
+            else:
+                offs.append(self.copy(spec[1], elem))
+                if offs[-1] is None:
+                    return None
+        b.StartVector(4, n, 4)
+        for off in reversed(offs):
+            b.PrependUOffsetTRelative(off)
+        return b.EndVector()
@@ -0,0 +1,154 @@
+import functools
+import os
+import sys
+
+import flatbuffers
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main6  # noqa: E402
+from bindings import tfl as tflite  # noqa: E402
+
+# BuiltinOperator / TensorType values used by the test models
+ADD, CONV_2D, FULLY_CONNECTED, MUL, RELU, RESHAPE, SUB = 0, 3, 9, 18, 19, 22, 41
+FLOAT32, INT32 = 0, 2
+
+
+def write_model(path, buffers, tensors, opcodes, operators, inputs, outputs):
+    """Grava um modelo de um subgraph com os emitters do main6.
+
+    buffers: bytes ou None (o buffer 0 é o vazio); tensors: (nome, shape, buffer, tipo);
+    opcodes: builtin codes; operators: (opcode, entradas, saídas, FullyConnectedOptions ou None),
+    com as options dadas como {"fused": ..., "keep": ...}.
+    """
+    b = flatbuffers.Builder(1024)
+    buffer_offs = [main6.create_buffer(b, v) for v in buffers]
+    opcode_offs = [main6.emit_opcode(b, {"builtin_code": code, "version": 1, "custom_code": None}) for code in opcodes]
+    tensor_offs = [main6.emit_tensor(b, {"name": name, "shape": np.array(shape, np.int32), "type": ttype,
+                                         "buffer": buf})
+                   for name, shape, buf, ttype in tensors]
+    _, options_fc = main6.fc_enums()
+    op_offs = []
+    for opcode, ins, outs, fc in operators:
+        values = [fc.get("fused", 0), 0, fc.get("keep", 0)] if fc is not None else None
+        options = functools.partial(main6.create_fc_options, values=values) if values else None
+        op_offs.append(main6.emit_operator(b, {"opcode_index": opcode, "inputs": ins, "outputs": outs,
+                                               "options_type": options_fc if options else 0, "options": options}))
+    tensors_vec = main6.create_offset_vector(b, tensor_offs)
+    ops_vec = main6.create_offset_vector(b, op_offs)
+    inputs_vec, outputs_vec = main6.vec_int(b, inputs), main6.vec_int(b, outputs)
+    name = b.CreateString("main")
+    S, M = tflite.SubGraph, tflite.Model
+    S.SubGraphStart(b)
+    S.SubGraphAddTensors(b, tensors_vec)
+    S.SubGraphAddInputs(b, inputs_vec)
+    S.SubGraphAddOutputs(b, outputs_vec)
+    S.SubGraphAddOperators(b, ops_vec)
+    S.SubGraphAddName(b, name)
+    sg = S.SubGraphEnd(b)
+    opcodes_vec = main6.create_offset_vector(b, opcode_offs)
+    subgraphs_vec = main6.create_offset_vector(b, [sg])
+    buffers_vec = main6.create_offset_vector(b, buffer_offs)
+    M.ModelStart(b)
+    M.ModelAddVersion(b, 3)
+    M.ModelAddOperatorCodes(b, opcodes_vec)
+    M.ModelAddSubgraphs(b, subgraphs_vec)
+    M.ModelAddBuffers(b, buffers_vec)
+    b.Finish(M.ModelEnd(b), b"TFL3")
+    with open(path, "wb") as f:
+        f.write(b.Output())
+    return str(path)
+
+
+def weights(*shape, seed=0):
+    return np.random.default_rng(seed).standard_normal(shape).astype(np.float32)
+
+
+def int32s(*values):
+    return np.array(values, np.int32).tobytes()
+
+
+@pytest.fixture
+def fc_model(tmp_path):
+    # x[1,2,8] -> FC0 (relu) -> FC1 -> ADD(f1, f1); keep_num_dims=0 everywhere
+    return write_model(
+        tmp_path / "fc.tflite",
+        [None, weights(4, 8).tobytes(), weights(4, 4, seed=1).tobytes()],
+        [("x", [1, 2, 8], 0, FLOAT32), ("w0", [4, 8], 1, FLOAT32), ("f0", [2, 4], 0, FLOAT32),
+         ("w1", [4, 4], 2, FLOAT32), ("f1", [2, 4], 0, FLOAT32), ("out", [2, 4], 0, FLOAT32)],
+        [FULLY_CONNECTED, ADD],
+        [(0, [0, 1, -1], [2], {"fused": 1}), (0, [2, 3, -1], [4], {}), (1, [4, 4], [5], None)],
+        [0], [5])
+
+
+@pytest.fixture
+def reshape_model(tmp_path):
+    # x[1,2,8] -> RESHAPE [2,8] -> FC (w 4x8) [2,4] -> RESHAPE [1,2,4] -> ADD(r, r)
+    # with keep_num_dims both RESHAPEs are redundant
+    return write_model(
+        tmp_path / "reshape.tflite",
+        [None, int32s(2, 8), weights(4, 8).tobytes(), int32s(1, 2, 4)],
+        [("x", [1, 2, 8], 0, FLOAT32), ("s0", [2], 1, INT32), ("flat", [2, 8], 0, FLOAT32),
+         ("w", [4, 8], 2, FLOAT32), ("y", [2, 4], 0, FLOAT32), ("s1", [3], 3, INT32),
+         ("r", [1, 2, 4], 0, FLOAT32), ("out", [1, 2, 4], 0, FLOAT32)],
+        [FULLY_CONNECTED, RESHAPE, ADD],
+        [(1, [0, 1], [2], None), (0, [2, 3, -1], [4], {}), (1, [4, 5], [6], None), (2, [6, 6], [7], None)],
+        [0], [7])
+
+
+@pytest.fixture
+def flatten_model(tmp_path):
+    # x[2,3,8] -> FC (w 16x8) -> y (declared [6,16]) -> RESHAPE [6,16] -> RELU -> output
+    # with keep_num_dims y is really [2,3,16]: the RESHAPE is a flatten, not an identity, and must stay
+    return write_model(
+        tmp_path / "flatten.tflite",
+        [None, weights(16, 8).tobytes(), int32s(6, 16)],
+        [("x", [2, 3, 8], 0, FLOAT32), ("w", [16, 8], 1, FLOAT32), ("y", [6, 16], 0, FLOAT32),
+         ("s", [2], 2, INT32), ("r", [6, 16], 0, FLOAT32), ("out", [6, 16], 0, FLOAT32)],
+        [FULLY_CONNECTED, RESHAPE, RELU],
+        [(0, [0, 1, -1], [2], {}), (1, [2, 3], [4], None), (2, [4], [5], None)],
+        [0], [5])
+
+
+@pytest.fixture
+def dead_model(tmp_path):
+    # x[1,8] -> FC(w0) -> ADD -> out; dead branch FC(x, w1) -> SUB; orphan tensor/buffer; unused MUL opcode
+    return write_model(
+        tmp_path / "dead.tflite",
+        [None, weights(256, 8).tobytes(), weights(4, 8, seed=1).tobytes(), weights(1024, seed=2).tobytes()],
+        [("x", [1, 8], 0, FLOAT32), ("w1", [256, 8], 1, FLOAT32), ("f1", [1, 256], 0, FLOAT32),
+         ("d", [1, 256], 0, FLOAT32), ("w0", [4, 8], 2, FLOAT32), ("f0", [1, 4], 0, FLOAT32),
+         ("out", [1, 4], 0, FLOAT32), ("orphan", [1024], 3, FLOAT32)],
+        [MUL, FULLY_CONNECTED, SUB, ADD],
+        [(1, [0, 1, -1], [2], {}), (2, [2, 2], [3], None), (1, [0, 4, -1], [5], {}), (3, [5, 5], [6], None)],
+        [0], [6])
+
+
+@pytest.fixture
+def run_model():
+    """Roda o modelo no interpretador do LiteRT com uma entrada fixa (pula o teste sem ele)."""
+    interpreter = pytest.importorskip("ai_edge_litert.interpreter")
+
+    def run(path):
+        it = interpreter.Interpreter(model_path=str(path))
+        it.allocate_tensors()
+        inp = it.get_input_details()[0]
+        it.set_tensor(inp["index"], np.random.default_rng(1).standard_normal(inp["shape"]).astype(np.float32))
+        it.invoke()
+        return it.get_tensor(it.get_output_details()[0]["index"])
+    return run
+
+
+def load(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    return data, main6.load_model(data)
+
+
+def op_codes(path):
+    # builtin code of every operator of subgraph 0, in order
+    _, model = load(path)
+    sg = model.Subgraphs(0)
+    return [model.OperatorCodes(sg.Operators(i).OpcodeIndex()).BuiltinCode() for i in range(sg.OperatorsLength())]
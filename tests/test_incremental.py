@@ -0,0 +1,70 @@
+import numpy as np
+
+import graph_ir
+import main6
+from conftest import ADD, FLOAT32, FULLY_CONNECTED, load, weights, write_model
+
+
+def with_buffer(src, dst, index, values):
+    # copy of src with buffer index overwritten in place (same size, same layout)
+    data = bytearray(load(src)[0])
+    pos = int(graph_ir.build_ir(bytes(data)).buffer_data_pos[index])
+    raw = values.tobytes()
+    data[pos:pos + len(raw)] = raw
+    dst.write_bytes(bytes(data))
+    return str(dst)
+
+
+def incremental_matches_full(tmp_path, prev_input, new_input, **options):
+    prev_output, full, inc = (str(tmp_path / name) for name in ("prev.tflite", "full.tflite", "inc.tflite"))
+    main6.inject_keepdims(prev_input, prev_output, **options)
+    main6.inject_keepdims(new_input, full, **options)
+    main6.incremental_keepdims(new_input, prev_input, prev_output, inc, **options)
+    return load(inc)[0] == load(full)[0]
+
+
+def test_weight_change_is_patched_in_place(fc_model, tmp_path, capsys):
+    changed = with_buffer(fc_model, tmp_path / "changed.tflite", 2, np.full((4, 4), 0.5, np.float32))
+    assert incremental_matches_full(tmp_path, fc_model, changed)
+    assert "1 of 3 buffers changed, patched" in capsys.readouterr().out
+
+
+def test_unchanged_input_is_a_copy(fc_model, tmp_path, capsys):
+    assert incremental_matches_full(tmp_path, fc_model, fc_model, infer_shapes=True)
+    assert "0 of 3 buffers changed, patched" in capsys.readouterr().out
+
+
+def test_shape_constant_change_rebuilds(reshape_model, tmp_path, capsys):
+    changed = with_buffer(reshape_model, tmp_path / "changed.tflite", 3, np.array([2, 1, 4], np.int32))
+    assert incremental_matches_full(tmp_path, reshape_model, changed, infer_shapes=True)
+    assert "buffer 3 feeds a shape input" in capsys.readouterr().out
+
+
+def test_shape_constant_change_is_patched_without_shape_passes(reshape_model, tmp_path, capsys):
+    changed = with_buffer(reshape_model, tmp_path / "changed.tflite", 3, np.array([2, 1, 4], np.int32))
+    assert incremental_matches_full(tmp_path, reshape_model, changed)
+    assert "patched" in capsys.readouterr().out
+
+
+def test_graph_change_reports_the_reason(fc_model, tmp_path, capsys):
+    # same tensors and weights as fc_model, FC1 now fused with RELU: nothing can be patched in place
+    changed = write_model(
+        tmp_path / "fused.tflite", [None, weights(4, 8).tobytes(), weights(4, 4, seed=1).tobytes()],
+        [("x", [1, 2, 8], 0, FLOAT32), ("w0", [4, 8], 1, FLOAT32), ("f0", [2, 4], 0, FLOAT32),
+         ("w1", [4, 4], 2, FLOAT32), ("f1", [2, 4], 0, FLOAT32), ("out", [2, 4], 0, FLOAT32)],
+        [FULLY_CONNECTED, ADD],
+        [(0, [0, 1, -1], [2], {"fused": 1}), (0, [2, 3, -1], [4], {"fused": 1}), (1, [4, 4], [5], None)],
+        [0], [5])
+    assert incremental_matches_full(tmp_path, fc_model, changed)
+    out = capsys.readouterr().out
+    assert "the graph or metadata changed, rebuilding" in out
+    assert "weights can't be patched" not in out
+
+
+def test_unpaired_tensors_report_the_reason(dead_model, tmp_path, capsys):
+    # fp16 adds a tensor per weight, so input and output tensors no longer pair one to one
+    prev_output, inc = str(tmp_path / "prev.tflite"), str(tmp_path / "inc.tflite")
+    main6.inject_keepdims(dead_model, prev_output, compress_weights="fp16")
+    changed = with_buffer(dead_model, tmp_path / "changed.tflite", 2, np.ones((4, 8), np.float32))
+    main6.incremental_keepdims(changed, dead_model, prev_output, inc, compress_weights="fp16")
+    assert "don't pair one to one" in capsys.readouterr().out
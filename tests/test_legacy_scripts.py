@@ -0,0 +1,46 @@
+import importlib
+
+import numpy as np
+import pytest
+
+import benchmark
+import main6
+from conftest import load
+
+# the older entry points, all reading and writing through model_io
+SCRIPTS = [("main", "main"), ("main2", "inject_keep_num_dims"), ("main3", "inject"), ("main5", "inject_keepdims")]
+
+
+@pytest.fixture(params=SCRIPTS, ids=[module for module, _ in SCRIPTS])
+def script(request):
+    module, func = request.param
+    return getattr(importlib.import_module(module), func)
+
+
+def test_output_is_valid(script, fc_model, tmp_path):
+    out = str(tmp_path / "out.tflite")
+    script(fc_model, out)
+    assert benchmark.check_output(fc_model, out) == []
+
+
+def test_external_weights_come_back_inline(script, fc_model, tmp_path):
+    external = str(tmp_path / "external.tflite")
+    main6.inject_keepdims(fc_model, external, external_threshold=64)
+    out = str(tmp_path / "out.tflite")
+    script(external, out)
+    assert benchmark.check_output(external, out) == []
+
+
+def test_quantization_is_carried(script, fc_model, tmp_path):
+    quantized = str(tmp_path / "int8.tflite")
+    main6.inject_keepdims(fc_model, quantized, compress_weights="int8")
+    out = str(tmp_path / "out.tflite")
+    script(quantized, out)
+    (_, src), (_, dst) = load(quantized), load(out)
+    for t in range(src.Subgraphs(0).TensorsLength()):
+        a, b = src.Subgraphs(0).Tensors(t).Quantization(), dst.Subgraphs(0).Tensors(t).Quantization()
+        assert (a is None) == (b is None)
+        if a is not None:
+            np.testing.assert_array_equal(a.ScaleAsNumpy(), b.ScaleAsNumpy())
+            np.testing.assert_array_equal(a.ZeroPointAsNumpy(), b.ZeroPointAsNumpy())
+            assert a.QuantizedDimension() == b.QuantizedDimension()
@@ -0,0 +1,79 @@
+import os
+
+import main6
+import model_cache
+
+
+class Rewrite:
+    # stands in for the rewrite: counts the calls and writes a marker derived from the input
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, input_path, output_path):
+        self.calls += 1
+        with open(input_path, "rb") as src, open(output_path, "wb") as dst:
+            dst.write(b"out:" + src.read())
+
+
+def write(path, data):
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_miss_then_hit(tmp_path):
+    src, out, cache = write(tmp_path / "in.tflite", b"model"), str(tmp_path / "out.tflite"), str(tmp_path / "cache")
+    rewrite = Rewrite()
+    assert not model_cache.cached_rewrite(rewrite, src, out, {"a": 1}, cache)
+    os.remove(out)
+    assert model_cache.cached_rewrite(rewrite, src, out, {"a": 1}, cache)
+    assert rewrite.calls == 1
+    assert (tmp_path / "out.tflite").read_bytes() == b"out:model"
+
+
+def test_config_or_input_change_misses(tmp_path):
+    src, out, cache = write(tmp_path / "in.tflite", b"model"), str(tmp_path / "out.tflite"), str(tmp_path / "cache")
+    rewrite = Rewrite()
+    model_cache.cached_rewrite(rewrite, src, out, {"a": 1}, cache)
+    assert not model_cache.cached_rewrite(rewrite, src, out, {"a": 2}, cache)
+    write(tmp_path / "in.tflite", b"other")
+    assert not model_cache.cached_rewrite(rewrite, src, out, {"a": 1}, cache)
+    assert rewrite.calls == 3
+    assert (tmp_path / "out.tflite").read_bytes() == b"out:other"
+
+
+def test_linked_hit_is_not_overwritten_by_a_later_miss(tmp_path):
+    src, out, cache = write(tmp_path / "in.tflite", b"model"), str(tmp_path / "out.tflite"), str(tmp_path / "cache")
+    rewrite = Rewrite()
+    model_cache.cached_rewrite(rewrite, src, out, {}, cache, link=True)
+    assert model_cache.cached_rewrite(rewrite, src, out, {}, cache, link=True)
+    entry = model_cache.entry_path(cache, model_cache.cache_key(src, {}))
+    assert os.path.samefile(out, entry)
+    write(tmp_path / "in.tflite", b"other")
+    model_cache.cached_rewrite(rewrite, src, out, {}, cache, link=True)
+    with open(entry, "rb") as f:
+        assert f.read() == b"out:model"
+
+
+def test_evict_keeps_the_most_recent(tmp_path):
+    cache = str(tmp_path / "cache")
+    rewrite = Rewrite()
+    paths = []
+    for i in range(3):
+        src = write(tmp_path / ("in%d.tflite" % i), b"x" * 100)
+        model_cache.cached_rewrite(rewrite, src, str(tmp_path / "out.tflite"), {"i": i}, cache)
+        entry = model_cache.entry_path(cache, model_cache.cache_key(src, {"i": i}))
+        os.utime(entry, (i, i))
+        paths.append(entry)
+    model_cache.evict(cache, 250)
+    assert [os.path.exists(p) for p in paths] == [False, True, True]
+
+
+def test_cache_config_tracks_output_options():
+    base = main6.cache_config()
+    assert main6.cache_config(remove_reshapes=True) != base
+    assert main6.cache_config(compress_weights="int8") != main6.cache_config(compress_weights="fp16")
+    # --patch never runs the rebuild passes, so they don't split its entries
+    assert main6.cache_config(patch=True, remove_dead=True) == main6.cache_config(patch=True)
+    # split subgraphs don't share strings/vtables with the rest, but the worker count doesn't matter
+    assert main6.cache_config(subgraph_workers=1) == base
+    assert main6.cache_config(subgraph_workers=2) == main6.cache_config(subgraph_workers=8) != base
@@ -0,0 +1,57 @@
+import flatbuffers
+import numpy as np
+
+import graph_ir
+import main6
+import table_copy
+from bindings import tfl as tflite
+from conftest import load
+
+
+def copy_model(data):
+    b = flatbuffers.Builder(1024)
+    off = table_copy.TableCopier(b, data).copy("Model", graph_ir.root_table(np.frombuffer(data, np.uint8)))
+    assert off is not None
+    b.Finish(off, b"TFL3")
+    return bytes(b.Output())
+
+
+def test_model_round_trip(fc_model, tmp_path, run_model):
+    data, _ = load(fc_model)
+    out = copy_model(data)
+    root = graph_ir.root_table(np.frombuffer(data, np.uint8))
+    assert table_copy.table_digest(out, "Model", graph_ir.root_table(np.frombuffer(out, np.uint8))) == \
+        table_copy.table_digest(data, "Model", root)
+    src, dst = graph_ir.build_ir(data), graph_ir.build_ir(out)
+    assert dst.opcode_builtin.tolist() == src.opcode_builtin.tolist()
+    for a, b in zip(src.subgraphs, dst.subgraphs):
+        assert a.num_tensors == b.num_tensors
+        assert all(a.shape(t).tolist() == b.shape(t).tolist() for t in range(a.num_tensors))
+        assert a.op_inputs.tolist() == b.op_inputs.tolist() and a.op_outputs.tolist() == b.op_outputs.tolist()
+    for i in range(src.num_buffers):
+        pa, sa = src.buffer_data_pos[i], src.buffer_data_size[i]
+        pb, sb = dst.buffer_data_pos[i], dst.buffer_data_size[i]
+        assert data[pa:pa + sa] == out[pb:pb + sb]
+    path = tmp_path / "copy.tflite"
+    path.write_bytes(out)
+    np.testing.assert_array_equal(run_model(path), run_model(fc_model))
+
+
+def test_copy_is_idempotent(fc_model):
+    # a copy of the copy is the same bytes: vtables and alignment settle after one pass
+    data, _ = load(fc_model)
+    once = copy_model(data)
+    assert copy_model(once) == once
+
+
+def test_overrides_and_drop(fc_model):
+    data, model = load(fc_model)
+    tensor = model.Subgraphs(0).Tensors(1)
+    b = flatbuffers.Builder(1024)
+    copier = table_copy.TableCopier(b, data)
+    off = copier.copy("Tensor", tensor._tab.Pos, {main6.TENSOR_VT_BUFFER: ("<I", 7)}, drop=(main6.TENSOR_VT_NAME,))
+    b.Finish(off)
+    copied = tflite.Tensor.Tensor.GetRootAsTensor(bytes(b.Output()), 0)
+    assert copied.Buffer() == 7
+    assert copied.Name() is None
+    assert copied.ShapeAsNumpy().tolist() == tensor.ShapeAsNumpy().tolist()
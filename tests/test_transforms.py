@@ -0,0 +1,126 @@
+import numpy as np
+import pytest
+
+import benchmark
+import graph_ir
+import main6
+import shape_infer
+import weight_compress
+from conftest import ADD, FULLY_CONNECTED, RESHAPE, load, op_codes
+
+DEQUANTIZE, INT8 = 6, 9
+
+
+def rewrite(src, tmp_path, name="out.tflite", **options):
+    out = str(tmp_path / name)
+    main6.inject_keepdims(src, out, **options)
+    return out
+
+
+def fc_options(path):
+    data, model = load(path)
+    sg = model.Subgraphs(0)
+    found = []
+    for i in range(sg.OperatorsLength()):
+        op = sg.Operators(i)
+        if model.OperatorCodes(op.OpcodeIndex()).BuiltinCode() == FULLY_CONNECTED:
+            table = op.BuiltinOptions()
+            options = main6.tflite.FullyConnectedOptions.FullyConnectedOptions()
+            options.Init(table.Bytes, table.Pos)
+            found.append((options.FusedActivationFunction(), options.KeepNumDims()))
+    return found
+
+
+def test_keep_num_dims(fc_model, tmp_path, run_model):
+    out = rewrite(fc_model, tmp_path)
+    assert benchmark.output_problems(load(fc_model)[0], load(out)[0]) == []
+    assert fc_options(out) == [(1, True), (0, True)]
+    np.testing.assert_allclose(run_model(out).reshape(-1), run_model(fc_model).reshape(-1), rtol=1e-6)
+
+
+def test_remove_reshapes(reshape_model, tmp_path, run_model):
+    out = rewrite(reshape_model, tmp_path, remove_reshapes=True)
+    assert op_codes(out) == [FULLY_CONNECTED, ADD]
+    np.testing.assert_allclose(run_model(out), run_model(reshape_model), rtol=1e-6)
+
+
+def test_remove_reshapes_keeps_flatten_after_keep_num_dims(flatten_model, tmp_path, run_model):
+    # declared shapes make the RESHAPE look like an identity; with keep_num_dims it is a flatten
+    plain = rewrite(flatten_model, tmp_path, "plain.tflite")
+    out = rewrite(flatten_model, tmp_path, remove_reshapes=True)
+    assert RESHAPE in op_codes(out)
+    expected = run_model(plain)
+    assert expected.shape == (6, 16)
+    np.testing.assert_allclose(run_model(out), expected, rtol=1e-6)
+
+
+def test_shape_inference(fc_model):
+    data, model = load(fc_model)
+    ir = graph_ir.build_ir(data)
+    inferred = shape_infer.ShapeInference(data, model, ir, keep_num_dims=True).infer(0)
+    assert {t: shape for t, (shape, _) in inferred.items()} == {2: (1, 2, 4), 4: (1, 2, 4), 5: (1, 2, 4)}
+    assert shape_infer.ShapeInference(data, model, ir).infer(0) == {}
+
+
+def test_infer_shapes_rewrites_declared_shapes(fc_model, tmp_path, run_model):
+    out = rewrite(fc_model, tmp_path, infer_shapes=True)
+    g = graph_ir.build_ir(load(out)[0]).subgraphs[0]
+    assert [g.shape(t).tolist() for t in (2, 4, 5)] == [[1, 2, 4]] * 3
+    assert run_model(out).shape == (1, 2, 4)
+
+
+def test_shape_buffers(reshape_model):
+    assert shape_infer.shape_buffers(graph_ir.build_ir(load(reshape_model)[0])) == {1, 3}
+
+
+def test_remove_dead(dead_model, tmp_path, run_model):
+    out = rewrite(dead_model, tmp_path, remove_dead=True)
+    ir = graph_ir.build_ir(load(out)[0])
+    assert op_codes(out) == [FULLY_CONNECTED, ADD]
+    assert ir.opcode_builtin.tolist() == [FULLY_CONNECTED, ADD]
+    assert ir.subgraphs[0].num_tensors == 4
+    assert ir.buffer_data_size.tolist() == [0, 4 * 8 * 4]
+    np.testing.assert_allclose(run_model(out), run_model(dead_model), rtol=1e-6)
+
+
+def test_remove_dead_drops_shape_buffers_of_removed_reshapes(reshape_model, tmp_path):
+    kept = rewrite(reshape_model, tmp_path, "kept.tflite", remove_reshapes=True)
+    out = rewrite(reshape_model, tmp_path, remove_reshapes=True, remove_dead=True)
+    assert graph_ir.build_ir(load(kept)[0]).num_buffers == 4
+    assert graph_ir.build_ir(load(out)[0]).buffer_data_size.tolist() == [0, 4 * 8 * 4]
+
+
+def test_compress_fp16(fc_model, tmp_path, run_model):
+    out = rewrite(fc_model, tmp_path, compress_weights="fp16")
+    ir = graph_ir.build_ir(load(out)[0])
+    assert DEQUANTIZE in ir.opcode_builtin.tolist()
+    assert sorted(ir.buffer_data_size.tolist()) == [0, 4 * 4 * 2, 4 * 8 * 2]
+    np.testing.assert_allclose(run_model(out).reshape(-1), run_model(fc_model).reshape(-1), atol=1e-2)
+
+
+def test_compress_int8(fc_model, tmp_path, run_model):
+    out = rewrite(fc_model, tmp_path, compress_weights="int8")
+    _, model = load(out)
+    sg = model.Subgraphs(0)
+    weights = [sg.Tensors(t) for t in (1, 3)]
+    assert [w.Type() for w in weights] == [INT8, INT8]
+    assert [w.Quantization().ScaleLength() for w in weights] == [4, 4]
+    expected = run_model(fc_model).reshape(-1)
+    np.testing.assert_allclose(run_model(out).reshape(-1), expected, atol=0.05 * np.abs(expected).max())
+
+
+def test_to_float16_saturates():
+    src = np.array([1.5, -1e6, 1e6, 0.0], np.float32)
+    out = np.frombuffer(weight_compress.to_float16(memoryview(src).cast("B")), "<f2")
+    assert out.tolist() == [1.5, -65504.0, 65504.0, 0.0]
+
+
+@pytest.mark.parametrize("shape, axis", [((4, 8), 0), ((3, 3, 2, 5), 3)])
+def test_quantize_int8_per_channel(shape, axis):
+    src = np.random.default_rng(0).standard_normal(shape).astype(np.float32)
+    raw, scales = weight_compress.quantize_int8(memoryview(src).cast("B"), shape, axis, chunk=7)
+    q = np.frombuffer(raw, np.int8).reshape(shape)
+    assert len(scales) == shape[axis]
+    assert np.abs(q).max(axis=tuple(i for i in range(len(shape)) if i != axis)).tolist() == [127] * shape[axis]
+    restored = q * scales.reshape([-1 if i == axis else 1 for i in range(len(shape))])
+    assert np.abs(restored - src).max() <= scales.max() / 2 + 1e-6
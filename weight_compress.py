@@ -0,0 +1,53 @@
+import numpy as np
+
+# elements converted per step: temporaries stay around CHUNK * 8 bytes whatever the buffer size
+CHUNK = 1 << 20
+FLOAT16_MAX = float(np.finfo(np.float16).max)
+# weight-only int8 is symmetric with the range [-127, 127], as the TFLite kernels expect
+INT8_MAX = 127
+
+
+def float32_view(view):
+    return np.frombuffer(view, dtype="<f4")
+
+
+def to_float16(view, chunk=CHUNK):
+    """Bytes float16 (little-endian) de um buffer float32; valores fora do alcance saturam em ±65504."""
+    src = float32_view(view)
+    out = np.empty(len(src), dtype="<f2")
+    for start in range(0, len(src), chunk):
+        part = src[start:start + chunk]
+        np.clip(part, -FLOAT16_MAX, FLOAT16_MAX, out=out[start:start + chunk], casting="same_kind")
+    return memoryview(out).cast("B")
+
+
+def channel_rows(src, shape, axis):
+    # (rows, channels) view when the channel is the last axis, else (channels, rest)
+    if axis == len(shape) - 1:
+        return src.reshape(-1, shape[axis]), 1
+    return src.reshape(shape[0], -1), 0
+
+
+def quantize_int8(view, shape, axis, chunk=CHUNK):
+    """Quantização int8 simétrica por canal (eixo axis, 0 ou o último) de um buffer float32.
+
+    Devolve (bytes int8, scales float32 por canal). Duas passadas em blocos de linhas: o
+    máximo absoluto de cada canal e depois a conversão, sem cópia float do buffer inteiro.
+    """
+    rows, channel_axis = channel_rows(float32_view(view), shape, axis)
+    step = max(1, chunk // max(1, rows.shape[1]))
+    absmax = np.zeros(shape[axis], dtype=np.float32)
+    for start in range(0, rows.shape[0], step):
+        part = np.abs(rows[start:start + step]).max(axis=1 - channel_axis, initial=0)
+        if channel_axis:
+            np.maximum(absmax, part, out=absmax)
+        else:
+            absmax[start:start + step] = part
+    scales = absmax / INT8_MAX
+    scales[scales == 0] = 1.0  # all-zero channel: any positive scale quantizes it to 0
+    out = np.empty(rows.shape, dtype=np.int8)
+    for start in range(0, rows.shape[0], step):
+        part = rows[start:start + step] / (scales if channel_axis else scales[start:start + step, None])
+        np.clip(np.rint(part, out=part), -INT8_MAX, INT8_MAX, out=part)
+        out[start:start + step] = part
+    return memoryview(out.reshape(-1)).cast("B"), scales